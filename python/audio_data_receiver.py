@@ -14,6 +14,8 @@ import struct
 from datetime import datetime
 from collections import defaultdict
 from config import MQTTConfig
+from profiling import ProfilerControl
+from topic_router import TopicRouter
 
 class AudioDataReceiver:
     """音訊資料接收器"""
@@ -23,6 +25,14 @@ class AudioDataReceiver:
         self.config = MQTTConfig()
         self.broker_host, self.broker_port = self.config.get_broker_info()
         
+        # 主題只在啟動時讀取並編譯一次
+        topics = self.config.get_topics()
+        self.audio_prefix = topics.get('audio_prefix', 'esp32/audio')
+        self.control_topic = f"{topics.get('control', 'esp32/control')}/server"
+        self.router = TopicRouter()
+        self.router.add(f"{self.audio_prefix}/info", self.handle_completion_message)
+        self.router.add(f"{self.audio_prefix}/{{timestamp:int}}/{{chunk_index:int}}", self.handle_audio_chunk)
+        
         # 音訊資料重組
         self.audio_chunks = defaultdict(dict)  # timestamp: {chunk_index: data}
         self.audio_headers = {}  # timestamp: header_info
@@ -38,6 +48,11 @@ class AudioDataReceiver:
         self.client.on_message = self.on_message
         self.connected = False
         
+        # 執行期剖析（esp32/control/server，見 profiling.py）
+        self.profiler = ProfilerControl(self.client.publish, "audio_receiver", self.control_topic,
+                                        self.config.get_server_config().get('profile_dir', 'profiles'))
+        self.router.add(self.control_topic, self.profiler.handle)
+        
         # 創建輸出目錄
         self.output_dir = "received_audio"
         os.makedirs(self.output_dir, exist_ok=True)
@@ -53,10 +68,9 @@ class AudioDataReceiver:
             print("✅ MQTT連接成功")
             
             # 訂閱音訊資料主題
-            topics = self.config.get_topics()
-            audio_prefix = topics.get('audio_prefix', 'esp32/audio')
-            client.subscribe(f"{audio_prefix}/+/+")  # 格式: <prefix>/timestamp/chunk_index
-            client.subscribe(f"{audio_prefix}/info")  # 訂閱資訊通知
+            client.subscribe(f"{self.audio_prefix}/+/+")  # 格式: <prefix>/timestamp/chunk_index
+            client.subscribe(f"{self.audio_prefix}/info")  # 訂閱資訊通知
+            client.subscribe(self.control_topic)  # 剖析控制指令
             
             print("📡 已訂閱音訊資料主題")
         else:
@@ -68,39 +82,23 @@ class AudioDataReceiver:
         payload = msg.payload
         
         try:
-            topics = self.config.get_topics()
-            audio_prefix = topics.get('audio_prefix', 'esp32/audio')
-            if topic == f"{audio_prefix}/info":
-                # 完成通知
-                self.handle_completion_message(payload)
-            elif topic.startswith(f"{audio_prefix}/"):
-                # 音訊資料塊
-                self.handle_audio_chunk(topic, payload)
+            # 完成通知 → handle_completion_message；音訊資料塊 → handle_audio_chunk
+            if not self.router.dispatch(topic, payload):
+                print(f"⚠️ 主題解析失敗: {topic}")
         except Exception as e:
             print(f"❌ 處理訊息時發生錯誤: {e}")
     
-    def handle_audio_chunk(self, topic, payload):
-        """處理音訊資料塊"""
-        # 解析主題格式: <audio_prefix>/timestamp/chunk_index（如 esp32/audio/1690000000000/12）
-        parts = topic.split('/')
-        # 預期 parts: [esp32, audio, timestamp, chunk_index]
-        if len(parts) >= 4:
-            try:
-                timestamp = int(parts[2])
-                chunk_index = int(parts[3])
-            except Exception:
-                print(f"⚠️ 主題解析失敗: {topic}")
-                return
-            
-            # 儲存音訊塊
-            if timestamp not in self.audio_chunks:
-                self.audio_chunks[timestamp] = {}
-                print(f"📦 開始接收時間戳 {timestamp} 的音訊資料")
-            
-            self.audio_chunks[timestamp][chunk_index] = payload
-            self.total_chunks_received += 1
+    def handle_audio_chunk(self, payload, timestamp, chunk_index):
+        """處理音訊資料塊（主題 <audio_prefix>/timestamp/chunk_index 已由 router 解析）"""
+        # 儲存音訊塊
+        if timestamp not in self.audio_chunks:
+            self.audio_chunks[timestamp] = {}
+            print(f"📦 開始接收時間戳 {timestamp} 的音訊資料")
+        
+        self.audio_chunks[timestamp][chunk_index] = payload
+        self.total_chunks_received += 1
 
-            print(f"📥 收到音訊塊: 時間戳={timestamp}, 塊={chunk_index}, 大小={len(payload)} 位元組")
+        print(f"📥 收到音訊塊: 時間戳={timestamp}, 塊={chunk_index}, 大小={len(payload)} 位元組")
     
     def handle_completion_message(self, payload):
         """處理完成通知訊息"""
@@ -239,6 +237,7 @@ class AudioDataReceiver:
     
     def disconnect(self):
         """斷開MQTT連接"""
+        self.profiler.shutdown()
         self.client.loop_stop()
         self.client.disconnect()
         print("🔌 MQTT連接已斷開")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨 session 微批次排程器
+- 收集所有裝置「已可決策」的 session，湊滿 max_batch 或最舊一筆等待超過 max_delay_ms 即送出
+- 模型對堆疊後的張量只跑一次前向傳遞，再逐筆回呼 on_result（由伺服器發佈到 esp32/infer/{device}）
+- 單筆最壞等待時間 = max_delay_ms + 一次批次推論時間，尾延遲有上界
+- 批次推論失敗時，改以各筆提交時附帶的 fallback 結果（例如能量規則）回呼，session 仍會回覆、緩衝區仍會釋放
+- ReplyCoalescer：同一裝置在 window_ms 內的多筆推論結果合併成一則回覆訊息（[server] reply_mode = coalesce）
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class MicroBatcher:
+    """以背景執行緒依「大小或期限」觸發的批次推論排程器。"""
+
+    def __init__(self, model, on_result, max_batch=8, max_delay_ms=5.0):
+        self.model = model
+        self.on_result = on_result
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max(0.0, float(max_delay_ms)) / 1000.0
+        self._pending = []  # [(key, feats, enqueue_time, fallback)]
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        # 統計
+        self.batches = 0
+        self.items = 0
+        self.errors = 0  # 推論失敗而改用 fallback 的批次數
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止排程器；尚在等待的項目會先全部送出。"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+    def submit(self, key, feats, fallback=None):
+        """加入一筆待推論的 session；key 會原樣交回 on_result。
+
+        fallback：批次推論失敗時改交給 on_result 的結果；None 時該筆只記錄錯誤，不回呼。
+        """
+        with self._cond:
+            self._pending.append((key, feats, time.monotonic(), fallback))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _take_batch(self):
+        """等待直到湊滿一批或最舊一筆到期；停止且無待處理項目時回傳 None。"""
+        with self._cond:
+            while not self._pending:
+                if not self._running:
+                    return None
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.max_delay
+            while self._running and len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                results = self.model.infer_batch([feats for _, feats, _, _ in batch])
+            except Exception as e:
+                print(f"⚠️ 批次推論錯誤（{len(batch)} 筆），改用 fallback 結果: {e}")
+                self.errors += 1
+                results = [fallback for _, _, _, fallback in batch]
+            self.batches += 1
+            self.items += len(batch)
+            for (key, _, _, _), result in zip(batch, results):
+                if result is None:
+                    continue
+                try:
+                    self.on_result(key, result)
+                except Exception as e:
+                    print(f"⚠️ 推論結果回呼錯誤 {key}: {e}")
+
+
+class ReplyCoalescer:
+    """依裝置合併推論結果：每台裝置第一筆結果起算 window_ms 後，把期間累積的結果一次送出。
+
+    publish(device, results) 由背景執行緒（或呼叫 flush_due 的一方）於鎖外呼叫。
+    所有裝置的期限都是「加入時間 + 固定視窗」，因此以 FIFO 佇列即為期限順序。
+    """
+
+    def __init__(self, publish, window_ms=20.0, max_items=32):
+        self.publish = publish
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_items = min(255, max(1, int(max_items)))
+        self._pending = {}     # device → [result, ...]
+        self._order = deque()  # (deadline, device, 該批 list)；已送出的批次仍留到期限才移除
+        self._count = 0        # _pending 中尚未送出的結果數
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        # 統計
+        self.messages = 0
+        self.items = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="reply-coalescer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止背景執行緒並送出所有等待中的結果。"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+        self.flush_due(float("inf"))
+
+    def pending(self) -> int:
+        """尚未送出的結果數（不含 _order 中已湊滿送出或已被取代的舊項目）。"""
+        return self._count
+
+    def submit(self, device, result):
+        full = None
+        with self._cond:
+            batch = self._pending.get(device)
+            if batch is None:
+                batch = self._pending[device] = [result]
+                self._order.append((time.monotonic() + self.window, device, batch))
+                if len(self._order) == 1:
+                    self._cond.notify()
+            else:
+                batch.append(result)
+            self._count += 1
+            if len(batch) >= self.max_items:
+                # 湊滿就先送；佇列中的舊項目於到期時因 list 已不同而略過
+                del self._pending[device]
+                self._count -= len(batch)
+                full = batch
+        if full is not None:
+            self._send(device, full)
+
+    def flush_due(self, now=None) -> int:
+        """送出已到期的裝置批次；回傳送出的訊息數。"""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._cond:
+            while self._order and self._order[0][0] <= now:
+                _, device, batch = self._order.popleft()
+                if self._pending.get(device) is batch:
+                    del self._pending[device]
+                    self._count -= len(batch)
+                    due.append((device, batch))
+        for device, batch in due:
+            self._send(device, batch)
+        return len(due)
+
+    def _send(self, device, batch):
+        try:
+            self.publish(device, batch)
+        except Exception as e:
+            print(f"⚠️ 合併回覆發佈錯誤 {device}: {e}")
+        self.messages += 1
+        self.items += len(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._order:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                delay = self._order[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+            self.flush_due()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 特徵伺服器壓測
+- 於暫存目錄產生 config.ini，啟動無介面 broker（mqtt_broker_core.py）與
+  feature_server_async.py 兩個子行程，本行程以 asyncio 模擬大量裝置
+- 每台裝置送出一個 session（frames 幀 Binary v1 特徵），統計回覆數、吞吐量與
+  最後一幀送出到收到回覆的延遲（P50/P99）
+
+用法：
+    python benchmarks/bench_async_server.py --devices 5000 --frames 6 --bins 40
+    python benchmarks/bench_async_server.py --server sync   # 改測 feature_server.py（paho）
+    python benchmarks/bench_async_server.py --instances 2   # 兩個伺服器以 $share 共享訂閱分擔
+"""
+
+import argparse
+import asyncio
+import configparser
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+from feature_codec import encode_binary_frame  # noqa: E402
+from feature_server_async import AsyncMQTTClient  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, port, args):
+    cfg = configparser.ConfigParser()
+    cfg['broker'] = {'custom_host': '127.0.0.1', 'custom_port': str(port), 'use_broker': 'custom'}
+    cfg['server'] = {
+        'frames_to_decide': str(args.frames),
+        'model': args.model,
+        'model_path': os.path.abspath(args.model_path) if args.model_path else '',
+        'batch_size': str(args.batch),
+        'workers': '0' if args.server == 'async' else str(args.workers),
+        'session_max': str(max(10000, args.devices * 2)),
+        'metrics_port': '0',
+        'log_messages': 'false',
+        'async_queue_size': str(args.queue),
+        'share_group': 'bench' if args.instances > 1 else '',
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        cfg.write(f)
+
+
+def start_process(script, cwd, ready_marker, extra=()):
+    """啟動子行程並等待 stdout 出現 ready_marker；之後於背景讀掉輸出避免管線塞滿。"""
+    proc = subprocess.Popen([sys.executable, "-u", os.path.join(ROOT, script), *extra], cwd=cwd,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    deadline = time.time() + 30
+    lines = []
+    while time.time() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            break
+        lines.append(line)
+        if ready_marker in line:
+            threading.Thread(target=lambda: [None for _ in proc.stdout], daemon=True).start()
+            return proc
+    proc.kill()
+    raise RuntimeError(f"{script} 未就緒：\n{''.join(lines)}")
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_load(port, args):
+    # 接收回覆
+    sub = AsyncMQTTClient(f"bench_sub_{os.getpid()}", keepalive=60)
+    await sub.connect("127.0.0.1", port)
+    sub.subscribe(["esp32/infer/#"])
+    await sub.drain()
+
+    last_sent = {}
+    latencies = []
+    replies = [0]
+    done = asyncio.Event()
+
+    async def collect():
+        prefix_len = len("esp32/infer/")
+        async for topic, _ in sub.messages():
+            replies[0] += 1
+            device = topic[prefix_len:]
+            t = last_sent.pop(device, None)
+            if t is not None:
+                latencies.append(time.perf_counter() - t)
+                if not last_sent and len(latencies) >= args.devices:
+                    done.set()
+
+    collector = asyncio.create_task(collect())
+    await asyncio.sleep(0.2)
+
+    # 發送端：多條連線分攤裝置
+    pubs = []
+    for i in range(args.connections):
+        c = AsyncMQTTClient(f"bench_pub_{os.getpid()}_{i}", keepalive=60)
+        await c.connect("127.0.0.1", port)
+        pubs.append(c)
+
+    devices = [f"dev{d:05d}" for d in range(args.devices)]
+    rng = random.Random(0)
+    raws = [bytes(rng.getrandbits(8) for _ in range(args.bins)) for _ in range(64)]
+    interval = 1.0 / args.rate if args.rate else 0.0
+
+    t0 = time.perf_counter()
+    sent = 0
+    for idx in range(args.frames):
+        for d, device in enumerate(devices):
+            body = encode_binary_frame(raws[(d + idx) % len(raws)], (1, args.bins), int(time.time() * 1000))
+            client = pubs[d % len(pubs)]
+            client.publish(f"esp32/feat/{device}/s0/{idx}", body)
+            if idx == args.frames - 1:
+                last_sent[device] = time.perf_counter()
+            sent += 1
+            if sent % 256 == 0:
+                await asyncio.gather(*(c.drain() for c in pubs))
+                if interval:
+                    lag = t0 + sent * interval - time.perf_counter()
+                    if lag > 0:
+                        await asyncio.sleep(lag)
+    await asyncio.gather(*(c.drain() for c in pubs))
+    t_sent = time.perf_counter() - t0
+
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    t_all = time.perf_counter() - t0
+    collector.cancel()
+    for c in pubs + [sub]:
+        await c.close()
+    return sent, t_sent, t_all, latencies, replies[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="asyncio 特徵伺服器壓測")
+    parser.add_argument("--devices", type=int, default=5000)
+    parser.add_argument("--frames", type=int, default=6, help="每個 session 的幀數（= frames_to_decide）")
+    parser.add_argument("--bins", type=int, default=40)
+    parser.add_argument("--connections", type=int, default=8, help="發送端連線數")
+    parser.add_argument("--rate", type=float, default=0, help="總發送速率（幀/秒，0 = 盡量快）")
+    parser.add_argument("--server", choices=("async", "sync"), default="async")
+    parser.add_argument("--workers", type=int, default=2, help="sync 伺服器的 worker 數")
+    parser.add_argument("--model", default="energy")
+    parser.add_argument("--model-path", default="")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--queue", type=int, default=1024, help="async_queue_size")
+    parser.add_argument("--instances", type=int, default=1, help="伺服器行程數（>1 時使用共享訂閱）")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_async_")
+    port = free_port()
+    write_config(os.path.join(workdir, "config.ini"), port, args)
+
+    broker = start_process("mqtt_broker_core.py", workdir, "監聽地址", ["--host", "127.0.0.1", "--port", str(port)])
+    script = "feature_server_async.py" if args.server == "async" else "feature_server.py"
+    servers = [start_process(script, workdir, "訂閱特徵主題") for _ in range(max(1, args.instances))]
+    try:
+        time.sleep(0.3)
+        sent, t_sent, t_all, lat, replies = asyncio.run(run_load(port, args))
+    finally:
+        for proc in servers + [broker]:
+            proc.terminate()
+        for proc in servers + [broker]:
+            proc.wait(10)
+
+    print(f"🏁 {args.server} × {len(servers)}: {args.devices} 台裝置 × {args.frames} 幀（bins={args.bins}，{args.connections} 條連線）")
+    print(f"📤 送出 {sent} 幀，耗時 {t_sent:.2f}s（{sent / t_sent:.0f} 幀/s）")
+    print(f"📥 回覆 {len(lat)}/{args.devices}（總回覆 {replies}，重複 {replies - len(lat)}），全部完成 {t_all:.2f}s（{len(lat) / t_all:.0f} session/s）")
+    print(f"⏱️ 最後一幀 → 回覆 P50={percentile(lat, 0.5) * 1000:.1f} ms  P99={percentile(lat, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
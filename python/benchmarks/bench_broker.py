@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MQTT broker 核心壓測（mqtt_broker_core.py 事件迴圈）
+- 啟動無介面 broker 子行程，本行程以 asyncio 建立大量連線
+- 閒置連線：--idle 條只送 CONNECT 的連線（模擬大量已連線但安靜的 ESP32），
+  回報建立速度、broker 的執行緒數與 RSS
+- 轉發（fan-out）：--subscribers 個訂閱者訂閱 bench/fan/#，一個發佈者送 --messages 則 --size 位元組的訊息，
+  回報發佈速率與每秒送達則數（訂閱者收到的總則數 / 時間）；閒置連線於轉發期間保持連線
+- payload 為隨機位元組（非 UTF-8），訂閱者逐則比對內容，確認 broker 以位元組原樣轉發
+- 慢速訂閱者：--slow 個同樣訂閱 bench/fan/# 但從不讀取的連線，驗證它們只會塞滿自己的輸出佇列
+  （依 broker 的 --overflow 丟棄、斷線或寫入暫存檔），不拖慢其他訂閱者
+
+用法：
+    python benchmarks/bench_broker.py --idle 10000
+    python benchmarks/bench_broker.py --idle 1000 --subscribers 200 --messages 2000 --size 256
+    python benchmarks/bench_broker.py --idle 0 --subscribers 50 --slow 5 --messages 20000 --size 4096 --overflow spill
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from bench_async_server import free_port, start_process  # noqa: E402
+from feature_server_async import AsyncMQTTClient  # noqa: E402
+
+
+def proc_status(pid):
+    """Linux：回傳 (執行緒數, RSS MB)；無 /proc 時回傳 (None, None)。"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+async def open_idle(port, count, concurrency):
+    """建立 count 條閒置連線（keepalive 0，不送 PINGREQ）。"""
+    clients = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            c = AsyncMQTTClient(f"idle_{i}", keepalive=0)
+            await c.connect("127.0.0.1", port)
+            clients.append(c)
+
+    results = await asyncio.gather(*(one(i) for i in range(count)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    return clients, errors
+
+
+async def fanout(port, args):
+    slow = []
+    for i in range(args.slow):
+        c = AsyncMQTTClient(f"fan_slow_{i}", keepalive=0)
+        await c.connect("127.0.0.1", port)
+        c.subscribe(["bench/fan/#"])
+        await c.drain()
+        slow.append(c)
+    subs = []
+    for i in range(args.subscribers):
+        c = AsyncMQTTClient(f"fan_sub_{i}", keepalive=0)
+        await c.connect("127.0.0.1", port)
+        c.subscribe(["bench/fan/#"])
+        await c.drain()
+        subs.append(c)
+    await asyncio.sleep(0.5)  # 等待 SUBACK
+
+    expected = args.messages
+    done = asyncio.Event()
+    received = [0]
+    corrupted = [0]
+    payload = os.urandom(args.size)
+
+    async def consume(c):
+        n = 0
+        async for _, body in c.messages():
+            n += 1
+            received[0] += 1
+            if body != payload:
+                corrupted[0] += 1
+            if n >= expected:
+                break
+        if received[0] >= expected * len(subs):
+            done.set()
+
+    tasks = [asyncio.create_task(consume(c)) for c in subs]
+    pub = AsyncMQTTClient("fan_pub", keepalive=0)
+    await pub.connect("127.0.0.1", port)
+    t0 = time.perf_counter()
+    for i in range(expected):
+        pub.publish(f"bench/fan/{i % 16}", payload)
+        if i % 64 == 63:
+            await pub.drain()
+    await pub.drain()
+    t_pub = time.perf_counter() - t0
+    try:
+        await asyncio.wait_for(done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - t0
+    for t in tasks:
+        t.cancel()
+    for c in subs + [pub]:
+        await c.close()
+    for c in slow:
+        c.writer.close()
+    return t_pub, elapsed, received[0], corrupted[0]
+
+
+async def run(port, broker_pid, args):
+    threads0, rss0 = proc_status(broker_pid)
+    t0 = time.perf_counter()
+    idle, errors = await open_idle(port, args.idle, args.concurrency)
+    dt = time.perf_counter() - t0
+    await asyncio.sleep(1.0)  # 等 broker 處理完最後一批 CONNECT
+    threads, rss = proc_status(broker_pid)
+    print(f"🔌 閒置連線 {len(idle)}/{args.idle}（失敗 {len(errors)}），{dt:.1f}s，{len(idle) / max(dt, 1e-9):.0f} 連線/s")
+    if errors:
+        print(f"   第一個錯誤: {errors[0]!r}")
+    if threads is not None:
+        print(f"🧵 broker 執行緒 {threads0} → {threads}，RSS {rss0:.1f} → {rss:.1f} MB"
+              f"（每條連線 {(rss - rss0) * 1024 / max(1, len(idle)):.1f} KB）")
+
+    if args.subscribers and args.messages:
+        t_pub, elapsed, received, corrupted = await fanout(port, args)
+        total = args.subscribers * args.messages
+        print(f"📤 fan-out：{args.messages} 則 × {args.subscribers} 訂閱者（{args.size} B），"
+              f"另有 {args.slow} 個不讀取的慢速訂閱者")
+        print(f"   發佈 {args.messages / t_pub:.0f} msg/s，送達 {received}/{total}，"
+              f"{received / elapsed:.0f} deliveries/s（{elapsed:.2f}s）")
+        if received < total:
+            print(f"⚠️ 未送達 {total - received} 則：訂閱者讀取跟不上時，broker 依 --overflow {args.overflow} 處理輸出佇列溢位")
+        if corrupted:
+            print(f"❌ {corrupted} 則 payload 與送出的內容不符")
+
+    for c in idle:
+        c.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT broker 核心壓測")
+    parser.add_argument("--idle", type=int, default=10000, help="閒置連線數")
+    parser.add_argument("--concurrency", type=int, default=500, help="同時進行中的 CONNECT 數")
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=128, help="payload 位元組數")
+    parser.add_argument("--slow", type=int, default=0, help="不讀取的慢速訂閱者數")
+    parser.add_argument("--overflow", default="drop_qos0", help="broker 輸出佇列滿時的處理方式")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    # 本行程同樣需要大量檔案描述符（Unix）
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    port = free_port()
+    broker = start_process("mqtt_broker_core.py", HERE, "監聽地址", ["--host", "127.0.0.1", "--port", str(port),
+                                                                      "--overflow", args.overflow])
+    try:
+        asyncio.run(run(port, broker.pid, args))
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+特徵 ingest 熱路徑基準（行程內，不經 socket）
+- 以假 MQTT client 建立 FeatureServer（workers=0），直接呼叫 _handle_feature；
+  session 湊滿時經 _reply_inference 決策並「發佈」到假 client
+- 測試矩陣：量化 u8/f32 × bins 40/64 × 每 session 幀數 6..100（Binary v1 或 JSON）
+- 每個組合回報：
+    fps            每秒處理幀數（含解碼、累積與決策）
+    p99_us         單次 _handle_feature 的 P99 延遲
+    p99_decide_us  觸發決策那一幀（含 _reply_inference）的 P99 延遲
+    decode_ns      _decode_feature_values 單獨的每幀時間
+    peak_b         tracemalloc：每幀處理期間的暫時配置峰值（位元組，平均）
+    retained_b     tracemalloc：整輪結束後每幀淨增加的記憶體（位元組）
+- 計時重複 --repeat 輪，fps 取最高、延遲取最低（同 bench_topic_router.py 的取最快）
+- --save 存成 JSON 基準；--compare 與既有基準比對，fps 下降或 P99 上升超過 --tolerance 時結束碼為 1
+  （共享 CPU 的虛擬機上單次量測可能有 ±20% 的雜訊，判定退步前請重跑確認）
+
+用法：
+    python benchmarks/bench_ingest.py --save baseline.json
+    python benchmarks/bench_ingest.py --compare baseline.json
+    python benchmarks/bench_ingest.py --quant u8 --bins 40 --frames 6,50 --model tinycnn --model-path m.npz
+"""
+
+import argparse
+import configparser
+import gc
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from feature_codec import decode_frame, encode_binary_frame  # noqa: E402
+from feature_simulator import encode_payload  # noqa: E402
+
+
+class FakeClient:
+    """只計數的 MQTT client。"""
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+
+
+def write_config(path, args):
+    cfg = configparser.ConfigParser()
+    cfg['server'] = {
+        'model': args.model,
+        'model_path': os.path.abspath(args.model_path) if args.model_path else '',
+        'batch_size': '1',
+        'workers': '0',
+        'session_max': '100000',
+        'session_max_rows': '256',
+        'metrics_port': '0',
+        'log_messages': 'false',
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        cfg.write(f)
+
+
+def make_payloads(quant, bins, wire, rng, count=64):
+    """預先產生 count 種單幀 payload，輪流使用。"""
+    out = []
+    for _ in range(count):
+        if quant == "u8":
+            raw = bytes(rng.getrandbits(8) for _ in range(bins))
+        else:
+            raw = struct.pack(f"<{bins}f", *(rng.random() for _ in range(bins)))
+        if wire == "bin":
+            out.append(encode_binary_frame(raw, (1, bins), int(time.time() * 1000), quant=quant))
+        else:
+            out.append(json.dumps(encode_payload(raw, (1, bins), quant=quant)).encode("utf-8"))
+    return out
+
+
+def make_schedule(frames, total, concurrent, tag):
+    """產生 (device, session, idx, 是否為決策幀)：每波 concurrent 個 session 交錯送幀。"""
+    sessions = max(1, total // frames)
+    out = []
+    for wave in range(0, sessions, concurrent):
+        group = [(f"dev{s % 1000:03d}", f"{tag}s{s}") for s in range(wave, min(sessions, wave + concurrent))]
+        for idx in range(frames):
+            for device, session in group:
+                out.append((device, session, idx, idx == frames - 1))
+    return out
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_case(srv, quant, bins, frames, args, rng):
+    srv.server_cfg['frames_to_decide'] = frames
+    payloads = make_payloads(quant, bins, args.wire, rng)
+    handle = srv._handle_feature
+    npay = len(payloads)
+    # session 名稱各組合各輪不同（已決策的 session 會被視為遲到幀）
+    case = f"{quant}{bins}x{frames}"
+
+    # 暖身（建立 FramePool 緩衝區、模型暫存等）
+    for i, (device, session, idx, _) in enumerate(make_schedule(frames, min(args.n, 2000), args.concurrent, f"{case}w")):
+        handle(payloads[i % npay], device, session, idx)
+
+    # 計時：重複 repeat 輪（每輪新的 session），取最佳值降低排程雜訊
+    clock = time.perf_counter_ns
+    best = None
+    for rep in range(args.repeat):
+        schedule = make_schedule(frames, args.n, args.concurrent, f"{case}t{rep}")
+        published = srv.client.published
+        lat = []
+        lat_decide = []
+        # 與 timeit 相同，計時期間停用 GC，避免偶發的完整回收混入延遲
+        gc.collect()
+        gc.disable()
+        t_start = clock()
+        for i, (device, session, idx, last) in enumerate(schedule):
+            t0 = clock()
+            handle(payloads[i % npay], device, session, idx)
+            dt = clock() - t0
+            lat.append(dt)
+            if last:
+                lat_decide.append(dt)
+        elapsed = (clock() - t_start) / 1e9
+        gc.enable()
+        r = {
+            "frames": len(lat),
+            "decisions": srv.client.published - published,
+            "fps": round(len(lat) / elapsed, 1),
+            "p50_us": round(percentile(lat, 0.5) / 1000, 2),
+            "p99_us": round(percentile(lat, 0.99) / 1000, 2),
+            "p99_decide_us": round(percentile(lat_decide, 0.99) / 1000, 2),
+        }
+        if best is None:
+            best = r
+        else:
+            best["fps"] = max(best["fps"], r["fps"])
+            for k in ("p50_us", "p99_us", "p99_decide_us"):
+                best[k] = min(best[k], r[k])
+
+    # 單獨量測解碼
+    metas = [decode_frame(p) for p in payloads]
+    decode = srv._decode_feature_values
+    reps = max(1, args.n // npay)
+    t0 = clock()
+    for _ in range(reps):
+        for meta, raw in metas:
+            decode(meta, raw)
+    decode_ns = (clock() - t0) / (reps * npay)
+
+    # 記憶體（另跑一輪；tracemalloc 會拖慢執行，不與計時混用）
+    schedule = make_schedule(frames, min(args.n, args.alloc_frames), args.concurrent, f"{case}m")
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    peak_sum = 0
+    for i, (device, session, idx, _) in enumerate(schedule):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        handle(payloads[i % npay], device, session, idx)
+        peak_sum += tracemalloc.get_traced_memory()[1] - before
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best.update({
+        "decode_ns": round(decode_ns, 1),
+        "peak_b": round(peak_sum / max(1, len(schedule)), 1),
+        "retained_b": round((end - base) / max(1, len(schedule)), 1),
+    })
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """逐項比對；回傳退步的組合數。"""
+    regressions = 0
+    print(f"\n📊 與基準比對（容許 {tolerance:.0%}）")
+    for name, cur in results.items():
+        old = baseline.get("cases", {}).get(name)
+        if old is None:
+            print(f"  {name:<18} （基準中無此組合）")
+            continue
+        fps = cur["fps"] / old["fps"] - 1 if old["fps"] else 0.0
+        p99 = cur["p99_us"] / old["p99_us"] - 1 if old["p99_us"] else 0.0
+        bad = fps < -tolerance or p99 > tolerance
+        regressions += bad
+        print(f"  {name:<18} fps {fps:+7.1%}  p99 {p99:+7.1%}  {'❌ 退步' if bad else '✅'}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="特徵 ingest 熱路徑基準")
+    parser.add_argument("--quant", default="u8,f32")
+    parser.add_argument("--bins", default="40,64")
+    parser.add_argument("--frames", default="6,25,50,100", help="每 session 幀數（= frames_to_decide）")
+    parser.add_argument("--wire", choices=("bin", "json"), default="bin")
+    parser.add_argument("-n", type=int, default=20000, help="每個組合處理的幀數")
+    parser.add_argument("--repeat", type=int, default=5, help="計時輪數（fps 取最高、延遲取最低）")
+    parser.add_argument("--concurrent", type=int, default=64, help="同時交錯送幀的 session 數")
+    parser.add_argument("--alloc-frames", type=int, default=5000, help="tracemalloc 量測的幀數")
+    parser.add_argument("--model", default="energy")
+    parser.add_argument("--model-path", default="")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="將結果存為 JSON 基準")
+    parser.add_argument("--compare", help="與 JSON 基準比對")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    # 於暫存目錄以專用設定建立伺服器，避免讀寫工作目錄的 config.ini
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    write_config(os.path.join(workdir, "config.ini"), args)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import feature_server
+        srv = feature_server.FeatureServer(client=FakeClient(), workers=0)
+    finally:
+        os.chdir(cwd)
+
+    rng = random.Random(args.seed)
+    results = {}
+    print(f"🏁 {args.wire} 格式，每組合 {args.n} 幀，{args.concurrent} 個 session 交錯，模型 {args.model}")
+    print(f"{'case':<18} {'fps':>10} {'p50_us':>8} {'p99_us':>8} {'p99_dec':>8} {'dec_ns':>8} {'peak_b':>8} {'ret_b':>7}")
+    for quant in args.quant.split(","):
+        for bins in (int(b) for b in args.bins.split(",")):
+            if srv.model is not None and bins != srv.model.num_bins:
+                print(f"⏭️ 模型輸入 bins={srv.model.num_bins}，略過 {quant}-{bins}")
+                continue
+            for frames in (int(f) for f in args.frames.split(",")):
+                name = f"{quant}-{bins}-{frames}"
+                r = run_case(srv, quant, bins, frames, args, rng)
+                results[name] = r
+                print(f"{name:<18} {r['fps']:>10.0f} {r['p50_us']:>8.1f} {r['p99_us']:>8.1f} "
+                      f"{r['p99_decide_us']:>8.1f} {r['decode_ns']:>8.0f} {r['peak_b']:>8.0f} {r['retained_b']:>7.1f}")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": getattr(feature_server.np, "__version__", None),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        },
+        "cases": results,
+    }
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 基準已存: {args.save}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
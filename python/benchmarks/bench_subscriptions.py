@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+broker 訂閱比對微基準（mqtt_broker_core.py 的轉發對象解析）
+比較每則 PUBLISH 找出訂閱者的成本：
+- legacy      : 舊 _forward_message 寫法（逐一掃描所有訂閱並以 _topic_matches 比對，成本隨訂閱數線性成長）
+- trie        : SubscriptionTrie.match（成本只與主題層數及命中的萬用字元分支有關）
+- trie+cache  : MQTTBrokerCore._resolve（訂閱樹 + 依主題快取解析結果，含共享訂閱選出的成員）
+訂閱組合模擬 --devices 台裝置：每台訂閱 esp32/infer/{device}，另有數個萬用字元監控者與
+$share/workers/esp32/feat/+/+/+ 共享訂閱；發佈主題為各裝置的特徵幀與推論回覆。
+另以 --unique 則互不重複的特徵幀主題（.../{session}/{idx}，每幀都不同）量測快取全部落空時的成本：
+trie+cache 需付出插入與淘汰，與 cache off（route_cache_size=0）比較。
+
+用法：
+    python benchmarks/bench_subscriptions.py [--devices 100 1000 10000] [-n 20000] [--repeat 3] [--unique 240000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mqtt_broker_core import MQTTBrokerCore, parse_shared  # noqa: E402
+
+
+def legacy_topic_matches(published_topic, subscribed_topic):
+    """舊 MQTTBrokerCore._topic_matches（原樣保留作為基準）"""
+    if subscribed_topic == published_topic:
+        return True
+
+    # 支援 + 萬用字元
+    if '+' in subscribed_topic:
+        sub_parts = subscribed_topic.split('/')
+        pub_parts = published_topic.split('/')
+
+        if len(sub_parts) == len(pub_parts):
+            for sub_part, pub_part in zip(sub_parts, pub_parts):
+                if sub_part != '+' and sub_part != pub_part:
+                    return False
+            return True
+
+    # 支援 # 萬用字元
+    if subscribed_topic.endswith('#'):
+        prefix = subscribed_topic[:-1]
+        return published_topic.startswith(prefix)
+
+    return False
+
+
+def build_subscriptions(devices, workers=4):
+    """回傳 {訂閱主題: set(client_id)}（與 MQTTBrokerCore.subscriptions 相同結構）。"""
+    subs = {}
+    for d in range(devices):
+        subs.setdefault(f"esp32/infer/dev{d:05d}", set()).add(f"dev{d:05d}")
+    for i in range(4):
+        subs.setdefault("esp32/infer/#", set()).add(f"monitor{i}")
+    subs.setdefault("esp32/feat/info", set()).add("audit")
+    subs.setdefault("esp32/+/+/+/0", set()).add("audit")
+    for i in range(workers):
+        subs.setdefault("$share/workers/esp32/feat/+/+/+", set()).add(f"worker{i}")
+    return subs
+
+
+def bench(name, fn, topics, n, repeat):
+    """取 repeat 次中最快的一次，降低排程雜訊。"""
+    batch = [topics[i % len(topics)] for i in range(n)]
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for topic in batch:
+            fn(topic)
+        best = min(best, time.perf_counter() - t0)
+    print(f"  {name:<12} {best / n * 1e6:9.2f} µs/msg  ({n / best:,.0f} msg/s)")
+    return best
+
+
+def bench_pass(name, core, topics, repeat):
+    """每次重複前清空快取，量測一輪互不重複主題的解析成本。"""
+    best = float("inf")
+    for _ in range(repeat):
+        core._routes.clear()
+        resolve = core._resolve
+        t0 = time.perf_counter()
+        for topic in topics:
+            resolve(topic)
+        best = min(best, time.perf_counter() - t0)
+    print(f"  {name:<12} {best / len(topics) * 1e6:9.2f} µs/msg  ({len(topics) / best:,.0f} msg/s)")
+    return best
+
+
+def run_unique(devices, count, repeat):
+    subs = build_subscriptions(devices)
+    cores = {"trie+cache": MQTTBrokerCore(verbose=False), "cache off": MQTTBrokerCore(verbose=False, route_cache_size=0)}
+    for core in cores.values():
+        for topic, clients in subs.items():
+            for client_id in clients:
+                core._subscribe(client_id, topic)
+    per_device = -(-count // devices)
+    topics = [f"esp32/feat/dev{d:05d}/s{i // 64}/{i % 64}" for i in range(per_device) for d in range(devices)][:count]
+    print(f"📊 {devices} 台裝置，{len(topics)} 個互不重複的主題（快取上限 {cores['trie+cache'].route_cache_size}）")
+    times = {name: bench_pass(name, core, topics, repeat) for name, core in cores.items()}
+    print(f"  trie+cache / cache off = {times['trie+cache'] / times['cache off']:.2f}")
+
+
+def run(devices, n, repeat):
+    subs = build_subscriptions(devices)
+    core = MQTTBrokerCore(verbose=False)
+    for topic, clients in subs.items():
+        for client_id in clients:
+            core._subscribe(client_id, topic)
+    trie = core._trie
+
+    def legacy(topic):
+        subscribers = set()
+        for sub_topic, sub_clients in subs.items():
+            shared = parse_shared(sub_topic)
+            if shared is not None:
+                if legacy_topic_matches(topic, shared[1]):
+                    member = core._shared_ring(sub_topic, sub_clients).get(core._share_key(topic))
+                    if member is not None:
+                        subscribers.add(member)
+            elif legacy_topic_matches(topic, sub_topic):
+                subscribers.update(sub_clients)
+        return subscribers
+
+    def trie_only(topic):
+        return trie.match(topic)
+
+    def cached(topic):
+        return core._resolve(topic)
+
+    step = max(1, devices // 64)
+    topics = [f"esp32/feat/dev{d:05d}/s{s}/{i}" for d in range(0, devices, step) for s in range(2) for i in range(4)]
+    topics += [f"esp32/infer/dev{d:05d}" for d in range(0, devices, step)]
+
+    # 三種解析結果必須一致（'a/#' 符合 'a' 為新行為，上面的主題組合不涉及）
+    for topic in topics:
+        expected = legacy(topic)
+        assert set(core._resolve(topic)) == expected, topic
+
+    print(f"📊 {devices} 台裝置（{sum(len(c) for c in subs.values())} 筆訂閱，{len(topics)} 個發佈主題）")
+    t_legacy = bench("legacy", legacy, topics, max(1, n // max(1, devices // 100)), repeat)
+    t_legacy *= max(1, devices // 100)  # legacy 於大訂閱數時縮小樣本，換算回 n 則
+    t_trie = bench("trie", trie_only, topics, n, repeat)
+    t_cache = bench("trie+cache", cached, topics, n, repeat)
+    print(f"  加速：trie {t_legacy / t_trie:.0f}x，trie+cache {t_legacy / t_cache:.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="broker 訂閱比對微基準")
+    parser.add_argument("--devices", type=int, nargs="+", default=[100, 1000, 10000], help="裝置數（可多個）")
+    parser.add_argument("-n", type=int, default=20000, help="每項測試的訊息數")
+    parser.add_argument("--repeat", type=int, default=3, help="重複次數（取最快）")
+    parser.add_argument("--unique", type=int, default=240000, help="互不重複主題的訊息數（0 = 略過）")
+    args = parser.parse_args()
+    for devices in args.devices:
+        run(devices, args.n, args.repeat)
+    if args.unique:
+        run_unique(max(args.devices), args.unique, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+主題路由微基準
+比較每則訊息的主題處理成本：
+- legacy_feature : 舊 FeatureServer 的 worker 池路徑（on_message / _shard_key / _dispatch / _handle_feature
+                   各自重建 f-string 或重新 rsplit/split 主題）
+- legacy_audio   : 舊 AudioDataReceiver 寫法（每則呼叫 get_topics() 重新查 configparser、再 split）
+- router_*       : TopicRouter.match（啟動時編譯一次）
+
+用法：
+    python benchmarks/bench_topic_router.py [-n 100000] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from config import MQTTConfig  # noqa: E402
+from topic_router import TopicRouter  # noqa: E402
+
+
+def _noop(payload, *fields):
+    pass
+
+
+def bench(name, fn, topics, n, repeat):
+    """取 repeat 次中最快的一次，降低排程雜訊。"""
+    batch = [topics[i % len(topics)] for i in range(n)]
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for topic in batch:
+            fn(topic)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{name:<16} {best / n * 1e9:8.1f} ns/msg  ({n / best / 1e6:.2f} M msg/s)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TopicRouter 微基準")
+    parser.add_argument("-n", type=int, default=100000, help="每項測試的訊息數")
+    parser.add_argument("--repeat", type=int, default=5, help="重複次數（取最快）")
+    args = parser.parse_args()
+
+    # 使用暫存目錄的預設設定，避免讀寫工作目錄的 config.ini
+    cfg = MQTTConfig(os.path.join(tempfile.mkdtemp(), "config.ini"))
+    feat_prefix = cfg.get_topics()['feature_prefix']
+    audio_prefix = cfg.get_topics()['audio_prefix']
+
+    feat_topics = [f"{feat_prefix}/dev{d:03d}/s{s}/{i}" for d in range(16) for s in range(4) for i in range(8)]
+    feat_topics.append(f"{feat_prefix}/info")
+    audio_topics = [f"{audio_prefix}/1690000000{t:03d}/{c}" for t in range(16) for c in range(32)]
+    audio_topics.append(f"{audio_prefix}/info")
+
+    topics = cfg.get_topics()
+
+    def legacy_feature(topic):
+        prefix = topics.get('feature_prefix', 'esp32/feat')
+        info_topic = f"{prefix}/info"
+        feat_prefix = f"{prefix}/"
+        if topic != info_topic and topic.startswith(feat_prefix):
+            topic.rsplit('/', 3)[-3]  # on_message：指標用的 device
+        if topic == info_topic:
+            return
+        parts = topic.rsplit('/', 3)  # _shard_key
+        (parts[-3], parts[-2])
+        if topic == info_topic:  # _dispatch
+            return
+        if topic.startswith(feat_prefix):
+            parts = topic.split('/')  # _handle_feature
+            parts[-3], parts[-2], int(parts[-1])
+
+    def legacy_audio(topic):
+        prefix = cfg.get_topics().get('audio_prefix', 'esp32/audio')
+        if topic == f"{prefix}/info":
+            return
+        if topic.startswith(f"{prefix}/"):
+            parts = topic.split('/')
+            if len(parts) >= 4:
+                int(parts[2]), int(parts[3])
+
+    feat_router = TopicRouter()
+    feat_router.add(f"{feat_prefix}/info", _noop)
+    feat_router.add(f"{feat_prefix}/{{device}}/{{session}}/{{idx:int}}", _noop)
+    audio_router = TopicRouter()
+    audio_router.add(f"{audio_prefix}/info", _noop)
+    audio_router.add(f"{audio_prefix}/{{timestamp:int}}/{{chunk_index:int}}", _noop)
+
+    # 正確性：router 解析出的欄位需與舊寫法一致
+    assert feat_router.match(feat_topics[9])[1] == ("dev000", "s1", 1)
+    assert audio_router.match(audio_topics[33])[1] == (1690000000001, 1)
+    assert feat_router.match(f"{feat_prefix}/info")[1] == ()
+    assert feat_router.match(f"{feat_prefix}/dev/s/notint") is None
+
+    print(f"🏁 每項 {args.n} 則訊息 × {args.repeat} 次（取最快）")
+    base_f = bench("legacy_feature", legacy_feature, feat_topics, args.n, args.repeat)
+    new_f = bench("router_feature", feat_router.match, feat_topics, args.n, args.repeat)
+    base_a = bench("legacy_audio", legacy_audio, audio_topics, args.n, args.repeat)
+    new_a = bench("router_audio", audio_router.match, audio_topics, args.n, args.repeat)
+    print(f"📊 feature: {base_f / new_f:.2f}x  audio: {base_a / new_a:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
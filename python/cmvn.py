@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+每裝置線上 CMVN（cepstral mean/variance normalization，見 docs/methodology_zh.md「正規化」）
+- 所有裝置的統計量存於連續的 [max_devices, F] float64 陣列（權重、均值、M2），
+  每次更新只使用預配置的 [F] 暫存，不隨裝置數配置新陣列
+- 以 Welford/Chan 合併公式一次併入一段 [t, F] 幀，合併前舊統計乘上 decay^t 做指數遺忘，
+  有效記憶約 1/(1 - decay) 幀，跟得上麥克風增益或環境噪音的緩慢變化
+- 正規化就地寫回：x ← (x - mean) / sqrt(var + eps)；新裝置的第一段即以自身統計正規化（等同每段 z-score）
+- 可附每段的列遮罩（session 缺幀時補零的列）：統計只併入實際收到的列，補零的列正規化後仍為 0（即均值）
+- save()/load() 以 .npz 保存 (device, weight, mean, M2)，伺服器重啟後沿用
+- 超過 max_devices 時回收最久未活動的裝置槽位
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class OnlineCMVN:
+    """多裝置、每 bin 的指數遺忘均值/變異數統計與就地正規化。"""
+
+    def __init__(self, bins, max_devices=4096, decay=0.999, eps=1e-5):
+        self.bins = int(bins)
+        self.max_devices = max(1, int(max_devices))
+        self.decay = float(decay)
+        self.eps = float(eps)
+
+        D, F = self.max_devices, self.bins
+        self.weight = np.zeros(D, dtype=np.float64)
+        self.mean = np.zeros((D, F), dtype=np.float64)
+        self.m2 = np.zeros((D, F), dtype=np.float64)
+        # 每次更新共用的暫存（於鎖內使用）
+        self._bmean = np.empty(F, dtype=np.float64)
+        self._bm2 = np.empty(F, dtype=np.float64)
+        self._delta = np.empty(F, dtype=np.float64)
+        self._tmp = np.empty(F, dtype=np.float64)
+        self._scale = np.empty(F, dtype=np.float32)
+        self._shift = np.empty(F, dtype=np.float32)
+        self._slots = OrderedDict()  # device → slot（LRU 順序）
+        self._free = list(range(D - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _slot(self, device):
+        s = self._slots.get(device)
+        if s is not None:
+            self._slots.move_to_end(device)
+            return s
+        if self._free:
+            s = self._free.pop()
+        else:
+            _, s = self._slots.popitem(last=False)
+        self._slots[device] = s
+        self.weight[s] = 0.0
+        self.mean[s] = 0.0
+        self.m2[s] = 0.0
+        return s
+
+    def _update(self, s, rows):
+        """以 Chan 合併公式併入 [t, F] 幀（舊統計先乘 decay^t）。"""
+        n = rows.shape[0]
+        if not n:
+            return
+        bmean, bm2, delta, tmp = self._bmean, self._bm2, self._delta, self._tmp
+        np.mean(rows, axis=0, dtype=np.float64, out=bmean)
+        # 區塊 M2 = Σx² - n·mean²（float64 累加，不產生 [t, F] 中間陣列）
+        np.einsum('ij,ij->j', rows, rows, dtype=np.float64, out=bm2)
+        np.multiply(bmean, bmean, out=tmp)
+        tmp *= n
+        bm2 -= tmp
+        np.maximum(bm2, 0.0, out=bm2)
+
+        mean, m2 = self.mean[s], self.m2[s]
+        forget = self.decay ** n
+        w = self.weight[s] * forget
+        total = w + n
+        np.subtract(bmean, mean, out=delta)
+        np.multiply(delta, n / total, out=tmp)
+        mean += tmp
+        m2 *= forget
+        m2 += bm2
+        np.multiply(delta, delta, out=tmp)
+        tmp *= w * n / total
+        m2 += tmp
+        self.weight[s] = total
+
+    def apply(self, device, blocks, masks=None):
+        """以該裝置的 blocks（依時間順序的 [t, F] float32 可寫視圖）更新統計，並就地正規化。
+
+        masks：與 blocks 對應的 [t] bool（True = 實際收到的列）或 None（整段皆有效）。
+        """
+        if masks is None:
+            masks = [None] * len(blocks)
+        with self._lock:
+            s = self._slot(device)
+            for block, mask in zip(blocks, masks):
+                self._update(s, block if mask is None else block[mask])
+            w = self.weight[s]
+            if w <= 0.0:
+                return
+            np.divide(self.m2[s], w, out=self._tmp)
+            self._tmp += self.eps
+            np.sqrt(self._tmp, out=self._tmp)
+            np.divide(1.0, self._tmp, out=self._scale, casting='unsafe')
+            self._shift[...] = self.mean[s]
+            for block, mask in zip(blocks, masks):
+                block -= self._shift
+                block *= self._scale
+                if mask is not None:
+                    block[~mask] = 0.0
+
+    def stats(self, device):
+        """回傳 (weight, mean[F], var[F]) 複本；未見過的裝置回傳 None。"""
+        with self._lock:
+            s = self._slots.get(device)
+            if s is None or self.weight[s] <= 0.0:
+                return None
+            return float(self.weight[s]), self.mean[s].copy(), self.m2[s] / self.weight[s]
+
+    def save(self, path):
+        """原子寫入 .npz（先寫暫存檔再 os.replace）。"""
+        with self._lock:
+            devices = list(self._slots.keys())
+            idx = np.fromiter(self._slots.values(), dtype=np.intp, count=len(devices))
+            data = {
+                "bins": np.int64(self.bins),
+                "decay": np.float64(self.decay),
+                "devices": np.array(devices, dtype=str),
+                "weight": self.weight[idx],
+                "mean": self.mean[idx],
+                "m2": self.m2[idx],
+            }
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp, path)
+        return len(devices)
+
+    def load(self, path) -> int:
+        """載入先前保存的統計；bins 不符時略過。回傳載入的裝置數。"""
+        with np.load(path) as data:
+            if int(data["bins"]) != self.bins:
+                raise ValueError(f"CMVN 統計 bins={int(data['bins'])} 與目前 {self.bins} 不符")
+            devices = [str(d) for d in data["devices"]][-self.max_devices:]
+            k = len(devices)
+            weight, mean, m2 = data["weight"][-k:], data["mean"][-k:], data["m2"][-k:]
+        with self._lock:
+            for i, device in enumerate(devices):
+                s = self._slot(device)
+                self.weight[s] = weight[i]
+                self.mean[s] = mean[i]
+                self.m2[s] = m2[i]
+        return k
@@ -55,7 +55,51 @@ class MQTTConfig:
         # 伺服器端示範參數
         self.config['server'] = {
             'frames_to_decide': '6',
-            'energy_threshold': '0.6'
+            'energy_threshold': '0.6',
+            'model': 'energy',
+            'model_path': 'models/kws_tinycnn.npz',
+            'batch_size': '8',
+            'batch_timeout_ms': '5',
+            'workers': '0',
+            'worker_mode': 'thread',
+            'session_ttl_s': '30',
+            'session_max': '10000',
+            'session_flush_on_expire': 'false',
+            'session_max_rows': '256',
+            'infer_mode': 'session',
+            'stream_window': '49',
+            'stream_hop': '10',
+            'stream_alpha': '0.5',
+            'stream_threshold': '0.8',
+            'stream_refractory_ms': '1000',
+            'stream_max_devices': '2048',
+            'metrics_host': '127.0.0.1',
+            'metrics_port': '0',
+            'log_messages': 'true',
+            'async_queue_size': '1024',
+            'share_group': '',
+            'archive_dir': '',
+            'archive_segment_mb': '64',
+            'archive_segment_s': '3600',
+            'archive_queue': '1024',
+            'cmvn': 'false',
+            'cmvn_decay': '0.999',
+            'cmvn_max_devices': '4096',
+            'cmvn_path': 'cmvn_stats.npz',
+            'cmvn_save_s': '60',
+            'dedup_ttl_s': '60',
+            'dedup_max': '50000',
+            'dedup_republish_s': '1.0',
+            'dedup_window': '65536',
+            'reply_mode': 'single',
+            'reply_window_ms': '20',
+            'reply_max_items': '32',
+            'reply_format': 'json',
+            'ingress_queue': '0',
+            'shed_policy': 'drop_oldest',
+            'shed_watermark': '0.8',
+            'shed_budget_ms': '200',
+            'profile_dir': 'profiles'
         }
         
         self.save_config()
@@ -93,7 +137,67 @@ class MQTTConfig:
     def get_server_config(self):
         """（可選）伺服器端行為配置"""
         return {
-            'frames_to_decide': self.config.getint('server', 'frames_to_decide', fallback=6)
+            'frames_to_decide': self.config.getint('server', 'frames_to_decide', fallback=6),
+            # 模型後端：energy（內建能量規則）或 tinycnn（kws_model.py 的 NumPy DS-CNN）
+            'model': self.config.get('server', 'model', fallback='energy'),
+            'model_path': self.config.get('server', 'model_path', fallback='models/kws_tinycnn.npz'),
+            # 跨 session 微批次：湊滿 batch_size 或等待超過 batch_timeout_ms 即推論（1 = 逐筆）
+            'batch_size': self.config.getint('server', 'batch_size', fallback=8),
+            'batch_timeout_ms': self.config.getfloat('server', 'batch_timeout_ms', fallback=5.0),
+            # 訊息處理 worker：數量（0 = 於網路執行緒內處理，預設）與模式 thread/process
+            'workers': self.config.getint('server', 'workers', fallback=0),
+            'worker_mode': self.config.get('server', 'worker_mode', fallback='thread'),
+            # session 表：閒置逾時（秒）、數量上限（LRU 淘汰）、淘汰時是否以部分幀決策
+            'session_ttl_s': self.config.getfloat('server', 'session_ttl_s', fallback=30.0),
+            'session_max': self.config.getint('server', 'session_max', fallback=10000),
+            'session_flush_on_expire': self.config.getboolean('server', 'session_flush_on_expire', fallback=False),
+            # 每個 session 預配置的最大列數（幀數 × 每則訊息列數），超出的 idx 會被丟棄
+            'session_max_rows': self.config.getint('server', 'session_max_rows', fallback=256),
+            # 推論模式：session（每 session 決策一次）或 stream（每裝置滑動視窗常駐偵測）
+            'infer_mode': self.config.get('server', 'infer_mode', fallback='session'),
+            'stream_window': self.config.getint('server', 'stream_window', fallback=49),
+            'stream_hop': self.config.getint('server', 'stream_hop', fallback=10),
+            'stream_alpha': self.config.getfloat('server', 'stream_alpha', fallback=0.5),
+            'stream_threshold': self.config.getfloat('server', 'stream_threshold', fallback=0.8),
+            'stream_refractory_ms': self.config.getint('server', 'stream_refractory_ms', fallback=1000),
+            'stream_max_devices': self.config.getint('server', 'stream_max_devices', fallback=2048),
+            # Prometheus 指標 HTTP 端點（port 0 = 停用）
+            'metrics_host': self.config.get('server', 'metrics_host', fallback='127.0.0.1'),
+            'metrics_port': self.config.getint('server', 'metrics_port', fallback=0),
+            # 逐則訊息日誌（大量裝置時建議關閉）
+            'log_messages': self.config.getboolean('server', 'log_messages', fallback=True),
+            # asyncio 版（feature_server_async.py）各階段之間的佇列上限
+            'async_queue_size': self.config.getint('server', 'async_queue_size', fallback=1024),
+            # 共享訂閱群組（空白 = 不共享）：多個伺服器以 $share/<group>/ 分擔特徵訊息
+            'share_group': self.config.get('server', 'share_group', fallback='').strip(),
+            # 特徵封存目錄（空白 = 停用）與 segment 輪替大小/時間、待寫入佇列上限
+            'archive_dir': self.config.get('server', 'archive_dir', fallback='').strip(),
+            'archive_segment_mb': self.config.getint('server', 'archive_segment_mb', fallback=64),
+            'archive_segment_s': self.config.getfloat('server', 'archive_segment_s', fallback=3600.0),
+            'archive_queue': self.config.getint('server', 'archive_queue', fallback=1024),
+            # 每裝置線上 CMVN（需 numpy 與模型）：每幀遺忘係數、裝置槽位數、統計保存路徑與間隔
+            'cmvn': self.config.getboolean('server', 'cmvn', fallback=False),
+            'cmvn_decay': self.config.getfloat('server', 'cmvn_decay', fallback=0.999),
+            'cmvn_max_devices': self.config.getint('server', 'cmvn_max_devices', fallback=4096),
+            'cmvn_path': self.config.get('server', 'cmvn_path', fallback='cmvn_stats.npz').strip(),
+            'cmvn_save_s': self.config.getfloat('server', 'cmvn_save_s', fallback=60.0),
+            # 去重：已決策 session 的回覆快取（TTL/上限）、遲到幀重送結果的最短間隔、串流模式近期幀數
+            'dedup_ttl_s': self.config.getfloat('server', 'dedup_ttl_s', fallback=60.0),
+            'dedup_max': self.config.getint('server', 'dedup_max', fallback=50000),
+            'dedup_republish_s': self.config.getfloat('server', 'dedup_republish_s', fallback=1.0),
+            'dedup_window': self.config.getint('server', 'dedup_window', fallback=65536),
+            # 推論回覆：single / coalesce（同裝置視窗內合併為陣列）、合併視窗與上限、json / bin（回覆 Binary v1）
+            'reply_mode': self.config.get('server', 'reply_mode', fallback='single').strip().lower(),
+            'reply_window_ms': self.config.getfloat('server', 'reply_window_ms', fallback=20.0),
+            'reply_max_items': self.config.getint('server', 'reply_max_items', fallback=32),
+            'reply_format': self.config.get('server', 'reply_format', fallback='json').strip().lower(),
+            # 過載保護：worker 佇列上限（0 = 不限）、丟棄政策、觸發水位（佔上限比例）、drop_oldest 的延遲預算
+            'ingress_queue': self.config.getint('server', 'ingress_queue', fallback=0),
+            'shed_policy': self.config.get('server', 'shed_policy', fallback='drop_oldest').strip().lower(),
+            'shed_watermark': self.config.getfloat('server', 'shed_watermark', fallback=0.8),
+            'shed_budget_ms': self.config.getfloat('server', 'shed_budget_ms', fallback=200.0),
+            # 執行期剖析結果（esp32/control/server 指令）的輸出目錄
+            'profile_dir': self.config.get('server', 'profile_dir', fallback='profiles').strip()
         }
     
     def get_client_config(self):
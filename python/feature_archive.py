@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+特徵封存（供教師/學生週期性蒸餾收集資料，見 docs/methodology_zh.md 第 5 節）
+- 每種 (量化型別 q, bins F) 各自一串 segment；資料檔是預配置的 [rows, F] memmap，
+  每列固定 F 個 u8 或 little-endian f32，session 的幀依時間順序連續寫入
+- 每個 segment 附一個精簡的二進位索引（device, session, 起始列, 幀數, ts）
+- segment 依大小（archive_segment_mb）或時間（archive_segment_s）輪替；關閉時截斷為實際長度
+- 寫入由背景執行緒負責：ingest/決策路徑只把張量放入有界佇列（滿時丟棄並計數），不做磁碟 I/O
+- ArchiveReader 以 np.memmap 唯讀開啟，回傳任一 session 的零拷貝視圖
+
+目錄結構：
+    <archive_dir>/<q>_<F>/<建立時間 ms>-<pid>-<n>.dat   資料
+    <archive_dir>/<q>_<F>/<建立時間 ms>-<pid>-<n>.idx   索引：標頭 <4sBH>（magic, q, F），
+                                                       之後每筆 <IIQBB> + device + session
+
+列出封存內容：
+    python feature_archive.py archive/ --list
+"""
+
+import argparse
+import glob
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from feature_codec import QUANT_CODES, QUANT_NAMES
+
+INDEX_MAGIC = b"EFA1"
+INDEX_HEADER = struct.Struct('<4sBH')    # magic, quant code, bins
+INDEX_ENTRY = struct.Struct('<IIQBB')    # 起始列, 幀數, ts(ms), len(device), len(session)
+DTYPES = {"u8": np.dtype(np.uint8), "f32": np.dtype('<f4')}
+
+_STOP = object()
+
+
+class _Segment:
+    """一個可寫入的 segment（memmap 資料檔 + 索引檔）。"""
+
+    def __init__(self, root, quant, bins, rows, seq):
+        self.quant = quant
+        self.bins = bins
+        self.rows = rows
+        self.used = 0
+        self.opened = time.monotonic()
+        folder = os.path.join(root, f"{quant}_{bins}")
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, f"{int(time.time() * 1000)}-{os.getpid()}-{seq}")
+        self.data_path = base + ".dat"
+        self.index_path = base + ".idx"
+        self.mm = np.memmap(self.data_path, dtype=DTYPES[quant], mode='w+', shape=(rows, bins))
+        self.index = open(self.index_path, 'wb')
+        self.index.write(INDEX_HEADER.pack(INDEX_MAGIC, QUANT_CODES[quant], bins))
+
+    def free(self):
+        return self.rows - self.used
+
+    def append(self, device, session, frames, ts):
+        n = frames.shape[0]
+        self.mm[self.used:self.used + n] = frames
+        dev = device.encode('utf-8')[:255]
+        ses = session.encode('utf-8')[:255]
+        # 資料先寫入，再寫索引：讀取端看到索引時資料必定已在 page cache
+        self.index.write(INDEX_ENTRY.pack(self.used, n, int(ts or 0), len(dev), len(ses)) + dev + ses)
+        self.used += n
+
+    def close(self):
+        self.mm.flush()
+        self.mm = None
+        self.index.close()
+        # 截斷未使用的預配置空間
+        os.truncate(self.data_path, self.used * self.bins * DTYPES[self.quant].itemsize)
+
+
+class FeatureArchive:
+    """非阻塞的 session 特徵封存器（背景執行緒寫入 memmap segment）。"""
+
+    def __init__(self, root, segment_mb=64, segment_s=3600, max_pending=1024):
+        self.root = root
+        self.segment_bytes = max(1, int(segment_mb)) * 1024 * 1024
+        self.segment_s = float(segment_s)
+        self._q = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._segments = {}  # (q, F) → _Segment
+        self._seq = 0
+        self._thread = None
+        # 統計
+        self.sessions = 0
+        self.frames = 0
+        self.dropped = 0
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="feature-archive", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._q.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def pending(self):
+        return self._q.qsize()
+
+    def append(self, device, session, frames, quant, ts=None) -> bool:
+        """排入一段 [T, F] 幀（依 quant 轉成 u8 或 f32）；佇列滿時丟棄並回傳 False，不阻塞。
+
+        呼叫端之後可能重用 frames 的緩衝區（例如 FramePool），因此可寫的視圖會先複製一份；
+        唯讀視圖（如直接指向 payload bytes 的 np.frombuffer）則直接引用。
+        """
+        arr = np.asarray(frames, dtype=DTYPES[quant])
+        if arr.ndim != 2 or not arr.shape[0]:
+            return False
+        if arr.flags.writeable and not arr.flags.owndata:
+            arr = arr.copy()
+        try:
+            self._q.put_nowait((device, session, arr, quant, ts))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                item = self._q.get(timeout=1.0)
+            except queue.Empty:
+                self._roll_expired()
+                continue
+            if item is _STOP:
+                break
+            touched = set()
+            while item is not None and item is not _STOP:
+                try:
+                    touched.add(self._write(*item))
+                except Exception as e:
+                    print(f"⚠️ 特徵封存寫入錯誤: {e}")
+                # 一次處理完目前已排入的項目，再統一 flush 索引
+                try:
+                    item = self._q.get_nowait()
+                except queue.Empty:
+                    item = None
+            for seg in touched:
+                if seg is not None and seg.mm is not None:
+                    seg.index.flush()
+            if item is _STOP:
+                break
+            self._roll_expired()
+        for seg in self._segments.values():
+            seg.close()
+        self._segments.clear()
+
+    def _write(self, device, session, frames, quant, ts):
+        bins = frames.shape[1]
+        key = (quant, bins)
+        seg = self._segments.get(key)
+        if seg is not None and seg.free() < frames.shape[0]:
+            seg.close()
+            seg = None
+        if seg is None:
+            rows = max(frames.shape[0], self.segment_bytes // (bins * DTYPES[quant].itemsize))
+            self._seq += 1
+            seg = _Segment(self.root, quant, bins, rows, self._seq)
+            self._segments[key] = seg
+        seg.append(device, session, frames, ts)
+        self.sessions += 1
+        self.frames += frames.shape[0]
+        return seg
+
+    def _roll_expired(self):
+        now = time.monotonic()
+        for key, seg in list(self._segments.items()):
+            if now - seg.opened >= self.segment_s:
+                seg.close()
+                del self._segments[key]
+
+
+class ArchiveReader:
+    """唯讀存取封存資料；session() 回傳 memmap 上的零拷貝視圖。"""
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = {}   # (device, session) → [(data_path, start, count, ts)]
+        self._formats = {}  # data_path → (quant, bins)
+        self._ends = {}     # data_path → 已索引的最大列
+        self._maps = {}     # data_path → (rows, memmap)
+        self.refresh()
+
+    def refresh(self):
+        """重新掃描索引（寫入中的 segment 也會讀到已 flush 的部分）。"""
+        self.entries.clear()
+        for index_path in sorted(glob.glob(os.path.join(self.root, "*", "*.idx"))):
+            with open(index_path, 'rb') as f:
+                blob = f.read()
+            if len(blob) < INDEX_HEADER.size:
+                continue
+            magic, qcode, bins = INDEX_HEADER.unpack_from(blob)
+            if magic != INDEX_MAGIC:
+                continue
+            data_path = index_path[:-4] + ".dat"
+            self._formats[data_path] = (QUANT_NAMES[qcode], bins)
+            off = INDEX_HEADER.size
+            end = 0
+            while off + INDEX_ENTRY.size <= len(blob):
+                start, count, ts, dlen, slen = INDEX_ENTRY.unpack_from(blob, off)
+                off += INDEX_ENTRY.size
+                if off + dlen + slen > len(blob):
+                    break  # 寫到一半的尾端
+                device = blob[off:off + dlen].decode('utf-8')
+                session = blob[off + dlen:off + dlen + slen].decode('utf-8')
+                off += dlen + slen
+                self.entries.setdefault((device, session), []).append((data_path, start, count, ts))
+                end = max(end, start + count)
+            self._ends[data_path] = end
+        return self
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def _map(self, data_path):
+        rows = self._ends[data_path]
+        cached = self._maps.get(data_path)
+        if cached is not None and cached[0] >= rows:
+            return cached[1]
+        quant, bins = self._formats[data_path]
+        # 只映射已索引的範圍（寫入中的 segment 之後會截斷，不可觸碰未索引的尾端）
+        mm = np.memmap(data_path, dtype=DTYPES[quant], mode='r', shape=(rows, bins))
+        self._maps[data_path] = (rows, mm)
+        return mm
+
+    def views(self, device, session):
+        """依寫入順序回傳該 session 各段的零拷貝 [t, F] 視圖；同一 segment 內相鄰的段會合併。"""
+        spans = []
+        for path, start, count, _ in self.entries.get((device, session), ()):
+            if spans and spans[-1][0] == path and spans[-1][2] == start:
+                spans[-1][2] = start + count
+            else:
+                spans.append([path, start, start + count])
+        return [self._map(path)[start:end] for path, start, end in spans]
+
+    def session(self, device, session):
+        """回傳整個 session 的 [T, F]；只有一段時為零拷貝視圖，跨 segment 或不相鄰時串接成新陣列。"""
+        views = self.views(device, session)
+        if not views:
+            raise KeyError((device, session))
+        return views[0] if len(views) == 1 else np.concatenate(views)
+
+    def iter_sessions(self):
+        """依序產生 (device, session, ts, [T, F])，供訓練程式逐筆讀取。"""
+        for (device, session), chunks in self.entries.items():
+            yield device, session, chunks[0][3], self.session(device, session)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="特徵封存工具")
+    parser.add_argument("root", help="封存目錄（[server] archive_dir）")
+    parser.add_argument("--list", action="store_true", help="列出 session 與形狀")
+    args = parser.parse_args()
+
+    reader = ArchiveReader(args.root)
+    frames = sum(count for chunks in reader.entries.values() for _, _, count, _ in chunks)
+    print(f"📦 {len(reader)} 個 session，{frames} 幀，{len(reader._formats)} 個 segment")
+    if args.list:
+        for device, session, ts, feats in reader.iter_sessions():
+            print(f"  {device}/{session} ts={ts} shape={feats.shape} dtype={feats.dtype}")
+
+
+if __name__ == "__main__":
+    main()
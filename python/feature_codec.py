@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+特徵幀線上格式（模擬器與伺服器共用）
+- JSON：{"ts","sr","feat","shape","win_ms","hop_ms","q","data":"<base64>"}（舊裝置相容）
+- Binary v1：固定 little-endian 標頭 + 原始張量位元組（省去 base64 約 33% 與 JSON 解析）
+
+Binary v1 標頭（26 bytes，'<2sBBBBQIHHHH'）：
+    magic   2s   b"EF"
+    version u8   1
+    quant   u8   0=u8, 1=f32
+    feat    u8   0=logmel, 1=mfcc
+    flags   u8   保留（0）
+    ts      u64  毫秒時間戳
+    sr      u32  取樣率
+    T       u16  shape[0]（幀數）
+    F       u16  shape[1]（bins）
+    win_ms  u16
+    hop_ms  u16
+其後緊接 T*F 個 u8 或 little-endian float32。
+
+推論回覆 Binary v1（[server] reply_format = bin；JSON 陣列的精簡替代）：
+    標頭 '<2sBB'：magic b"ER"、version 1、筆數 n
+    每筆 '<QHHffBBB'：ts(ms)、frames、missing、conf、latency_ms、mode（0=session、1=stream）、
+                      len(session)、len(result)，之後緊接 session 與 result 的 UTF-8
+"""
+
+import base64
+import json
+import struct
+
+FRAME_MAGIC = b"EF"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<2sBBBBQIHHHH')
+
+QUANT_CODES = {'u8': 0, 'f32': 1}
+QUANT_NAMES = {v: k for k, v in QUANT_CODES.items()}
+QUANT_ITEMSIZE = {'u8': 1, 'f32': 4}
+
+FEAT_CODES = {'logmel': 0, 'mfcc': 1}
+FEAT_NAMES = {v: k for k, v in FEAT_CODES.items()}
+
+RESULT_MAGIC = b"ER"
+RESULT_VERSION = 1
+RESULT_HEADER = struct.Struct('<2sBB')
+RESULT_ENTRY = struct.Struct('<QHHffBBB')
+RESULT_MODES = {'session': 0, 'stream': 1}
+RESULT_MODE_NAMES = {v: k for k, v in RESULT_MODES.items()}
+
+
+def encode_binary_frame(raw, shape, ts, sr=16000, feat="logmel", win_ms=25, hop_ms=10, quant="u8") -> bytes:
+    """將一段特徵張量打包為 Binary v1 訊息。"""
+    if quant not in QUANT_CODES:
+        raise ValueError(f"不支援的量化型別: {quant}")
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC, FRAME_VERSION, QUANT_CODES[quant], FEAT_CODES.get(feat, 0), 0,
+        int(ts), int(sr), int(shape[0]), int(shape[1]), int(win_ms), int(hop_ms),
+    )
+    return header + bytes(raw)
+
+
+def is_binary_frame(payload) -> bool:
+    """以 magic 判斷訊息格式（JSON 必以 '{' 或空白開頭，不會與 b"EF" 衝突）。"""
+    return len(payload) >= FRAME_HEADER.size and payload[:2] == FRAME_MAGIC
+
+
+def decode_frame(payload):
+    """解析一則特徵訊息（自動偵測格式）。
+
+    回傳 (meta, raw)：meta 與 JSON 欄位同名（不含 data）；
+    Binary 時 raw 為指向原訊息的 memoryview（不複製），JSON 時為 base64 解碼後的 bytes。
+    """
+    if is_binary_frame(payload):
+        (_, version, q, feat, _flags, ts, sr, t, f, win_ms, hop_ms) = FRAME_HEADER.unpack_from(payload)
+        if version != FRAME_VERSION:
+            raise ValueError(f"不支援的特徵格式版本: {version}")
+        if q not in QUANT_NAMES:
+            raise ValueError(f"未知的量化代碼: {q}")
+        meta = {
+            "ts": ts,
+            "sr": sr,
+            "feat": FEAT_NAMES.get(feat, 'logmel'),
+            "shape": [t, f],
+            "win_ms": win_ms,
+            "hop_ms": hop_ms,
+            "q": QUANT_NAMES[q],
+        }
+        return meta, memoryview(payload)[FRAME_HEADER.size:]
+
+    meta = json.loads(payload)
+    b64 = meta.pop('data', '')
+    raw = base64.b64decode(b64) if b64 else b''
+    return meta, raw
+
+
+def encode_results(results) -> bytes:
+    """將最多 255 筆推論結果（與 JSON 回覆同欄位的 dict）打包為回覆 Binary v1。"""
+    if len(results) > 255:
+        raise ValueError(f"單則回覆最多 255 筆結果（{len(results)}）")
+    parts = [RESULT_HEADER.pack(RESULT_MAGIC, RESULT_VERSION, len(results))]
+    for r in results:
+        session = str(r.get("session", "")).encode('utf-8')[:255]
+        label = str(r.get("result", "")).encode('utf-8')[:255]
+        parts.append(RESULT_ENTRY.pack(
+            int(r.get("ts", 0)), min(int(r.get("frames", 0)), 0xFFFF), min(int(r.get("missing", 0)), 0xFFFF),
+            float(r.get("conf", 0.0)), float(r.get("latency_ms", 0.0)),
+            RESULT_MODES.get(r.get("mode", "session"), 0), len(session), len(label)))
+        parts.append(session)
+        parts.append(label)
+    return b"".join(parts)
+
+
+def decode_results(payload) -> list:
+    """encode_results 的反向；回傳 dict 列表（conf/latency_ms 為 float32 精度）。"""
+    magic, version, n = RESULT_HEADER.unpack_from(payload)
+    if magic != RESULT_MAGIC or version != RESULT_VERSION:
+        raise ValueError(f"不是回覆 Binary v1（magic={magic!r}, version={version}）")
+    off = RESULT_HEADER.size
+    out = []
+    for _ in range(n):
+        ts, frames, missing, conf, latency_ms, mode, slen, rlen = RESULT_ENTRY.unpack_from(payload, off)
+        off += RESULT_ENTRY.size
+        session = bytes(payload[off:off + slen]).decode('utf-8')
+        label = bytes(payload[off + slen:off + slen + rlen]).decode('utf-8')
+        off += slen + rlen
+        out.append({"ts": ts, "session": session, "frames": frames, "missing": missing, "result": label,
+                    "conf": conf, "latency_ms": latency_ms, "mode": RESULT_MODE_NAMES.get(mode, "session")})
+    return out
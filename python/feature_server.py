@@ -2,64 +2,399 @@
 # -*- coding: utf-8 -*-
 """
 最小特徵接收與回覆伺服器
-- 訂閱: esp32/feat/{device}/{session}/{idx} 與 esp32/feat/info
-- 聚合每個 session 的幀，並回覆簡單推論結果至 esp32/infer/{device}
-- 僅為 Demo 用，不執行真實模型推論
+- 訂閱: esp32/feat/{device}/{session}/{idx}（JSON 或 Binary v1）與 esp32/feat/info
+- 聚合每個 session 的幀，並回覆推論結果至 esp32/infer/{device}
+- 預設以能量規則示範；設定 [server] model = tinycnn 時改用 kws_model.py 的 NumPy DS-CNN
+- [server] infer_mode = stream 時改為每裝置滑動視窗的常駐偵測（見 streaming.py）
 """
 
-import base64
 import json
+import os
 import queue
 import random
+import struct
 import threading
 import time
-from collections import defaultdict
 
 import paho.mqtt.client as mqtt
 
+from batch_scheduler import MicroBatcher, ReplyCoalescer
 from config import MQTTConfig
+from feature_codec import decode_frame, encode_results
+from frame_buffer import FramePool, SessionFrames
+from ingest_pool import ShardedWorkerPool
+from ingress_queue import LoadShedder
+from metrics import MetricsRegistry, start_http_server
+from profiling import ProfilerControl
+from session_table import RecentKeys, SessionTable
+from topic_router import TopicRouter
+
+try:
+    # 可選：有 numpy 時以零拷貝視圖解碼並向量化累加；否則退回純 Python
+    import numpy as np
+except ImportError:  # pragma: no cover - 視執行環境而定
+    np = None
+
+if np is not None:
+    from cmvn import OnlineCMVN
+    from feature_archive import FeatureArchive
+    from streaming import StreamBank
+
+
+def shape_ok(shape) -> bool:
+    return bool(shape) and len(shape) == 2 and int(shape[1]) > 0
+
+
+class QueuePublisher:
+    """子行程內取代 MQTT client：publish 改為放入輸出佇列，由主行程統一發佈。"""
+
+    def __init__(self, out_q):
+        self.out_q = out_q
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.out_q.put((topic, payload))
+
+
+def make_process_handler(out_q):
+    """process 模式 worker 的處理器工廠（於子行程內執行，需為模組層級函式以便 pickle）。"""
+    server = FeatureServer(client=QueuePublisher(out_q), workers=0)
+    return server._dispatch
 
 
 class FeatureServer:
-    def __init__(self):
+    # 子類別可自行排程推論（例如 asyncio 版），此時不建立 MicroBatcher 執行緒
+    use_batcher = True
+    # 合併回覆的到期檢查：True 由 ReplyCoalescer 背景執行緒負責，False 由子類別定期呼叫 flush_due
+    use_reply_thread = True
+
+    def __init__(self, client=None, workers=None):
+        """client: 注入的 MQTT client（None 則建立 paho client）；
+        workers: worker 數（None 依 [server] workers，0 表示於網路執行緒內直接處理）。"""
         self.cfg = MQTTConfig()
         self.host, self.port = self.cfg.get_broker_info()
         self.topics = self.cfg.get_topics()
         self.server_cfg = self.cfg.get_server_config()
+        # 逐則訊息的 📥/✅ 日誌；大量裝置時建議關閉
+        self.log_messages = self.server_cfg.get('log_messages', True)
 
         # session → accumulator（不留原始資料，降低記憶體）
         # 格式：{"sum": float, "count": int, "dtype": "u8"|"f32"}
-        self.session_acc = defaultdict(lambda: {"sum": 0.0, "count": 0, "dtype": "u8"})
+        # 兩張表皆有 TTL 與數量上限：未湊滿 N 幀的 session、決策後才到的 info 都會過期淘汰
+        ttl_s = self.server_cfg.get('session_ttl_s', 30.0)
+        max_sessions = self.server_cfg.get('session_max', 10000)
+        self.session_acc = SessionTable(
+            factory=lambda: {"sum": 0.0, "count": 0, "dtype": "u8"},
+            ttl_s=ttl_s, max_size=max_sessions, on_evict=self._on_session_evicted)
+        # 正在處理中的 session（key → 執行緒 ident）與等待該執行緒接手的淘汰項目
+        self._busy = {}
+        self._retired = {}
+        self._busy_lock = threading.Lock()
         # session meta: expected frames (if announced)
-        self.session_meta = {}
+        self.session_meta = SessionTable(ttl_s=ttl_s, max_size=max_sessions)
+        # 已決策 session 的回覆快取（短 TTL + LRU）：QoS 1 重送或遲到的幀改為重送結果，不再開新 session
+        self.decided = SessionTable(ttl_s=self.server_cfg.get('dedup_ttl_s', 60.0),
+                                    max_size=self.server_cfg.get('dedup_max', 50000))
+        self.republish_s = self.server_cfg.get('dedup_republish_s', 1.0)
+        # 串流模式沒有 session 緩衝，以近期 (device, session, idx) 去重
+        self.recent_frames = RecentKeys(self.server_cfg.get('dedup_window', 65536))
+
+        # 訊息處理 worker 池：網路執行緒只入列，依 (device, session) 分派確保同 session 順序
+        if workers is None:
+            workers = self.server_cfg.get('workers', 0)
+        mode = self.server_cfg.get('worker_mode', 'thread')
+        capacity = self.server_cfg.get('ingress_queue', 0) if workers > 0 else 0
+        self.pool = None
+        if workers > 0 and mode == 'process':
+            # 模型與 session 狀態位於各子行程，主行程只負責入列與發佈
+            self.pool = ShardedWorkerPool(workers=workers, mode='process',
+                                          handler_factory=make_process_handler,
+                                          on_output=self._publish_raw, capacity=capacity)
+        elif workers > 0:
+            self.pool = ShardedWorkerPool(self._dispatch_route, workers=workers, mode='thread', capacity=capacity)
 
-        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
+        # 過載丟棄：佇列有上限時，由網路執行緒判斷優先序（info 與收尾幀優先）並依 shed_policy 丟棄
+        self.shedder = None
+        if capacity > 0:
+            if mode == 'process' and self.server_cfg.get('shed_policy') == 'degrade':
+                # 降級旗標位於主行程，子行程的推論讀不到
+                raise ValueError("shed_policy = degrade 僅支援 worker_mode = thread")
+            stream = self.server_cfg.get('infer_mode', 'session') == 'stream'
+            self.shedder = LoadShedder(
+                capacity, policy=self.server_cfg.get('shed_policy', 'drop_oldest'),
+                watermark=self.server_cfg.get('shed_watermark', 0.8),
+                budget_ms=self.server_cfg.get('shed_budget_ms', 200.0),
+                frames_to_decide=0 if stream else self.server_cfg.get('frames_to_decide', 6),
+                ttl_s=ttl_s, max_sessions=max_sessions)
+        self._shed_logged = 0.0
+
+        # 推論回覆：single（每個結果一則）或 coalesce（同裝置 reply_window_ms 內的結果合併成一則陣列）
+        self.reply_binary = self.server_cfg.get('reply_format', 'json') == 'bin'
+        self.replies = None
+
+        self.model = None
+        self.batcher = None
+        self.archive = None
+        if self.pool is None or self.pool.mode == 'thread':
+            if self.server_cfg.get('reply_mode', 'single') == 'coalesce':
+                self.replies = ReplyCoalescer(self._publish_results,
+                                              window_ms=self.server_cfg.get('reply_window_ms', 20.0),
+                                              max_items=self.server_cfg.get('reply_max_items', 32))
+                if self.use_reply_thread:
+                    self.replies.start()
+            # 特徵封存（蒸餾資料集）：背景執行緒寫入 memmap segment，決策路徑只入列
+            self.archive = self._start_archive()
+            # 模型後端：啟動時載入一次；None 表示使用內建能量規則
+            self.model = self._load_model()
+            # 跨 session 微批次（batch_size > 1 且有模型時啟用）
+            if self.model is not None and self.use_batcher and int(self.server_cfg.get('batch_size', 1)) > 1:
+                self.batcher = MicroBatcher(
+                    self.model, self._finish_decision,
+                    max_batch=self.server_cfg['batch_size'],
+                    max_delay_ms=self.server_cfg.get('batch_timeout_ms', 5.0),
+                ).start()
+
+        # 指標（Prometheus text format，見 metrics.py；process 模式下解碼/推論指標留在子行程）
+        self.metrics = MetricsRegistry()
+        self.m_ingest = self.metrics.counter('feature_messages_total', '收到的特徵訊息數', label='device')
+        self.m_decode = self.metrics.histogram('feature_decode_seconds', '單則特徵訊息解碼時間（秒）')
+        self.m_infer = self.metrics.histogram('feature_inference_seconds', '單次決策的推論時間（秒）')
+        self.m_dup = self.metrics.counter('feature_duplicate_frames_total', '丟棄的重送（redelivered）或決策後遲到（late）幀數',
+                                          label='kind')
+        self.m_shed = self.metrics.counter('feature_shed_total', '過載丟棄的幀（oldest/new_session/full）與降級為能量規則的決策（degraded）',
+                                           label='reason')
+        self.m_e2e = self.metrics.histogram('feature_e2e_seconds', '幀 ts 到回覆發佈的端到端時間（秒）')
+        self.metrics.gauge('feature_queue_depth', '等待處理的訊息與待批次推論數', self._queue_depth)
+        self.metrics.gauge('feature_active_sessions', '進行中的 session 數', lambda: len(self.session_acc))
+        if self.shedder is not None:
+            self.metrics.gauge('feature_ingress_capacity', 'ingest 佇列上限（一般項目）', lambda: self.shedder.capacity)
+            self.metrics.gauge('feature_degraded', '是否因過載改用能量規則（1 = 降級中）',
+                               lambda: int(self.shedder.degraded))
+        if self.archive is not None:
+            self.metrics.gauge('feature_archive_dropped', '封存佇列已滿而丟棄的 session 數',
+                               lambda: self.archive.dropped)
+        self.metrics_http = None
+
+        # 每個 session 依 idx 排列的 [max_rows, F] 緩衝區，由 pool 回收重用
+        self.frame_pool = FramePool(max_rows=self.server_cfg.get('session_max_rows', 256))
+
+        # 串流模式：每裝置滑動視窗，於第一幀到達時依 bins 建立
+        self.stream_mode = self.server_cfg.get('infer_mode', 'session') == 'stream'
+        if self.stream_mode and np is None:
+            print("⚠️ 未安裝 numpy，無法使用串流模式，改用 session 模式")
+            self.stream_mode = False
+        self.stream = None
+        self._stream_lock = threading.Lock()
+
+        # 每裝置線上 CMVN：解碼後、推論前就地正規化（只在有模型時使用），於第一個張量到達時依 bins 建立
+        self.use_cmvn = bool(self.server_cfg.get('cmvn')) and np is not None
+        self.cmvn = None
+        self._cmvn_saved = time.monotonic()
+
+        # 定期推進 session 表的時間輪
+        self._housekeeper = threading.Thread(target=self._housekeeping, name="session-housekeeping", daemon=True)
+        self._housekeeper.start()
+
+        # 主題樣式於啟動時編譯一次，處理器直接拿到已解析的欄位
+        self.feat_prefix = self.topics.get('feature_prefix', 'esp32/feat')
+        self.infer_prefix = self.topics.get('infer_prefix', 'esp32/infer')
+        self.router = TopicRouter()
+        self.router.add(f"{self.feat_prefix}/info", self._handle_info)
+        self.router.add(f"{self.feat_prefix}/{{device}}/{{session}}/{{idx:int}}", self._handle_feature)
+        # 網路執行緒轉告 worker 的過載丟棄數（內部項目，不接受外部發佈；process 模式經子行程的 router 分派）
+        self.router.add(f"{self.feat_prefix}/{{device}}/{{session}}/shed", self._handle_shed)
+        # 執行期剖析（esp32/control/server）：指令於網路執行緒處理，不進 worker 佇列
+        self.control_topic = f"{self.topics.get('control', 'esp32/control')}/server"
+        self.profiler = ProfilerControl(lambda topic, body: self._publish_raw(topic, body), "feature_server",
+                                        self.control_topic, self.server_cfg.get('profile_dir', 'profiles'))
+        self.router.add(self.control_topic, self.profiler.handle)
+
+        if client is None:
+            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+            client.on_connect = self.on_connect
+            client.on_message = self.on_message
+        self.client = client
 
     def run(self):
+        self._start_metrics()
+        if self.pool is not None:
+            self.pool.start()
+            print(f"🧵 訊息處理 worker: {self.pool.workers} 個（{self.pool.mode}）")
         print(f"🌐 連接 MQTT: {self.host}:{self.port}")
         self.client.connect(self.host, self.port, keepalive=60)
-        self.client.loop_forever()
+        try:
+            self.client.loop_forever()
+        finally:
+            if self.pool is not None:
+                self.pool.stop()
+            self._close()
+
+    def _close(self):
+        """停止背景元件並保存狀態（run() 結束時呼叫）。"""
+        self.profiler.shutdown()
+        if self.batcher is not None:
+            self.batcher.stop()
+        if self.replies is not None:
+            self.replies.stop()
+        if self.archive is not None:
+            self.archive.stop()
+        self._save_cmvn()
+
+    def _start_metrics(self):
+        port = self.server_cfg.get('metrics_port', 0)
+        if port:
+            host = self.server_cfg.get('metrics_host', '127.0.0.1')
+            try:
+                self.metrics_http = start_http_server(self.metrics, port, host)
+                print(f"📈 指標: http://{host}:{port}/metrics")
+            except OSError as e:
+                print(f"⚠️ 指標埠 {port} 無法使用: {e}")
 
     # MQTT callbacks
     def on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
             print("✅ 連接成功。訂閱特徵主題…")
-            feat_prefix = self.topics.get('feature_prefix', 'esp32/feat')
-            client.subscribe(f"{feat_prefix}/+/+/+")  # device/session/idx
-            client.subscribe(f"{feat_prefix}/info")
+            for topic in self.subscription_topics():
+                client.subscribe(topic)
         else:
             print(f"❌ 連接失敗: {reason_code}")
 
+    def subscription_topics(self):
+        """特徵主題（device/session/idx）與 info 主題。
+
+        設定 [server] share_group 時特徵主題改為 $share/<group>/...，由 broker 依 device/session
+        一致性雜湊分給 group 內的一個伺服器；info 仍為一般訂閱，每個伺服器都會收到
+        （非本機負責的 session 只留下一筆 meta，過期後淘汰）。
+        """
+        feat_topic = f"{self.feat_prefix}/+/+/+"
+        group = self.server_cfg.get('share_group', '')
+        if group:
+            feat_topic = f"$share/{group}/{feat_topic}"
+        return [feat_topic, f"{self.feat_prefix}/info", self.control_topic]
+
     def on_message(self, client, userdata, msg):
-        topic = msg.topic
+        route = self.router.match(msg.topic)
+        if route is None:
+            return
+        handler, fields = route
+        if handler == self._handle_shed:
+            return
+        if fields:
+            self.m_ingest.inc(fields[0])
+        elif handler == self.profiler.handle:
+            handler(msg.payload)
+            return
+        if self.pool is None:
+            self._dispatch_route(handler, fields, msg.payload)
+            return
+        # 網路執行緒只計算 shard key 並入列
+        try:
+            key = self._shard_key(fields, msg.payload)
+        except Exception as e:
+            print(f"⚠️ 無法分派訊息 {msg.topic}: {e}")
+            return
+        if self.pool.mode == 'thread':
+            # 已解析的路由直接交給 worker，不再重複比對主題
+            item = (handler, fields, msg.payload)
+        else:
+            # 子行程有自己的 router，只傳可 pickle 的原始主題
+            item = (msg.topic, msg.payload)
+        if self.shedder is None:
+            self.pool.submit(key, *item)
+            return
+        self._admit(key, fields, msg.payload, item)
+
+    def _admit(self, key, fields, payload: bytes, item):
+        """有界佇列的准入：info 與收尾幀優先入列，其餘依 shed_policy 丟棄。"""
+        shedder = self.shedder
+        if not fields:
+            # info：記下宣告的幀數（可能提早湊滿），一律優先
+            try:
+                shedder.note_info(key, int(json.loads(payload).get('frames', 0)))
+            except (TypeError, ValueError):
+                pass
+            if not self.pool.submit(key, *item, urgent=True)[0]:
+                self._on_shed("full")
+            return
+        session_key = tuple(fields[:2])
+        urgent, reason = shedder.classify(session_key, self._pool_depth())
+        if reason is not None:
+            self._on_shed(reason)
+            return
+        # 先前被丟棄的幀數排在此幀之前轉告 worker（以「已收到 + 已丟棄」判斷湊滿）
+        self._report_shed(session_key, final=urgent)
+        # group：收尾幀入列時，同 session 已入列的幀一併提前（不被擠出、不與收尾幀顛倒順序）
+        accepted, evicted = self.pool.submit(key, *item, urgent=urgent, evict_after=shedder.evict_after,
+                                             group=session_key)
+        if evicted is not None:
+            shedder.shed(self._item_session(evicted))
+            self._on_shed("oldest")
+        elif not accepted:
+            shedder.shed(session_key)
+            self._on_shed("full")
+
+    def _report_shed(self, session_key, final=True):
+        """把 session 尚未轉告的丟棄數以優先項目交給其 worker；入列失敗時退回，稍後由 housekeeping 重送。
+
+        final：之後不再有此 session 的幀（收尾幀或 housekeeping 重送），同 session 已入列的幀先移到通知之前，
+        worker 處理通知時即可決策；否則通知不移動其他幀（worker 此時還不會湊滿），不佔用一般佇列的空間。
+        """
+        n = self.shedder.take_shed(session_key)
+        if not n:
+            return
+        device, session = session_key
+        payload = str(n).encode()
+        if self.pool.mode == 'thread':
+            item = (self._handle_shed, session_key, payload)
+        else:
+            item = (f"{self.feat_prefix}/{device}/{session}/shed", payload)
+        group = session_key if final else None
+        if not self.pool.submit(session_key, *item, urgent=True, group=group)[0]:
+            self.shedder.shed(session_key, n)
+
+    def _item_session(self, item):
+        """由佇列項目取回 (device, session)（thread：(handler, fields, payload)；process：(topic, payload)）。"""
+        if self.pool.mode == 'thread':
+            return tuple(item[1][:2])
+        route = self.router.match(item[0])
+        return tuple(route[1][:2]) if route is not None else None
+
+    def _on_shed(self, reason):
+        self.m_shed.inc(reason)
+        now = time.monotonic()
+        if now - self._shed_logged >= 5.0:
+            self._shed_logged = now
+            print(f"⚠️ 過載：ingest 佇列 {self._pool_depth()}/{self.shedder.capacity}，"
+                  f"依 {self.shedder.policy} 丟棄（{reason}）")
+
+    def _pool_depth(self):
+        return sum(d for d in self.pool.depths() if d > 0)
+
+    def _queue_depth(self):
+        depth = self._pool_depth() if self.pool is not None else 0
+        if self.batcher is not None:
+            depth += self.batcher.pending()
+        if self.replies is not None:
+            depth += self.replies.pending()
+        return depth
+
+    def _shard_key(self, fields, payload: bytes):
+        """回傳 (device, session)；info 訊息（無欄位）需解析 JSON 取得。"""
+        if not fields:
+            info = json.loads(payload)
+            return (info.get('device'), info.get('session'))
+        if self.stream_mode:
+            # 串流狀態以裝置為單位，同一裝置須由同一 worker 依序處理
+            return fields[0]
+        return fields[:2]
+
+    def _dispatch(self, topic: str, payload: bytes):
+        route = self.router.match(topic)
+        if route is not None:
+            self._dispatch_route(route[0], route[1], payload)
+
+    def _dispatch_route(self, handler, fields, payload: bytes):
         try:
-            feat_prefix = self.topics.get('feature_prefix', 'esp32/feat')
-            if topic == f"{feat_prefix}/info":
-                self._handle_info(msg.payload)
-            elif topic.startswith(f"{feat_prefix}/"):
-                self._handle_feature(topic, msg.payload)
+            handler(payload, *fields)
         except Exception as e:
             print(f"⚠️ 處理訊息錯誤: {e}")
 
@@ -70,43 +405,351 @@ class FeatureServer:
             device = info.get('device')
             session = info.get('session')
             frames = int(info.get('frames', 0))
-            if device and session:
-                self.session_meta[(device, session)] = {"frames": frames}
-                print(f"ℹ️ 會話資訊 device={device} session={session} frames={frames}")
+            if device and session and (device, session) not in self.decided:
+                self.session_meta.set((device, session), {"frames": frames})
+                if self.log_messages:
+                    print(f"ℹ️ 會話資訊 device={device} session={session} frames={frames}")
         except Exception as e:
             print(f"⚠️ 解析 info 失敗: {e}")
 
-    def _handle_feature(self, topic: str, payload: bytes):
-        parts = topic.split('/')
-        # {feat_prefix}/{device}/{session}/{idx}
-        device, session, idx = parts[-3], parts[-2], int(parts[-1])
-        obj = json.loads(payload.decode('utf-8'))
+    def _handle_feature(self, payload: bytes, device: str, session: str, idx: int):
+        # 每則訊息自動偵測 JSON/Binary 格式
+        t0 = time.perf_counter()
+        if self.stream_mode:
+            if self.recent_frames.seen((device, session, idx)):
+                self.m_dup.inc("redelivered")
+                return
+            meta, raw = decode_frame(payload)
+            self._handle_stream_frame(device, session, meta, raw, t0)
+            return
+        done = self.decided.get((device, session))
+        if done is not None:
+            self._late_frame(device, session, idx, done)
+            return
+        self._with_session((device, session), self._accumulate_frame, payload, device, session, idx, t0)
+
+    def _handle_shed(self, payload: bytes, device: str, session: str):
+        """過載時此 session 有幀在入列前被丟棄：計入已到達的幀數，可能因此湊滿而決策。"""
+        if (device, session) in self.decided:
+            return
+        self._with_session((device, session), self._note_shed, int(payload), device, session)
+
+    def _with_session(self, key, fn, *args):
+        """處理期間標記此 session：其他執行緒（LRU/TTL）淘汰它時改由本執行緒處理完這則訊息後接手。"""
+        with self._busy_lock:
+            self._busy[key] = threading.get_ident()
+        try:
+            fn(*args)
+        finally:
+            with self._busy_lock:
+                del self._busy[key]
+                retired = self._retired.pop(key, ())
+            for acc, reason in retired:
+                self._evict_session(key, acc, reason)
+
+    def _note_shed(self, n: int, device: str, session: str):
+        acc = self.session_acc.get_or_create((device, session))
+        acc["shed"] = acc.get("shed", 0) + n
+        if self.log_messages:
+            print(f"🗑️ {device}/{session} 過載丟棄 {n} 幀（共 {acc['shed']} 幀）")
+        self._maybe_decide(device, session, acc)
+
+    def _accumulate_frame(self, payload: bytes, device: str, session: str, idx: int, t0: float):
+        meta, raw = decode_frame(payload)
+        shape = meta.get('shape')
+        acc = self.session_acc.get_or_create((device, session))
+        frames_buf = acc.get("buf")
+        if frames_buf is None:
+            bins = int(shape[1]) if shape_ok(shape) else 0
+            rows = int(shape[0]) if shape_ok(shape) else 1
+            # 只有模型與封存需要完整張量；能量規則只保留 bitmap
+            keep = self.model is not None or self.archive is not None
+            frames_buf = SessionFrames(self.frame_pool, bins if keep else 0, rows)
+            acc["buf"] = frames_buf
+        if frames_buf.seen(idx):
+            self.m_dup.inc("redelivered")
+            if self.log_messages:
+                print(f"♻️ {device}/{session} 重複幀#{idx}，略過")
+            return
         # 解析與累積
-        values, dtype = self._decode_feature_values(obj)
-        acc = self.session_acc[(device, session)]
-        acc["sum"] += sum(values)
+        values, dtype = self._decode_feature_values(meta, raw)
+        self.m_decode.observe(time.perf_counter() - t0)
+        tensor_rows = None
+        if frames_buf.buf is not None and isinstance(values, np.ndarray) and shape_ok(shape):
+            tensor_rows = values.reshape(-1, int(shape[1]))
+        try:
+            stored = frames_buf.put(idx, tensor_rows)
+        except ValueError as e:
+            print(f"⚠️ {device}/{session} 幀#{idx} {e}，略過")
+            return
+        if not stored:
+            print(f"⚠️ {device}/{session} 幀#{idx} 超出緩衝容量（{frames_buf.max_msgs}），略過")
+            return
+        acc["sum"] += self._sum_values(values)
         acc["count"] += len(values)
         acc["dtype"] = dtype
-        expect = self.session_meta.get((device, session), {}).get('frames', 0)
-        # 使用 frames 計數（而非值數）作為是否決策的門檻
-        frame_count = acc.get("frames", 0) + 1
+        acc["ts"] = meta.get('ts')
+        # 使用不重複的訊息數（而非值數）作為是否決策的門檻
+        frame_count = frames_buf.received
         acc["frames"] = frame_count
-        shape = obj.get('shape')
-        print(f"📥 {device}/{session} 收到幀#{idx}（幀 {frame_count}/{expect}），shape={shape}")
+        if self.log_messages:
+            expect = self.session_meta.get((device, session), {}).get('frames', 0)
+            print(f"📥 {device}/{session} 收到幀#{idx}（幀 {frame_count}/{expect}），shape={shape}")
+        self._maybe_decide(device, session, acc)
 
-        # Demo 策略：收到 N 幀就回覆一次結果
+    def _maybe_decide(self, device: str, session: str, acc):
+        """Demo 策略：已到達 N 幀（收到的幀加上過載丟棄的幀）或 info 宣告的幀數就回覆一次結果。"""
+        expect = self.session_meta.get((device, session), {}).get('frames', 0)
+        frame_count = acc.get("frames", 0)
+        shed = acc.get("shed", 0)
+        arrived = frame_count + shed
         N = int(self.server_cfg.get('frames_to_decide', 6))
-        if frame_count >= N or (expect and frame_count >= expect):
-            self._reply_inference(device, session)
-            # 清空此 session（單次決策）
-            if (device, session) in self.session_acc:
-                del self.session_acc[(device, session)]
-            if (device, session) in self.session_meta:
-                del self.session_meta[(device, session)]
-
-    def _reply_inference(self, device: str, session: str):
-        # 簡單規則：以整段均值做活動度（u8 → 0..1；f32 假定 0..1）
-        acc = self.session_acc.get((device, session), {"sum": 0.0, "count": 1, "dtype": "u8", "frames": 0})
+        if arrived < N and not (expect and arrived >= expect):
+            return
+        # 清空此 session（單次決策）；緩衝區所有權交給 _reply_inference
+        if self.session_acc.pop((device, session)) is None:
+            return  # 已被其他執行緒淘汰：由淘汰流程（本執行緒稍後接手）決策或釋放
+        self.session_meta.pop((device, session))
+        if not frame_count:
+            # 全部被丟棄：沒有可決策的幀
+            if acc.get("buf") is not None:
+                acc["buf"].release()
+            return
+        self._mark_decided(device, session)
+        # 未宣告幀數時以已到達的幀數為範圍，被丟棄的幀計入 missing
+        self._reply_inference(device, session, acc, expect or (arrived if shed else 0))
+
+    def _mark_decided(self, device: str, session: str):
+        """session 進入決策：之後到達的幀一律視為遲到（結果出來前直接丟棄）。"""
+        self.decided.set((device, session), {"payload": None, "sent": 0.0})
+
+    def _late_frame(self, device: str, session: str, idx: int, done):
+        """已決策 session 的幀：重送快取的回覆（每 session 每 dedup_republish_s 秒最多一次）。"""
+        self.m_dup.inc("late")
+        payload = done.get("payload")
+        now = time.monotonic()
+        if payload is None or now - done["sent"] < self.republish_s:
+            return
+        done["sent"] = now
+        self._emit_result(device, payload)
+        if self.log_messages:
+            print(f"🔁 {device}/{session} 幀#{idx} 於決策後到達，重送結果")
+
+    def _handle_stream_frame(self, device: str, session: str, meta, raw, t0):
+        """串流模式：寫入裝置滑動視窗，每 H 幀推論一次，平滑分數越過門檻才回覆。"""
+        shape = meta.get('shape')
+        if not shape_ok(shape):
+            return
+        values, dtype = self._decode_feature_values(meta, raw)
+        self.m_decode.observe(time.perf_counter() - t0)
+        rows = values.reshape(-1, int(shape[1]))
+        bank = self._stream_bank(rows.shape[1])
+        if rows.shape[1] != bank.bins:
+            print(f"⚠️ {device} 特徵 bins={rows.shape[1]} 與串流視窗 {bank.bins} 不符，略過")
+            return
+        if self.archive is not None:
+            self.archive.append(device, session, rows, dtype, meta.get('ts'))
+        s = bank.slot(device)
+        due = bank.push(s, rows)
+        if self.model is not None:
+            if self.use_cmvn:
+                # 視窗中最新的幀就地正規化（原始 payload 為唯讀視圖，不可直接改）
+                self._apply_cmvn(device, bank.recent(s, rows.shape[0]))
+            if not due:
+                return
+            probs, latency_ms = self.model.posteriors(bank.window_blocks(s))
+            self.m_infer.observe(latency_ms / 1000.0)
+        else:
+            # 能量規則：每幀一個分數（u8 → 0..1），每幀平滑一次
+            t0 = time.perf_counter()
+            score = self._sum_values(values) / max(1, len(values))
+            probs = (score / 255.0 if dtype == 'u8' else score,)
+            latency_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+        hit = bank.update(s, probs)
+        if hit is not None:
+            label, score = hit
+            result = {"result": label, "conf": round(score, 3), "latency_ms": latency_ms, "mode": "stream"}
+            self._publish_result(device, session, bank.window, 0, result, meta.get('ts'))
+
+    def _stream_bank(self, bins):
+        if self.stream is None:
+            with self._stream_lock:
+                if self.stream is None:
+                    cfg = self.server_cfg
+                    labels = self.model.labels if self.model is not None else ("yes",)
+                    self.stream = StreamBank(
+                        bins, window=cfg.get('stream_window', 49), hop=cfg.get('stream_hop', 10),
+                        max_devices=cfg.get('stream_max_devices', 2048), labels=labels,
+                        alpha=cfg.get('stream_alpha', 0.5), threshold=cfg.get('stream_threshold', 0.8),
+                        refractory_ms=cfg.get('stream_refractory_ms', 1000))
+                    print(f"🌊 串流模式：W={self.stream.window} H={self.stream.hop} F={bins}，"
+                          f"最多 {self.stream.max_devices} 台裝置")
+        return self.stream
+
+    def _apply_cmvn(self, device, blocks, masks=None):
+        if self.cmvn is None:
+            with self._stream_lock:
+                if self.cmvn is None:
+                    self.cmvn = self._load_cmvn(blocks[0].shape[1])
+        if blocks[0].shape[1] != self.cmvn.bins:
+            print(f"⚠️ {device} 特徵 bins={blocks[0].shape[1]} 與 CMVN 統計 {self.cmvn.bins} 不符，不正規化")
+            return
+        self.cmvn.apply(device, blocks, masks)
+
+    def _load_cmvn(self, bins):
+        cfg = self.server_cfg
+        cmvn = OnlineCMVN(bins, max_devices=cfg.get('cmvn_max_devices', 4096), decay=cfg.get('cmvn_decay', 0.999))
+        path = cfg.get('cmvn_path', '')
+        if path and os.path.exists(path):
+            try:
+                print(f"📐 CMVN：載入 {cmvn.load(path)} 台裝置的統計（{path}）")
+            except Exception as e:
+                print(f"⚠️ CMVN 統計載入失敗（{path}）: {e}，重新累積")
+        else:
+            print(f"📐 CMVN：F={bins}，decay={cmvn.decay}，最多 {cmvn.max_devices} 台裝置")
+        return cmvn
+
+    def _save_cmvn(self):
+        path = self.server_cfg.get('cmvn_path', '')
+        if self.cmvn is None or not path:
+            return
+        try:
+            self.cmvn.save(path)
+        except Exception as e:
+            print(f"⚠️ CMVN 統計保存失敗（{path}）: {e}")
+        self._cmvn_saved = time.monotonic()
+
+    def _on_session_evicted(self, key, acc, reason):
+        """session 過期或被 LRU 淘汰（可能於任一 worker 或 housekeeping 執行緒）。
+
+        若另一個執行緒正在處理此 session 的幀（仍持有 acc、可能正寫入其緩衝區），
+        交由該執行緒處理完當前訊息後接手，不在此釋放緩衝區。
+        """
+        with self._busy_lock:
+            owner = self._busy.get(key)
+            if owner is not None and owner != threading.get_ident():
+                self._retired.setdefault(key, []).append((acc, reason))
+                return
+        self._evict_session(key, acc, reason)
+
+    def _evict_session(self, key, acc, reason):
+        """淘汰 session：有過載丟棄的幀或設定 session_flush_on_expire 時以已收到的部分幀做一次決策，
+        否則釋放幀緩衝區。"""
+        device, session = key
+        self.session_meta.pop(key)
+        flush = self.server_cfg.get('session_flush_on_expire') or acc.get("shed", 0) > 0
+        if flush and acc.get("frames", 0) > 0:
+            print(f"⌛ {device}/{session} 未湊滿即淘汰（{reason}），以 {acc['frames']} 幀決策")
+            self._mark_decided(device, session)
+            self._reply_inference(device, session, acc, acc["frames"] + acc.get("shed", 0))
+        elif acc.get("buf") is not None:
+            acc["buf"].release()
+
+    def _housekeeping(self):
+        while True:
+            time.sleep(1.0)
+            try:
+                self.session_acc.expire()
+                self.session_meta.expire()
+                self.decided.expire()
+                if self.shedder is not None:
+                    self.shedder.expire()
+                    # 佇列滿而未能轉告的丟棄數（例如 process 模式的收尾幀也被丟棄）
+                    for key in self.shedder.unreported_keys():
+                        self._report_shed(key)
+                if time.monotonic() - self._cmvn_saved >= self.server_cfg.get('cmvn_save_s', 60.0):
+                    self._save_cmvn()
+            except Exception as e:
+                print(f"⚠️ session 淘汰錯誤: {e}")
+
+    def _reply_inference(self, device: str, session: str, acc, expect=0):
+        """對一個已自 session 表移除的累積器做決策並回覆；結束後釋放其幀緩衝區。"""
+        key, tensor = self._decision_key(device, session, acc, expect)
+        if self.model is not None and tensor is not None and len(tensor) and self._degraded():
+            # 過載降級：以能量規則決策，不佔用模型
+            self.m_shed.inc("degraded")
+            tensor = None
+        if self.model is not None and tensor is not None and len(tensor):
+            if self.batcher is not None:
+                # 交給微批次排程器；緩衝區待批次完成後才釋放（推論失敗時以能量規則回覆）
+                self.batcher.submit(key, tensor, fallback=self._energy_decision(acc))
+                return
+            result = self.model.infer(tensor)
+        else:
+            result = self._energy_decision(acc)
+        self._finish_decision(key, result)
+
+    def _degraded(self):
+        return self.shedder is not None and self.shedder.degraded
+
+    def _decision_key(self, device: str, session: str, acc, expect=0):
+        """整理決策所需資訊：回傳 (key, tensor)，key 為 _finish_decision 使用的
+        (device, session, frames, missing, frames_buf, frame_ts)，tensor 為 [T, F] 視圖或 None。
+        啟用封存時於此複製一份交給封存執行緒（之後緩衝區會被釋放重用）。"""
+        frames_buf = acc.get("buf")
+        missing = frames_buf.missing(expect) if frames_buf is not None else 0
+        tensor = frames_buf.tensor(expect) if frames_buf is not None else None
+        if self.archive is not None and tensor is not None and len(tensor):
+            self.archive.append(device, session, tensor, acc.get("dtype", "u8"), acc.get("ts"))
+        if self.use_cmvn and self.model is not None and tensor is not None and len(tensor):
+            # 缺幀補零的列不併入統計
+            self._apply_cmvn(device, [tensor], [frames_buf.present_rows(expect)])
+        return (device, session, int(acc.get("frames", 0)), missing, frames_buf, acc.get("ts")), tensor
+
+    def _finish_decision(self, key, result):
+        """釋放幀緩衝區、記錄推論時間並回覆（亦為微批次排程器的完成回呼）。"""
+        device, session, frames, missing, frames_buf, frame_ts = key
+        if frames_buf is not None:
+            frames_buf.release()
+        self.m_infer.observe(result["latency_ms"] / 1000.0)
+        payload = self._publish_result(device, session, frames, missing, result, frame_ts)
+        done = self.decided.get((device, session))
+        if done is not None:
+            done["payload"] = payload
+            done["sent"] = time.monotonic()
+
+    def _publish_result(self, device: str, session: str, frames: int, missing: int, result: dict, frame_ts=None):
+        now_ms = int(time.time() * 1000)
+        payload = {
+            "ts": now_ms,
+            "session": session,
+            "frames": frames,
+            "missing": missing,
+            **result,
+        }
+        self._emit_result(device, payload)
+        if frame_ts:
+            # 以裝置幀時間戳計算，裝置時鐘偏差會直接反映在此指標（合併模式不含合併等待）
+            self.m_e2e.observe(max(0.0, (now_ms - int(frame_ts)) / 1000.0))
+        if self.log_messages:
+            print(f"✅ 回覆推論 {payload} → {self.infer_prefix}/{device}")
+        return payload
+
+    def _emit_result(self, device: str, payload: dict):
+        """依 reply_mode 立即發佈單一結果，或交給 ReplyCoalescer 合併。"""
+        if self.replies is not None:
+            self.replies.submit(device, payload)
+            return
+        if self.reply_binary:
+            body = encode_results([payload])
+        else:
+            body = json.dumps(payload).encode('utf-8')
+        self._publish_raw(f"{self.infer_prefix}/{device}", body)
+
+    def _publish_results(self, device: str, results: list):
+        """合併回覆：同一裝置的多筆結果 → 一則 JSON 陣列或回覆 Binary v1。"""
+        if self.reply_binary:
+            body = encode_results(results)
+        else:
+            body = json.dumps(results).encode('utf-8')
+        self._publish_raw(f"{self.infer_prefix}/{device}", body)
+
+    def _publish_raw(self, topic: str, payload: bytes):
+        self.client.publish(topic, payload, qos=0, retain=False)
+
+    def _energy_decision(self, acc):
+        """簡單規則：以整段均值做活動度（u8 → 0..1；f32 假定 0..1）。"""
+        t0 = time.perf_counter()
         mean_val = (acc["sum"] / max(1, acc["count"]))
         if acc.get("dtype") == "u8":
             score = mean_val / 255.0
@@ -119,42 +762,80 @@ class FeatureServer:
         else:
             label = "no"
             conf = round(max(0.51, 0.9 * (1 - (thr - score))), 2)
-        frames = int(acc.get("frames", 0))
-        payload = {
-            "ts": int(time.time() * 1000),
-            "session": session,
-            "frames": frames,
+        return {
             "result": label,
             "conf": conf,
-            "score": round(score, 3)
+            "score": round(score, 3),
+            "latency_ms": round((time.perf_counter() - t0) * 1000.0, 3),
         }
-        infer_prefix = self.topics.get('infer_prefix', 'esp32/infer')
-        topic = f"{infer_prefix}/{device}"
-        self.client.publish(topic, json.dumps(payload).encode('utf-8'), qos=0, retain=False)
-        print(f"✅ 回覆推論 {payload} → {topic}")
-
-    def _decode_feature_values(self, obj):
-        """將一幀特徵 JSON 還原為數值列表與資料型別標記。"""
-        b64 = obj.get('data', '')
-        q = obj.get('q', 'u8')
-        raw = base64.b64decode(b64) if b64 else b''
-        shape = obj.get('shape', [1, 0])
+
+    def _start_archive(self):
+        root = self.server_cfg.get('archive_dir', '')
+        if not root:
+            return None
+        if np is None:
+            print("⚠️ 未安裝 numpy，無法封存特徵")
+            return None
+        archive = FeatureArchive(root, segment_mb=self.server_cfg.get('archive_segment_mb', 64),
+                                 segment_s=self.server_cfg.get('archive_segment_s', 3600),
+                                 max_pending=self.server_cfg.get('archive_queue', 1024)).start()
+        print(f"📦 特徵封存: {root}")
+        return archive
+
+    def _load_model(self):
+        """依 [server] model / model_path 載入模型後端；失敗時退回能量規則。"""
+        kind = self.server_cfg.get('model', 'energy')
+        if kind == 'energy':
+            return None
+        if np is None:
+            print("⚠️ 未安裝 numpy，無法使用模型後端，改用能量規則")
+            return None
+        from kws_model import load_model
+        path = self.server_cfg.get('model_path')
+        try:
+            model = load_model(kind, path, max_batch=max(1, int(self.server_cfg.get('batch_size', 1))))
+        except Exception as e:
+            print(f"⚠️ 模型載入失敗（{kind}: {path}）: {e}，改用能量規則")
+            return None
+        print(f"🧠 已載入模型 {kind}: {path}，labels={list(model.labels)}")
+        return model
+
+    def _decode_feature_values(self, meta, raw):
+        """將一幀特徵（meta + 原始位元組）還原為數值序列與資料型別標記。
+
+        raw 可為 bytes 或 memoryview（Binary 格式）。有 numpy 時回傳
+        `np.frombuffer` 視圖（u8 / little-endian f32，不複製）；否則回傳 Python 列表。
+        兩者皆支援 len() 並可交給 `_sum_values` 累加。
+        """
+        q = meta.get('q', 'u8')
+        shape = meta.get('shape', [1, 0])
         count = int(shape[0]) * int(shape[1]) if shape and len(shape) == 2 else len(raw)
-        values = []
         if q == 'u8':
             # 直接解析為 0..255
-            values = list(raw[:count])
+            count = min(count, len(raw))
+            if np is not None:
+                values = np.frombuffer(raw, dtype=np.uint8, count=count)
+            else:
+                values = list(raw[:count])
             dtype = 'u8'
         else:
-            # 以 little-endian float32 解析
-            import struct
-            values = list(struct.unpack('<' + 'f' * (len(raw) // 4), raw))
-            # 截斷到 shape 對應長度
-            if len(values) > count:
-                values = values[:count]
+            # 以 little-endian float32 解析，並截斷到 shape 對應長度
+            count = min(count, len(raw) // 4)
+            if np is not None:
+                values = np.frombuffer(raw, dtype='<f4', count=count)
+            else:
+                values = list(struct.unpack_from('<' + 'f' * count, raw))
             dtype = 'f32'
         return values, dtype
 
+    @staticmethod
+    def _sum_values(values) -> float:
+        """累加一幀數值；numpy 視圖走向量化路徑（u8 以 uint64、f32 以 float64 累加）。"""
+        if np is not None and isinstance(values, np.ndarray):
+            acc_dtype = np.uint64 if values.dtype == np.uint8 else np.float64
+            return float(values.sum(dtype=acc_dtype))
+        return float(sum(values))
+
 
 if __name__ == "__main__":
     FeatureServer().run()
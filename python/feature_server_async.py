@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 版特徵伺服器（大量裝置）
+- 與 FeatureServer 共用 MQTTConfig 主題、解碼與決策邏輯，只替換 I/O 與推論排程
+- 四個 async 階段以有界 asyncio.Queue 串接；下游滿時上游 await，背壓一路傳回 TCP 連線：
+    ingest  : 讀取 socket、解析 MQTT 封包             → ingest_q
+    decode  : 主題路由 + 解碼 + session 累積；湊滿的 session → infer_q
+    infer   : 一次取出最多 batch_size 個 session，以 run_in_executor 執行模型 → publish_q
+    publish : 寫回 socket，每批只 drain 一次
+- 內建最小 MQTT 3.1.1 client（QoS 0），不使用 paho 的阻塞 loop_forever
+- 串流模式（infer_mode = stream）的視窗推論仍於 decode 階段內執行
+
+執行：python feature_server_async.py（設定同 feature_server.py；佇列上限見 [server] async_queue_size）
+"""
+
+import asyncio
+import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from feature_server import FeatureServer
+from mqtt_broker_core import (CONNACK, PINGREQ, PUBLISH, encode_publish,
+                              encode_remaining_length)
+
+
+class AsyncMQTTClient:
+    """最小 asyncio MQTT 3.1.1 client：CONNECT / SUBSCRIBE / QoS 0 PUBLISH / PINGREQ。"""
+
+    def __init__(self, client_id="", keepalive=60):
+        self.client_id = client_id
+        self.keepalive = int(keepalive)
+        self.reader = None
+        self.writer = None
+        self._packet_id = 0
+        self._pinger = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        cid = self.client_id.encode('utf-8')
+        # 協定名稱 "MQTT"、level 4、flags = clean session
+        body = b"".join((struct.pack(">H", 4), b"MQTT", bytes([4, 0x02]), struct.pack(">H", self.keepalive),
+                         struct.pack(">H", len(cid)), cid))
+        self.writer.write(bytes([0x10]) + encode_remaining_length(len(body)) + body)
+        await self.writer.drain()
+        packet = await self.read_packet()
+        if packet is None or packet[0] != CONNACK or packet[2][1] != 0:
+            raise ConnectionError(f"CONNACK 失敗: {packet}")
+        if self.keepalive:
+            self._pinger = asyncio.create_task(self._ping_loop())
+
+    def subscribe(self, topics):
+        """送出 SUBSCRIBE（QoS 0）；SUBACK 由讀取迴圈略過。"""
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        body = bytearray(struct.pack(">H", self._packet_id))
+        for topic in topics:
+            t = topic.encode('utf-8')
+            body += struct.pack(">H", len(t)) + t + b"\x00"
+        self.writer.write(bytes([0x82]) + encode_remaining_length(len(body)) + bytes(body))
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """寫入傳送緩衝（不等待）；呼叫端以 drain() 控制背壓。"""
+        self.writer.write(encode_publish(topic, payload))
+
+    def publish_packet(self, packet):
+        """寫入預先編碼好的 PUBLISH 封包（重播工具用，省去逐則編碼）。"""
+        self.writer.write(packet)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def read_packet(self):
+        """讀取一個完整封包 (type, flags, body)；連線結束時回傳 None。"""
+        read = self.reader.readexactly
+        try:
+            # 固定標頭至少 2 位元組；剩餘長度多於一個位元組時才逐一讀取
+            head = await read(2)
+            b = head[1]
+            remaining = b & 0x7F
+            multiplier = 128
+            while b & 0x80:
+                if multiplier > 128 ** 3:
+                    raise ConnectionError("剩餘長度編碼超過 4 位元組")
+                b = (await read(1))[0]
+                remaining += (b & 0x7F) * multiplier
+                multiplier *= 128
+            body = await read(remaining) if remaining else b""
+        except asyncio.IncompleteReadError:
+            return None
+        return head[0] >> 4, head[0] & 0x0F, body
+
+    async def messages(self):
+        """依序產生收到的 (topic, payload)；其他封包（SUBACK、PINGRESP…）略過。"""
+        while True:
+            packet = await self.read_packet()
+            if packet is None:
+                return
+            msg_type, flags, body = packet
+            if msg_type != PUBLISH:
+                continue
+            topic_len = struct.unpack_from(">H", body)[0]
+            offset = 2 + topic_len
+            if (flags >> 1) & 0x03:
+                offset += 2  # QoS > 0 的 packet id
+            yield body[2:2 + topic_len].decode('utf-8'), body[offset:]
+
+    async def _ping_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self.writer.write(bytes([PINGREQ << 4, 0x00]))
+
+    async def close(self):
+        if self._pinger is not None:
+            self._pinger.cancel()
+        if self.writer is not None:
+            try:
+                self.writer.write(b"\xe0\x00")  # DISCONNECT
+                self.writer.close()
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+
+class AsyncFeatureServer(FeatureServer):
+    """以 asyncio 階段管線處理特徵訊息的 FeatureServer。"""
+
+    # 推論由 infer 階段自行批次，不另起 MicroBatcher 執行緒；合併回覆由 reply 階段到期送出
+    use_batcher = False
+    use_reply_thread = False
+
+    def __init__(self):
+        self.mqtt = AsyncMQTTClient()
+        super().__init__(client=self.mqtt, workers=0)
+        client_cfg = self.cfg.get_client_config()
+        self.mqtt.client_id = f"{client_cfg['client_id_prefix']}feature_async_{os.getpid()}"
+        self.mqtt.keepalive = client_cfg['keep_alive']
+        self.queue_size = max(1, int(self.server_cfg.get('async_queue_size', 1024)))
+        self.max_batch = max(1, int(self.server_cfg.get('batch_size', 1)))
+        self.ingest_q = None
+        self.infer_q = None
+        self.publish_q = None
+        # 模型持有鎖，同時只會有一個前向傳遞；單一執行緒即可
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feat-infer")
+        self._ready = deque()   # 湊滿待推論的 session（housekeeping 執行緒淘汰時也可能加入）
+        self._outbox = deque()  # 同步程式碼產生、待交給 publish 階段的 (topic, payload)
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self._start_metrics()
+        self.ingest_q = asyncio.Queue(self.queue_size)
+        self.infer_q = asyncio.Queue(self.queue_size)
+        self.publish_q = asyncio.Queue(self.queue_size)
+        workers = [
+            asyncio.create_task(self._decode_stage(), name="decode"),
+            asyncio.create_task(self._infer_stage(), name="infer"),
+            asyncio.create_task(self._publish_stage(), name="publish"),
+            asyncio.create_task(self._tick_stage(), name="tick"),
+        ]
+        if self.replies is not None:
+            workers.append(asyncio.create_task(self._reply_stage(), name="reply"))
+        try:
+            while True:
+                try:
+                    print(f"🌐 連接 MQTT: {self.host}:{self.port}（asyncio，佇列上限 {self.queue_size}）")
+                    await self.mqtt.connect(self.host, self.port)
+                    self.mqtt.subscribe(self.subscription_topics())
+                    await self.mqtt.drain()
+                    print("✅ 連接成功。已訂閱特徵主題")
+                    await self._ingest_stage()
+                    print("⚠️ 連線中斷，2 秒後重新連線")
+                except (ConnectionError, OSError) as e:
+                    print(f"⚠️ MQTT 連線錯誤: {e}，2 秒後重試")
+                await self.mqtt.close()
+                await asyncio.sleep(2.0)
+        finally:
+            for task in workers:
+                task.cancel()
+            self.executor.shutdown(wait=False)
+            self._close()
+
+    # 階段
+    async def _ingest_stage(self):
+        put = self.ingest_q.put
+        async for topic, payload in self.mqtt.messages():
+            await put((topic, payload))
+
+    async def _decode_stage(self):
+        while True:
+            topic, payload = await self.ingest_q.get()
+            route = self.router.match(topic)
+            if route is not None:
+                handler, fields = route
+                if fields:
+                    self.m_ingest.inc(fields[0])
+                self._dispatch_route(handler, fields, payload)
+            if self._ready:
+                await self._flush_ready()
+            if self._outbox:
+                await self._flush_outbox()
+
+    async def _infer_stage(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.infer_q.get()]
+            while len(batch) < self.max_batch and not self.infer_q.empty():
+                batch.append(self.infer_q.get_nowait())
+            jobs = []
+            for device, session, acc, expect in batch:
+                key, tensor = self._decision_key(device, session, acc, expect)
+                if self.model is not None and tensor is not None and len(tensor):
+                    jobs.append((key, tensor, acc))
+                else:
+                    self._finish_decision(key, self._energy_decision(acc))
+            if jobs:
+                try:
+                    results = await loop.run_in_executor(
+                        self.executor, self.model.infer_batch, [tensor for _, tensor, _ in jobs])
+                except Exception as e:
+                    # 與 MicroBatcher 相同：改以能量規則回覆，session 不會懸而未決
+                    print(f"⚠️ 批次推論錯誤（{len(jobs)} 筆），改用能量規則: {e}")
+                    results = [self._energy_decision(acc) for _, _, acc in jobs]
+                for (key, _, _), result in zip(jobs, results):
+                    self._finish_decision(key, result)
+            await self._flush_outbox()
+
+    async def _publish_stage(self):
+        while True:
+            topic, payload = await self.publish_q.get()
+            self.mqtt.publish(topic, payload)
+            while not self.publish_q.empty():
+                topic, payload = self.publish_q.get_nowait()
+                self.mqtt.publish(topic, payload)
+            try:
+                await self.mqtt.drain()
+            except (ConnectionError, OSError) as e:
+                print(f"⚠️ 發佈失敗: {e}")
+
+    async def _tick_stage(self):
+        """把 housekeeping 執行緒淘汰後決策的 session 送進管線（沒有新訊息時也不會卡住）。"""
+        while True:
+            await asyncio.sleep(0.5)
+            await self._flush_ready()
+            await self._flush_outbox()
+
+    async def _reply_stage(self):
+        """reply_mode = coalesce：每個合併視窗檢查一次到期的裝置批次。"""
+        interval = max(0.001, self.replies.window)
+        while True:
+            await asyncio.sleep(interval)
+            if self.replies.flush_due():
+                await self._flush_outbox()
+
+    async def _flush_ready(self):
+        while self._ready:
+            await self.infer_q.put(self._ready.popleft())
+
+    async def _flush_outbox(self):
+        while self._outbox:
+            await self.publish_q.put(self._outbox.popleft())
+
+    # 覆寫 FeatureServer 的同步出口：只入列，由各階段 await 放入下游佇列
+    def _reply_inference(self, device: str, session: str, acc, expect=0):
+        self._ready.append((device, session, acc, expect))
+
+    def _publish_raw(self, topic: str, payload: bytes):
+        self._outbox.append((topic, payload))
+
+    def _queue_depth(self):
+        return sum(q.qsize() for q in (self.ingest_q, self.infer_q, self.publish_q) if q is not None)
+
+
+if __name__ == "__main__":
+    AsyncFeatureServer().run()
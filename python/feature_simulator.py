@@ -16,6 +16,7 @@ from datetime import datetime
 import paho.mqtt.client as mqtt
 
 from config import MQTTConfig
+from feature_codec import encode_binary_frame
 
 
 def now_ms() -> int:
@@ -58,6 +59,11 @@ def encode_payload(raw, shape, sr=16000, feat="logmel", win_ms=25, hop_ms=10, qu
     return payload
 
 
+def encode_binary_payload(raw, shape, sr=16000, feat="logmel", win_ms=25, hop_ms=10, quant="u8"):
+    """Binary v1 格式（見 feature_codec.py），省去 JSON 與 base64 開銷。"""
+    return encode_binary_frame(raw, shape, now_ms(), sr=sr, feat=feat, win_ms=win_ms, hop_ms=hop_ms, quant=quant)
+
+
 def main():
     cfg = MQTTConfig()
     host, port = cfg.get_broker_info()
@@ -70,13 +76,14 @@ def main():
     feat_type = os.environ.get("FEAT", "logmel")
     quant = os.environ.get("QUANT", "u8")  # u8/f32
     interval_ms = int(os.environ.get("INTERVAL_MS", "50"))
+    wire = os.environ.get("WIRE", "json")  # json/bin
 
     feat_prefix = topics.get('feature_prefix', 'esp32/feat')
     info_topic = f"{feat_prefix}/info"
 
     print(f"🌐 MQTT {host}:{port}")
     print(f"📦 發送主題前綴: {feat_prefix}/{device_id}/{session_id}")
-    print(f"🔧 參數: frames={frames}, bins={bins}, feat={feat_type}, q={quant}")
+    print(f"🔧 參數: frames={frames}, bins={bins}, feat={feat_type}, q={quant}, wire={wire}")
 
     client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
     client.connect(host, port, keepalive=60)
@@ -85,9 +92,12 @@ def main():
     try:
         for idx in range(frames):
             raw, shape, dtype = make_random_feature(num_frames=1, num_bins=bins, quant=quant)
-            payload = encode_payload(raw, shape, feat=feat_type, quant=dtype)
+            if wire == "bin":
+                body = encode_binary_payload(raw, shape, feat=feat_type, quant=dtype)
+            else:
+                body = json.dumps(encode_payload(raw, shape, feat=feat_type, quant=dtype)).encode("utf-8")
             topic = f"{feat_prefix}/{device_id}/{session_id}/{idx}"
-            client.publish(topic, json.dumps(payload).encode("utf-8"), qos=0, retain=False)
+            client.publish(topic, body, qos=0, retain=False)
             print(f"📤 發送 frame {idx} → {topic}")
             time.sleep(interval_ms / 1000.0)
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+每個 session 的幀緩衝區
+- 依 topic 的 idx 把幀寫入預配置的 [max_rows, F] float32 陣列，亂序到達也能還原時間順序
+- 以 bytearray 當 presence bitmap：重複幀 O(1) 偵測並丟棄，缺幀在取用張量時補零並計數
+- 陣列由 FramePool 依 F 回收重用，session 建立/結束不再配置新記憶體
+- 未安裝 numpy 時仍提供 bitmap（去重與缺幀統計），只是不保留張量
+"""
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 視執行環境而定
+    np = None
+
+
+class FramePool:
+    """依 bins 數 F 回收 [max_rows, F] 緩衝區的簡單 free list。"""
+
+    def __init__(self, max_rows=256, max_pooled=1024):
+        self.max_rows = int(max_rows)
+        self.max_pooled = int(max_pooled)
+        self._free = {}  # F → [ndarray]
+
+    def acquire(self, bins):
+        free = self._free.get(bins)
+        if free:
+            try:
+                return free.pop()
+            except IndexError:  # 其他執行緒剛取走最後一個
+                pass
+        return np.empty((self.max_rows, bins), dtype=np.float32)
+
+    def release(self, buf):
+        free = self._free.setdefault(buf.shape[1], [])
+        if len(free) < self.max_pooled:
+            free.append(buf)
+
+
+class SessionFrames:
+    """單一 session 依 idx 排列的幀與 presence bitmap。"""
+
+    __slots__ = ("pool", "buf", "rows_per_msg", "max_msgs", "present", "received",
+                 "duplicates", "overflow", "high")
+
+    def __init__(self, pool, bins, rows_per_msg):
+        self.pool = pool
+        self.rows_per_msg = max(1, int(rows_per_msg))
+        self.max_msgs = max(1, pool.max_rows // self.rows_per_msg)
+        self.buf = pool.acquire(bins) if (np is not None and bins) else None
+        self.present = bytearray(self.max_msgs)
+        self.received = 0
+        self.duplicates = 0
+        self.overflow = 0
+        self.high = 0  # 已見過的最大 idx + 1
+
+    def seen(self, idx) -> bool:
+        return 0 <= idx < self.max_msgs and self.present[idx] != 0
+
+    def put(self, idx, values=None) -> bool:
+        """寫入第 idx 則訊息；重複或超出容量時回傳 False（呼叫端應略過此幀）。
+
+        values 的 bins 與緩衝區不符時拋出 ValueError，且不標記此幀（不會被當成已收到）。
+        """
+        if idx < 0 or idx >= self.max_msgs:
+            self.overflow += 1
+            return False
+        if self.present[idx]:
+            self.duplicates += 1
+            return False
+        if self.buf is not None and values is not None and (values.ndim != 2 or values.shape[1] != self.buf.shape[1]):
+            raise ValueError(f"幀 shape {values.shape} 與 session 的 bins={self.buf.shape[1]} 不符")
+        self.present[idx] = 1
+        self.received += 1
+        if idx + 1 > self.high:
+            self.high = idx + 1
+        if self.buf is not None and values is not None:
+            start = idx * self.rows_per_msg
+            n = min(values.shape[0], self.rows_per_msg)
+            self.buf[start:start + n] = values[:n]
+            if n < self.rows_per_msg:
+                self.buf[start + n:start + self.rows_per_msg] = 0.0
+        return True
+
+    def missing(self, expect=0) -> int:
+        """目前缺少的訊息數（以已見最大 idx 或宣告的總幀數為範圍）。"""
+        span = min(max(self.high, int(expect or 0)), self.max_msgs)
+        return span - self.received if span > self.received else 0
+
+    def tensor(self, expect=0):
+        """回傳依時間排序的 [T, F] 視圖（缺幀補零，不複製）；無 numpy 時回傳 None。"""
+        if self.buf is None:
+            return None
+        span = min(max(self.high, int(expect or 0)), self.max_msgs)
+        idx = self.present.find(0, 0, span)
+        while idx != -1:
+            start = idx * self.rows_per_msg
+            self.buf[start:start + self.rows_per_msg] = 0.0
+            idx = self.present.find(0, idx + 1, span)
+        return self.buf[:span * self.rows_per_msg]
+
+    def present_rows(self, expect=0):
+        """tensor() 各列是否來自實際收到的幀（[T] bool）；沒有缺幀時回傳 None。"""
+        if self.buf is None:
+            return None
+        span = min(max(self.high, int(expect or 0)), self.max_msgs)
+        if self.present.find(0, 0, span) == -1:
+            return None
+        mask = np.frombuffer(self.present, dtype=np.uint8, count=span) != 0
+        return np.repeat(mask, self.rows_per_msg)
+
+    def release(self):
+        """session 結束：把緩衝區交還 pool（之後不得再使用 tensor() 的視圖）。"""
+        if self.buf is not None:
+            self.pool.release(self.buf)
+            self.buf = None
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+訊息處理 worker 池
+- 網路執行緒只負責把訊息（如 (topic, payload) 或已解析的路由）放入佇列，不做解碼/推論
+- 依 shard key（如 (device, session)）固定分派到同一 worker，確保同一 session 依序處理
+- mode="thread"：執行緒 worker，共用同一個處理器
+- mode="process"：每個 worker 為獨立行程，由 handler_factory 在子行程內建立處理器，
+  可讓 CPU 密集的解碼使用多核心；子行程的輸出 (topic, payload) 經佇列交回主行程發佈
+- capacity > 0 時佇列有上限（見 ingress_queue.py）：thread 模式分優先/一般兩條佇列，
+  process 模式為有上限的 multiprocessing 佇列（不分優先序，滿時不入列，不阻塞網路執行緒）
+"""
+
+import multiprocessing
+import queue
+import threading
+
+from ingress_queue import IngressQueue
+
+_STOP = None
+
+
+def _process_main(handler_factory, in_q, out_q):
+    """子行程進入點：建立處理器後依序處理分派到此 shard 的訊息。"""
+    handler = handler_factory(out_q)
+    while True:
+        item = in_q.get()
+        if item is _STOP:
+            break
+        try:
+            handler(*item)
+        except Exception as e:
+            print(f"⚠️ worker 處理訊息錯誤: {e}")
+
+
+class ShardedWorkerPool:
+    """依 shard key 分派訊息的固定大小 worker 池。"""
+
+    def __init__(self, handler=None, workers=2, mode="thread", handler_factory=None, on_output=None, capacity=0):
+        if mode not in ("thread", "process"):
+            raise ValueError("mode 必須是 'thread' 或 'process'")
+        if mode == "process" and (handler_factory is None or on_output is None):
+            raise ValueError("process 模式需要 handler_factory 與 on_output")
+        if mode == "thread" and handler is None:
+            raise ValueError("thread 模式需要 handler")
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.mode = mode
+        self.handler_factory = handler_factory
+        self.on_output = on_output
+        # 每個 worker 佇列的一般項目上限（0 = 不限）
+        self.capacity = max(0, int(capacity))
+        self.per_worker = -(-self.capacity // self.workers) if self.capacity else 0
+        self._queues = []
+        self._threads = []
+        self._procs = []
+        self._out_q = None
+
+    def start(self):
+        if self.mode == "thread":
+            for i in range(self.workers):
+                q = IngressQueue(self.per_worker)
+                t = threading.Thread(target=self._thread_main, args=(q,), name=f"feat-worker-{i}", daemon=True)
+                self._queues.append(q)
+                self._threads.append(t)
+                t.start()
+        else:
+            # spawn：避免 fork 已啟動網路執行緒的行程，且與 Windows 行為一致
+            ctx = multiprocessing.get_context("spawn")
+            self._out_q = ctx.Queue()
+            for i in range(self.workers):
+                q = ctx.Queue(self.per_worker)
+                p = ctx.Process(target=_process_main, args=(self.handler_factory, q, self._out_q),
+                                name=f"feat-worker-{i}", daemon=True)
+                self._queues.append(q)
+                self._procs.append(p)
+                p.start()
+            t = threading.Thread(target=self._drain_output, name="feat-worker-output", daemon=True)
+            self._threads.append(t)
+            t.start()
+        return self
+
+    def submit(self, key, *item, urgent=False, evict_after=None, group=None):
+        """將 item 放入 key 對應 worker 的佇列，worker 以 handler(*item) 處理
+        （僅入列，不阻塞網路執行緒做運算；process 模式的 item 必須可 pickle）。
+
+        回傳 (是否接受, 被擠出的舊 item 或 None)；thread 模式的 urgent 項目一定接受，
+        evict_after / group 見 IngressQueue.offer。
+        """
+        q = self._queues[hash(key) % self.workers]
+        if self.mode == "thread":
+            return q.offer(item, urgent, evict_after, group)
+        if not self.per_worker:
+            q.put(item)
+            return True, None
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            return False, None
+        return True, None
+
+    def depths(self):
+        """各 worker 佇列深度（process 模式於部分平台無法取得時回傳 -1）。"""
+        out = []
+        for q in self._queues:
+            try:
+                out.append(q.qsize())
+            except NotImplementedError:
+                out.append(-1)
+        return out
+
+    def stop(self):
+        for q in self._queues:
+            q.put(_STOP)
+        for p in self._procs:
+            p.join()
+        if self._out_q is not None:
+            self._out_q.put(_STOP)
+        for t in self._threads:
+            t.join()
+
+    def _thread_main(self, q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                break
+            try:
+                self.handler(*item)
+            except Exception as e:
+                print(f"⚠️ worker 處理訊息錯誤: {e}")
+
+    def _drain_output(self):
+        while True:
+            item = self._out_q.get()
+            if item is _STOP:
+                break
+            topic, payload = item
+            try:
+                self.on_output(topic, payload)
+            except Exception as e:
+                print(f"⚠️ 發佈 worker 輸出錯誤 {topic}: {e}")
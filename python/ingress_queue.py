@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+特徵 ingest 的有界佇列與過載丟棄（load shedding）
+- IngressQueue：thread 模式 worker 的佇列，分「優先」與「一般」兩條 FIFO，worker 先取優先佇列；
+  一般佇列有容量上限，優先佇列（info 與會讓 session 湊滿的收尾幀）不受上限限制。
+  收尾幀入列時，同一 session 仍在一般佇列中的幀依序一併移入優先佇列（排在收尾幀之前），
+  因此收尾幀不會先於同 session 的幀處理，這些幀也不會再被 drop_oldest 擠出：已湊滿的 session 一定會決策。
+  process 模式（multiprocessing 佇列）沒有優先佇列，佇列滿時優先項目同樣不入列並計入丟棄
+- LoadShedder：於網路執行緒判斷每則訊息的優先序與是否丟棄（[server] shed_policy）：
+    drop_oldest        佇列滿時，若最舊的一般幀已等待超過 shed_budget_ms（其 session 已超出延遲預算）即丟棄它改收新幀，
+                       否則丟棄新幀
+    drop_new_sessions  佇列深度超過 shed_watermark 後不再接受新 session 的幀（水位降下前該 session 的後續幀一併丟棄），
+                       進行中的 session 照常處理
+    degrade            佇列深度超過 shed_watermark 後以能量規則取代模型推論（低於一半水位時恢復）；
+                       僅 thread 模式，一般佇列滿時仍會丟棄新幀
+  任何政策下一般佇列滿時都會丟棄新幀。被丟棄的幀仍計入 session 的幀數（收尾幀照常判斷），
+  並記為該 session 的丟棄數，由呼叫端轉告 worker（take_shed）：worker 以「已收到 + 已丟棄」判斷湊滿，
+  以已收到的部分幀決策，回覆的 missing 反映被丟棄的幀。全部幀都被丟棄的 session 沒有回覆
+"""
+
+import threading
+import time
+from collections import deque
+
+from session_table import SessionTable
+
+POLICIES = ("drop_oldest", "drop_new_sessions", "degrade")
+_MOVED = object()  # 一般佇列中已移入優先佇列的項目
+
+
+class IngressQueue:
+    """兩條優先序的有界佇列；get() 先取優先佇列。"""
+
+    def __init__(self, capacity=0):
+        self.capacity = max(0, int(capacity))  # 0 = 不限（一般佇列）
+        self._urgent = deque()
+        self._normal = deque()  # [入列時間, group, item]；移入優先佇列後 item 設為 _MOVED
+        self._count = 0         # 一般佇列中尚未移出的項目數
+        self._groups = {}       # group → deque of 一般佇列項目（同 group 依入列順序）
+        self._cond = threading.Condition()
+
+    def qsize(self) -> int:
+        return len(self._urgent) + self._count
+
+    def put(self, item):
+        """不檢查上限，直接放入一般佇列尾端（停止訊號等控制用途，保持先前項目先處理）。"""
+        with self._cond:
+            self._normal.append([time.monotonic(), None, item])
+            self._count += 1
+            self._cond.notify()
+
+    def offer(self, item, urgent=False, evict_after=None, group=None):
+        """嘗試入列；回傳 (是否接受, 被擠出的舊 item 或 None)。
+
+        evict_after：一般佇列已滿時，最舊一筆等待超過此秒數即擠出；None 表示不擠出。
+        group：項目所屬的 session；urgent 項目入列前，同 group 的一般項目先依序移入優先佇列。
+        """
+        evicted = None
+        with self._cond:
+            if urgent:
+                entries = self._groups.pop(group, None) if group is not None else None
+                if entries:
+                    for entry in entries:
+                        self._urgent.append(entry[2])
+                        entry[2] = _MOVED
+                    self._count -= len(entries)
+                self._urgent.append(item)
+            else:
+                now = time.monotonic()
+                if self.capacity and self._count >= self.capacity:
+                    self._skip_moved()
+                    if evict_after is None or now - self._normal[0][0] < evict_after:
+                        return False, None
+                    evicted = self._pop_normal()
+                entry = [now, group, item]
+                self._normal.append(entry)
+                self._count += 1
+                if group is not None:
+                    entries = self._groups.get(group)
+                    if entries is None:
+                        entries = self._groups[group] = deque()
+                    entries.append(entry)
+            self._cond.notify()
+        return True, evicted
+
+    def get(self):
+        with self._cond:
+            while not self._urgent and not self._count:
+                self._cond.wait()
+            if self._urgent:
+                return self._urgent.popleft()
+            self._skip_moved()
+            return self._pop_normal()
+
+    def _skip_moved(self):
+        """丟掉一般佇列前端已移入優先佇列的空位（呼叫前須確認 _count > 0）。"""
+        normal = self._normal
+        while normal[0][2] is _MOVED:
+            normal.popleft()
+
+    def _pop_normal(self):
+        _, group, item = self._normal.popleft()
+        self._count -= 1
+        if group is not None:
+            entries = self._groups[group]
+            entries.popleft()
+            if not entries:
+                del self._groups[group]
+        return item
+
+
+class LoadShedder:
+    """網路執行緒的准入控制：追蹤各 session 已到達的幀數以判斷收尾幀，並依政策決定丟棄。"""
+
+    def __init__(self, capacity, policy="drop_oldest", watermark=0.8, budget_ms=200.0,
+                 frames_to_decide=6, ttl_s=30.0, max_sessions=10000):
+        if policy not in POLICIES:
+            raise ValueError(f"shed_policy 必須是 {', '.join(POLICIES)} 之一（{policy}）")
+        self.capacity = max(1, int(capacity))
+        self.policy = policy
+        self.high_mark = max(1, int(self.capacity * min(1.0, max(0.0, float(watermark)))))
+        self.low_mark = self.high_mark // 2
+        self.evict_after = max(0.0, float(budget_ms)) / 1000.0 if policy == "drop_oldest" else None
+        # 0 = 不判斷收尾幀（串流模式沒有 session 決策）
+        self.frames_to_decide = int(frames_to_decide)
+        # (device, session) → [已到達幀數（含丟棄）, info 宣告的幀數, 尚未轉告 worker 的丟棄數, 是否為過載時的新 session]
+        self.sessions = SessionTable(factory=lambda: [0, 0, 0, False], ttl_s=ttl_s, max_size=max_sessions)
+        # 已湊滿（收尾幀已判斷）但仍有丟棄數尚未轉告 worker 的 session → 丟棄數
+        self.unreported = SessionTable(factory=lambda: [0], ttl_s=ttl_s, max_size=max_sessions)
+        self.degraded = False
+        self._lock = threading.Lock()  # 網路執行緒與 housekeeping 執行緒（重送丟棄數）共用
+
+    def note_info(self, key, frames):
+        """info 宣告的幀數（session 可能在 frames_to_decide 之前即湊滿）。"""
+        if self.frames_to_decide and frames:
+            with self._lock:
+                self.sessions.get_or_create(key)[1] = int(frames)
+
+    def classify(self, key, depth):
+        """回傳 (urgent, 丟棄原因或 None)；depth 為目前一般佇列的總深度。
+
+        回傳丟棄原因時此幀已記為丟棄；入列失敗或被擠出的幀由呼叫端以 shed() 記錄。
+        """
+        if self.policy == "degrade":
+            if depth >= self.high_mark:
+                self.degraded = True
+            elif depth <= self.low_mark:
+                self.degraded = False
+        if not self.frames_to_decide:
+            return False, None
+        with self._lock:
+            state = self.sessions.get(key)
+            reject = False
+            if self.policy == "drop_new_sessions" and depth >= self.high_mark:
+                if state is None:
+                    state = self.sessions.get_or_create(key)
+                    state[3] = True
+                reject = state[3]
+            elif state is not None:
+                state[3] = False
+            if state is None:
+                state = self.sessions.get_or_create(key)
+            state[0] += 1
+            if reject:
+                state[2] += 1
+            need = min(self.frames_to_decide, state[1]) if state[1] else self.frames_to_decide
+            if state[0] >= need:
+                self.sessions.pop(key)
+                if 0 < state[2] < state[0]:  # 全部被丟棄的 session 沒有可決策的幀，不必轉告
+                    self.unreported.get_or_create(key)[0] += state[2]
+                return (False, "new_session") if reject else (True, None)
+        return (False, "new_session") if reject else (False, None)
+
+    def shed(self, key, n=1):
+        """記錄 key 的 n 幀被丟棄（入列失敗、被擠出，或丟棄數轉告失敗而退回）。"""
+        if not self.frames_to_decide or key is None:
+            return
+        with self._lock:
+            state = self.sessions.get(key)
+            if state is not None:
+                state[2] += n
+            else:
+                self.unreported.get_or_create(key)[0] += n
+
+    def take_shed(self, key):
+        """取出 key 尚未轉告 worker 的丟棄數（取出後歸零）。"""
+        if not self.frames_to_decide:
+            return 0
+        with self._lock:
+            state = self.sessions.get(key)
+            n = 0
+            if state is not None:
+                n, state[2] = state[2], 0
+            pending = self.unreported.pop(key)
+            if pending is not None:
+                n += pending[0]
+            return n
+
+    def unreported_keys(self):
+        """已湊滿但丟棄數尚未轉告 worker 的 session（於 housekeeping 重送）。"""
+        return self.unreported.keys()
+
+    def expire(self):
+        self.sessions.expire()
+        self.unreported.expire()
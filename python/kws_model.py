@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+KWS 模型後端
+- 介面：輸入累積的 [T, F] log-Mel 張量，輸出 result / conf / latency_ms（對齊 esp32/infer 格式）
+- 參考實作：純 CPU、純 NumPy 的 DS-CNN（Tiny-CNN）前向傳遞，權重由 .npz 載入
+- 所有中間張量於載入時依 max_batch 預先配置，前向傳遞不再配置大型陣列
+
+權重檔（.npz，BatchNorm 需先折入 bias）：
+    labels       [K]        類別名稱
+    input_shape  [2]        (T, F)；較短的輸入補零、較長的截斷
+    input_scale  []         輸入線性縮放（u8 → 0..1 可設 1/255）
+    input_bias   []
+    conv0_w      [C, 3, 3]  第一層卷積（單通道輸入，stride 2，padding 1）
+    conv0_b      [C]
+    dw{i}_w      [C, 3, 3]  第 i 個 DS 區塊的 depthwise 卷積（stride 1，padding 1）
+    dw{i}_b      [C]
+    pw{i}_w      [C, C]     pointwise 1x1 卷積
+    pw{i}_b      [C]
+    fc_w         [K, C]     全域平均池化後的分類層
+    fc_b         [K]
+
+產生隨機權重（僅供通路/效能測試）：
+    python kws_model.py --init models/kws_tinycnn.npz --frames 49 --bins 40
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_LABELS = ("_silence_", "_unknown_", "yes", "no")
+
+
+class KWSModel:
+    """模型後端介面。
+
+    子類別實作 `load_input`（把一筆 [T, F] 特徵寫入預配置的批次槽位）與
+    `forward`（對前 n 個槽位執行一次前向傳遞並回傳 [n, K] 機率）。
+    """
+
+    labels = DEFAULT_LABELS
+    max_batch = 1
+
+    def __init__(self):
+        # 預配置緩衝區為所有呼叫者共用，前向傳遞需序列化
+        self._lock = threading.Lock()
+
+    def load_input(self, slot, feats):
+        raise NotImplementedError
+
+    def forward(self, n):
+        raise NotImplementedError
+
+    def infer(self, feats):
+        """單筆推論；feats 為 [T, F] 陣列或依時間順序排列的 [t, F] 區塊列表。"""
+        return self.infer_batch([feats])[0]
+
+    def posteriors(self, feats):
+        """單筆推論並回傳完整後驗 (probs[K] 複本, latency_ms)，供串流模式做時間平滑。"""
+        with self._lock:
+            t0 = time.perf_counter()
+            self.load_input(0, feats)
+            probs = self.forward(1)[0].copy()
+        return probs, round((time.perf_counter() - t0) * 1000.0, 3)
+
+    def infer_batch(self, batch):
+        """批次推論；回傳每筆的 {"result", "conf", "latency_ms"}。"""
+        results = []
+        with self._lock:
+            for start in range(0, len(batch), self.max_batch):
+                chunk = batch[start:start + self.max_batch]
+                t0 = time.perf_counter()
+                for slot, feats in enumerate(chunk):
+                    self.load_input(slot, feats)
+                probs = self.forward(len(chunk))
+                best = probs.argmax(axis=1)
+                latency_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+                for i, k in enumerate(best):
+                    results.append({
+                        "result": self.labels[int(k)],
+                        "conf": round(float(probs[i, k]), 3),
+                        "latency_ms": latency_ms,
+                    })
+        return results
+
+
+class TinyCNNModel(KWSModel):
+    """NumPy DS-CNN 參考實作（conv0 stride 2 → N 個 depthwise/pointwise 區塊 → GAP → FC）。"""
+
+    def __init__(self, path, max_batch=8):
+        super().__init__()
+        w = np.load(path, allow_pickle=False)
+        self.path = path
+        self.labels = tuple(str(x) for x in w["labels"])
+        self.input_frames, self.num_bins = (int(x) for x in w["input_shape"])
+        self.input_scale = np.float32(w["input_scale"]) if "input_scale" in w else np.float32(1.0)
+        self.input_bias = np.float32(w["input_bias"]) if "input_bias" in w else np.float32(0.0)
+        self.max_batch = max(1, int(max_batch))
+
+        f32 = np.float32
+        self.conv0_w = w["conv0_w"].astype(f32)
+        self.conv0_b = w["conv0_b"].astype(f32)
+        self.blocks = []
+        i = 0
+        while f"dw{i}_w" in w:
+            self.blocks.append((w[f"dw{i}_w"].astype(f32), w[f"dw{i}_b"].astype(f32),
+                                w[f"pw{i}_w"].astype(f32), w[f"pw{i}_b"].astype(f32)))
+            i += 1
+        self.fc_wT = np.ascontiguousarray(w["fc_w"].astype(f32).T)
+        self.fc_b = w["fc_b"].astype(f32)
+        self.channels = self.conv0_w.shape[0]
+        if len(self.labels) != self.fc_b.shape[0]:
+            raise ValueError("labels 數量與 fc_b 維度不符")
+
+        # 預配置緩衝區
+        B, C, T, F = self.max_batch, self.channels, self.input_frames, self.num_bins
+        self.out_t = (T - 1) // 2 + 1
+        self.out_f = (F - 1) // 2 + 1
+        To, Fo = self.out_t, self.out_f
+        self._xpad = np.zeros((B, T + 2, F + 2), dtype=f32)
+        self._hpad = np.zeros((B, C, To + 2, Fo + 2), dtype=f32)
+        self._h = self._hpad[:, :, 1:-1, 1:-1]  # 各層輸出直接寫入補零緩衝區的內部
+        self._acc = np.empty((B, C, To, Fo), dtype=f32)
+        self._tmp = np.empty((B, C, To, Fo), dtype=f32)
+        self._pw = np.empty((B, C, To * Fo), dtype=f32)
+        self._gap = np.empty((B, C), dtype=f32)
+        self._logits = np.empty((B, len(self.labels)), dtype=f32)
+        self._mx = np.empty((B, 1), dtype=f32)
+        self._sum = np.empty((B, 1), dtype=f32)
+
+    def load_input(self, slot, feats):
+        """將特徵縮放後寫入槽位 slot（補零/截斷至 input_frames）。"""
+        blocks = feats if isinstance(feats, (list, tuple)) else (feats,)
+        dst = self._xpad[slot, 1:1 + self.input_frames, 1:1 + self.num_bins]
+        row = 0
+        for block in blocks:
+            if row >= self.input_frames:
+                break
+            if block.shape[1] != self.num_bins:
+                raise ValueError(f"特徵 bins={block.shape[1]} 與模型 {self.num_bins} 不符")
+            n = min(block.shape[0], self.input_frames - row)
+            out = dst[row:row + n]
+            np.multiply(block[:n], self.input_scale, out=out, casting='unsafe')
+            np.add(out, self.input_bias, out=out)
+            row += n
+        dst[row:] = 0.0
+
+    def _conv3x3(self, src, w, b, n, stride):
+        """以 9 次平移相乘累加實作 3x3 卷積，輸出寫入 self._acc[:n]。"""
+        acc, tmp = self._acc[:n], self._tmp[:n]
+        To, Fo = self.out_t, self.out_f
+        acc[...] = b[None, :, None, None]
+        for dt in range(3):
+            for df in range(3):
+                if src.ndim == 3:  # 單通道輸入 [n, T+2, F+2]
+                    view = src[:n, None, dt:dt + stride * (To - 1) + 1:stride, df:df + stride * (Fo - 1) + 1:stride]
+                else:
+                    view = src[:n, :, dt:dt + To, df:df + Fo]
+                np.multiply(w[None, :, dt, df, None, None], view, out=tmp)
+                np.add(acc, tmp, out=acc)
+        np.maximum(acc, 0.0, out=acc)
+        return acc
+
+    def forward(self, n):
+        To, Fo = self.out_t, self.out_f
+        h = self._h[:n]
+        np.copyto(h, self._conv3x3(self._xpad, self.conv0_w, self.conv0_b, n, stride=2))
+        pw = self._pw[:n]
+        for dw_w, dw_b, pw_w, pw_b in self.blocks:
+            dw = self._conv3x3(self._hpad, dw_w, dw_b, n, stride=1)
+            np.matmul(pw_w, dw.reshape(n, self.channels, To * Fo), out=pw)
+            np.add(pw, pw_b[None, :, None], out=pw)
+            np.maximum(pw, 0.0, out=pw)
+            np.copyto(h, pw.reshape(n, self.channels, To, Fo))
+        gap = self._gap[:n]
+        np.mean(h, axis=(2, 3), out=gap)
+        logits = self._logits[:n]
+        np.matmul(gap, self.fc_wT, out=logits)
+        np.add(logits, self.fc_b, out=logits)
+        # softmax（就地）
+        mx, sm = self._mx[:n], self._sum[:n]
+        np.max(logits, axis=1, keepdims=True, out=mx)
+        np.subtract(logits, mx, out=logits)
+        np.exp(logits, out=logits)
+        np.sum(logits, axis=1, keepdims=True, out=sm)
+        np.divide(logits, sm, out=logits)
+        return logits
+
+
+MODEL_BACKENDS = {
+    "tinycnn": TinyCNNModel,
+    "dscnn": TinyCNNModel,
+}
+
+
+def load_model(kind, path, max_batch=8):
+    """依名稱建立模型後端；kind 為 'energy' 時回傳 None（使用伺服器內建能量規則）。"""
+    if not kind or kind == "energy":
+        return None
+    if kind not in MODEL_BACKENDS:
+        raise ValueError(f"未知的模型後端: {kind}")
+    return MODEL_BACKENDS[kind](path, max_batch=max_batch)
+
+
+def init_weights(path, frames=49, bins=40, channels=16, blocks=2, labels=DEFAULT_LABELS, seed=0):
+    """產生隨機初始化的 DS-CNN 權重檔（He 初始化），供通路與效能測試使用。"""
+    rng = np.random.default_rng(seed)
+    arrays = {
+        "labels": np.array(labels),
+        "input_shape": np.array([frames, bins], dtype=np.int32),
+        "input_scale": np.array(1.0 / 255.0, dtype=np.float32),
+        "input_bias": np.array(0.0, dtype=np.float32),
+        "conv0_w": rng.normal(0, np.sqrt(2 / 9), (channels, 3, 3)).astype(np.float32),
+        "conv0_b": np.zeros(channels, dtype=np.float32),
+        "fc_w": rng.normal(0, np.sqrt(2 / channels), (len(labels), channels)).astype(np.float32),
+        "fc_b": np.zeros(len(labels), dtype=np.float32),
+    }
+    for i in range(blocks):
+        arrays[f"dw{i}_w"] = rng.normal(0, np.sqrt(2 / 9), (channels, 3, 3)).astype(np.float32)
+        arrays[f"dw{i}_b"] = np.zeros(channels, dtype=np.float32)
+        arrays[f"pw{i}_w"] = rng.normal(0, np.sqrt(2 / channels), (channels, channels)).astype(np.float32)
+        arrays[f"pw{i}_b"] = np.zeros(channels, dtype=np.float32)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(path, **arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KWS 模型後端工具")
+    parser.add_argument("--init", metavar="PATH", help="產生隨機 DS-CNN 權重檔")
+    parser.add_argument("--frames", type=int, default=49)
+    parser.add_argument("--bins", type=int, default=40)
+    parser.add_argument("--channels", type=int, default=16)
+    parser.add_argument("--blocks", type=int, default=2)
+    parser.add_argument("--bench", metavar="PATH", help="載入權重並量測單筆推論延遲")
+    args = parser.parse_args()
+
+    if args.init:
+        init_weights(args.init, frames=args.frames, bins=args.bins, channels=args.channels, blocks=args.blocks)
+        print(f"💾 已產生權重: {args.init}")
+    if args.bench:
+        model = TinyCNNModel(args.bench, max_batch=1)
+        feats = np.random.default_rng(1).integers(0, 256, (model.input_frames, model.num_bins), dtype=np.uint8)
+        lat = sorted(model.infer(feats)["latency_ms"] for _ in range(200))
+        print(f"⏱️ P50={lat[100]:.3f} ms  P95={lat[190]:.3f} ms  labels={model.labels}")
+
+
+if __name__ == "__main__":
+    main()
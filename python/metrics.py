@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+輕量 Prometheus 指標
+- Counter / Gauge / Histogram（固定 bucket），熱路徑只做整數加法與一次 bisect，不取鎖
+  （CPython 下多執行緒同時 += 極少數情況可能遺失一次計數，對監控用途可接受）
+- Histogram 另輸出以 bucket 線性內插估計的 P50/P95/P99（<name>_quantile{quantile="..."}）
+- MetricsRegistry.render() 產生 Prometheus text format；start_http_server() 以背景執行緒提供 /metrics
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 秒為單位，涵蓋 10 µs ~ 10 s
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class LabeledCounter:
+    """以單一標籤區分的 Counter 家族（例如 device）。"""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._children = {}
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            child = self._children.setdefault(value, Counter())
+        return child
+
+    def inc(self, value, n=1):
+        self.labels(value).value += n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, child in list(self._children.items()):
+            lines.append(f"{self.name}{_fmt_labels({self.label: value})} {child.value}")
+        return lines
+
+
+class SimpleCounter(Counter):
+    __slots__ = ("name", "help")
+
+    def __init__(self, name, help_text):
+        super().__init__()
+        self.name = name
+        self.help = help_text
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+class Gauge:
+    """以回呼函式取值的 Gauge（抓取時才計算，熱路徑零成本）。"""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = float(self.fn())
+        except Exception:
+            value = float("nan")
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class LabeledGauge:
+    """以單一標籤區分的 Gauge 家族；fn() 回傳 [(標籤值, 數值)]，抓取時才計算。"""
+
+    def __init__(self, name, help_text, label, fn):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            items = list(self.fn())
+        except Exception:
+            items = []
+        for value, v in items:
+            lines.append(f"{self.name}{_fmt_labels({self.label: value})} {float(v)}")
+        return lines
+
+
+class Histogram:
+    """固定 bucket 的直方圖；observe 為 O(log buckets)，不取鎖。"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, quantiles=DEFAULT_QUANTILES):
+        self.name = name
+        self.help = help_text
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)  # 最後一格為 +Inf
+        self.sum = 0.0
+        self.quantiles = quantiles
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """由 bucket 線性內插估計分位數（落在 +Inf 時回傳最後一個邊界）。"""
+        counts = list(self.counts)
+        total = sum(counts)
+        if total == 0:
+            return float("nan")
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c > 0:
+                if i >= len(self.bounds):
+                    return self.bounds[-1]
+                upper = self.bounds[i]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+            if i < len(self.bounds):
+                lower = self.bounds[i]
+        return self.bounds[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        counts = list(self.counts)
+        cumulative = 0
+        for bound, c in zip(self.bounds, counts):
+            cumulative += c
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {cumulative}")
+        if self.quantiles:
+            qname = f"{self.name}_quantile"
+            lines.append(f"# HELP {qname} {self.help}（由 bucket 估計的分位數）")
+            lines.append(f"# TYPE {qname} gauge")
+            for q in self.quantiles:
+                lines.append(f'{qname}{{quantile="{q}"}} {self.quantile(q)}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, label=None):
+        metric = LabeledCounter(name, help_text, label) if label else SimpleCounter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, fn, label=None):
+        metric = LabeledGauge(name, help_text, label, fn) if label else Gauge(name, help_text, fn)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS, quantiles=DEFAULT_QUANTILES):
+        metric = Histogram(name, help_text, buckets, quantiles)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def start_http_server(registry, port, host="127.0.0.1"):
+    """以背景執行緒提供 http://host:port/metrics；回傳 server（可呼叫 shutdown()）。"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
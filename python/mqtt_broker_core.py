@@ -0,0 +1,915 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MQTT Broker 核心（不依賴 GUI）
+- 由 mqtt_broker_gui.py 抽出的連線/封包處理，GUI 以 on_event 回呼觀察狀態
+- 可單獨以無介面模式執行，作為本機測試與壓測用的 broker：
+    python mqtt_broker_core.py --host 127.0.0.1 --port 1883
+    python mqtt_broker_gui.py --headless --port 1883
+- 單一執行緒的 selectors 事件迴圈處理所有非阻塞 socket（accept / 讀 / 寫），broker 狀態只由該執行緒修改；
+  GUI 只讀取定期產生的快照（snapshot()），數千條閒置連線不需要數千條執行緒
+- 支援 MQTT 3.1/3.1.1 的 CONNECT / PUBLISH（QoS 0/1/2 接收，一律以 QoS 0 轉發）/
+  SUBSCRIBE / UNSUBSCRIBE / PINGREQ / DISCONNECT；MQTTFramer 增量切分封包（1～4 位元組剩餘長度、
+  一次 recv 多個或半個封包），封包內容以 memoryview 交給處理器，payload 以位元組原樣轉發
+- 轉發的 PUBLISH 每則訊息只組一次（沿用收到的主題區段與 payload），所有訂閱者共用同一份 bytes；
+  寫不下的封包只在各連線的 outbuf 保留參照，不為每個訂閱者複製
+- 每條連線有上限 out_queue_bytes 的輸出佇列：封包先入列，事件迴圈每輪結束時以 sendmsg 一次寫出多個封包
+  （scatter-gather）；慢速訂閱者（例如 GUI 監控端）只會讓自己的佇列變長，不影響發佈者與其他訂閱者。
+  佇列滿時（含單一封包就超過上限）依 overflow_policy：
+    drop_qos0   丟棄轉發給它的 QoS 0 PUBLISH（CONNACK/SUBACK 等控制封包照常入列）
+    disconnect  中斷該連線
+    spill       之後的封包依序寫入暫存檔（spill_dir），佇列消化到一半以下再讀回；已讀回超過一半時把未讀部分
+                搬到檔頭並截斷，暫存檔大小超過 spill_max_bytes 即中斷
+  各連線的佇列深度與丟棄數見 snapshot().clients、GUI 客戶端頁與 --metrics-port
+- 共享訂閱 $share/<group>/<filter>：同一 group 的成員輪流分擔符合 filter 的訊息，
+  依主題的指定層級（預設第 2、3 層，即 esp32/feat/{device}/{session}）做一致性雜湊，
+  同一 session 固定送給同一成員；成員增減時只有約 1/N 的 session 換手
+- 轉發對象以訂閱樹（subscription_trie.py）比對，成本與訂閱總數無關；解析結果（含共享訂閱選出的成員）
+  依主題快取，訂閱有任何變動即清空
+"""
+
+import argparse
+import selectors
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from itertools import islice
+
+from subscription_trie import SubscriptionTrie
+
+# 封包類型
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+# 剩餘長度 4 位元組編碼的上限（約 256 MB）
+MAX_PACKET = 268435455
+SPILL_COPY_BYTES = 1 << 20  # 壓縮暫存檔時每次搬移的量
+OVERFLOW_POLICIES = ("drop_qos0", "disconnect", "spill")
+# 單次 sendmsg 的緩衝區數（Linux IOV_MAX 為 1024）
+MAX_IOV = 512
+# Windows 的 socket 沒有 sendmsg，改為合併後 send
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+def encode_remaining_length(n: int) -> bytes:
+    """MQTT 可變長度編碼（每位元組 7 bits，最高位為延續旗標）。"""
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+
+def encode_publish(topic: str, payload: bytes) -> bytes:
+    """組出 QoS 0 的 PUBLISH 封包。"""
+    topic_bytes = topic.encode('utf-8')
+    return frame_publish(struct.pack(">H", len(topic_bytes)), topic_bytes, payload)
+
+
+def frame_publish(*parts) -> bytes:
+    """以已編碼的 PUBLISH 內容（主題長度 + 主題 + payload，可為 memoryview）組出 QoS 0 封包，只配置一次。"""
+    body_len = sum(len(part) for part in parts)
+    return b"".join((bytes([0x30]), encode_remaining_length(body_len), *parts))
+
+
+class MQTTFramer:
+    """增量式 MQTT 封包切分器：餵入任意切分的 recv 資料，取出完整封包。
+
+    - 剩餘長度為 1～4 位元組的可變長度編碼；一次 recv 可含多個封包，也可只含半個
+    - feed() 回傳 [(type, flags, body)]，body 是指向 recv 原始 bytes 的 memoryview，不複製
+    - 只有跨 recv 的不完整封包需要暫存：先收集片段，湊足整個封包的長度後才合併一次
+      （大型封包不會因反覆串接而變成 O(n²)）
+    """
+
+    __slots__ = ("max_packet", "_chunks", "_have", "_need")
+
+    def __init__(self, max_packet=MAX_PACKET):
+        self.max_packet = int(max_packet)
+        self._chunks = []  # 不完整封包的片段（bytes）
+        self._have = 0     # 片段總長度
+        self._need = 0     # 解析下一個封包至少需要的總長度
+
+    def pending(self) -> int:
+        """暫存中（尚未湊成完整封包）的位元組數。"""
+        return self._have
+
+    def feed(self, data):
+        if self._chunks:
+            self._chunks.append(data)
+            self._have += len(data)
+            if self._have < self._need:
+                return []
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+            self._have = 0
+        view = memoryview(data)
+        n = len(data)
+        pos = 0
+        out = []
+        need = 0  # 本次呼叫算出的尾端所需長度（0 = 尾端不足 2 位元組，未解析）
+        while n - pos >= 2:
+            # 固定標頭：1 位元組類型/旗標 + 1～4 位元組剩餘長度
+            remaining = 0
+            shift = 0
+            i = pos + 1
+            while True:
+                if i >= n:
+                    break
+                b = data[i]
+                remaining |= (b & 0x7F) << shift
+                i += 1
+                if not b & 0x80:
+                    shift = -1  # 長度完整
+                    break
+                shift += 7
+                if shift > 21:
+                    raise ValueError("剩餘長度編碼超過 4 位元組")
+            if shift != -1:
+                need = n - pos + 1  # 長度欄位未完整：再多任何資料即重新解析
+                break
+            if remaining > self.max_packet:
+                raise ValueError(f"封包過大（{remaining} 位元組）")
+            end = i + remaining
+            if end > n:
+                need = end - pos
+                break
+            first = data[pos]
+            out.append((first >> 4, first & 0x0F, view[i:end]))
+            pos = end
+        if pos < n:
+            # 不完整的尾端：複製下來（只有這一段），之後的 recv 片段先收集
+            # _need 只由這段尾端決定（不可沿用先前較大封包的長度）
+            self._chunks.append(bytes(view[pos:]))
+            self._have = n - pos
+            self._need = need or self._have + 1
+        else:
+            self._need = 0
+        return out
+
+
+def _hash32(text: str) -> int:
+    """crc32 再經 murmur3 fmix32 打散（crc32 本身是線性的，相近字串落點會聚集）。"""
+    h = zlib.crc32(text.encode('utf-8'))
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    return h ^ (h >> 16)
+
+
+class ConsistentHashRing:
+    """一致性雜湊環；每個成員放 vnodes 個虛擬節點讓負載較平均，跨行程/重啟結果穩定。"""
+
+    def __init__(self, members=(), vnodes=160):
+        points = sorted((_hash32(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._members = [m for _, m in points]
+
+    def get(self, key: str):
+        if not self._hashes:
+            return None
+        i = bisect(self._hashes, _hash32(key))
+        return self._members[i % len(self._members)]
+
+
+def parse_shared(sub_topic):
+    """'$share/<group>/<filter>' → (group, filter)；非共享訂閱回傳 None。"""
+    if not sub_topic.startswith('$share/'):
+        return None
+    _, group, topic_filter = sub_topic.split('/', 2)
+    return group, topic_filter
+
+
+def get_local_ip():
+    """獲取本機IP地址"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+
+class _Conn:
+    """一條客戶端連線（只由事件迴圈存取）。"""
+
+    __slots__ = ("sock", "address", "client_id", "connect_time", "framer", "outbuf", "outbytes", "writing",
+                 "flushing", "spill", "spill_pos", "spill_size", "dropped", "topics", "closed")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.client_id = None
+        self.connect_time = datetime.now()
+        self.framer = MQTTFramer()  # 跨 recv 的封包切分
+        self.outbuf = deque()  # 待寫出的封包（與其他訂閱者共用同一份 bytes）
+        self.outbytes = 0      # outbuf 的位元組數（上限 out_queue_bytes）
+        self.writing = False   # 已註冊 EVENT_WRITE（socket 寫不下）
+        self.flushing = False  # 已排入本輪結束時的批次寫出
+        self.spill = None      # overflow_policy = spill 時的暫存檔
+        self.spill_pos = 0     # 暫存檔已讀回的位置
+        self.spill_size = 0    # 暫存檔已寫入的位元組數
+        self.dropped = 0       # 佇列滿而丟棄的 PUBLISH 數
+        self.topics = set()        # 此連線的訂閱（斷線時只需清除自己的）
+        self.closed = False
+
+
+# GUI 觀察用的唯讀狀態：clients 為 (client_id, address, connect_time, 訂閱數, 輸出佇列位元組, 丟棄數)，
+# topics 為 (topic, 訂閱者)；輸出佇列位元組含 spill 暫存檔中尚未讀回的部分
+BrokerSnapshot = namedtuple("BrokerSnapshot", "clients topics")
+
+
+class MQTTBrokerCore:
+    """單一 selectors 事件迴圈的 MQTT Broker。
+
+    所有 socket 皆為非阻塞，連線、訂閱與統計只由事件迴圈執行緒修改，不需鎖；
+    其他執行緒（GUI）透過 snapshot() 取得定期產生的唯讀狀態。
+
+    on_event(kind, data)：狀態變化通知（於事件迴圈執行緒呼叫），kind 為 "log" / "client_update" /
+    "topic_update" / "message" / "stats"；client/topic/stats 每 snapshot_interval 秒最多一次。
+    未提供時日誌直接 print。verbose=False 時不逐則記錄 PUBLISH/轉發與 TCP 連線，也不送出 "message"。
+    share_levels：共享訂閱以主題的哪些層級（0 起算）做一致性雜湊。
+    out_queue_bytes / overflow_policy / spill_dir / spill_max_bytes：每條連線的輸出佇列上限與溢位處理。
+    """
+
+    def __init__(self, host='0.0.0.0', port=1883, on_event=None, verbose=True, share_levels=(2, 3),
+                 snapshot_interval=0.5, route_cache_size=65536, out_queue_bytes=1 << 20,
+                 overflow_policy="drop_qos0", spill_dir=None, spill_max_bytes=64 << 20):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy 必須是 {', '.join(OVERFLOW_POLICIES)} 之一（{overflow_policy}）")
+        self.host = host
+        self.port = port
+        self.on_event = on_event
+        self.verbose = verbose
+        self.share_levels = tuple(share_levels)
+        self.snapshot_interval = float(snapshot_interval)
+        self.running = False
+        self.server_socket = None
+        self._selector = None
+        self._thread = None
+        self._wake_r = self._wake_w = None
+
+        # 數據結構（事件迴圈專用）
+        self.clients = {}  # client_id -> _Conn
+        self.subscriptions = {}  # topic -> set of client_ids（共享訂閱以完整的 $share/... 為 key）
+        self._shared = {}  # $share/... -> ConsistentHashRing，成員變動時失效
+        self._trie = SubscriptionTrie()  # 轉發比對用的索引（與 subscriptions 同步）
+        self._routes = OrderedDict()  # 發佈主題 -> 轉發對象 tuple（插入順序即淘汰順序；popitem 為 O(1)）
+        self.route_cache_size = max(0, int(route_cache_size))
+        self.out_queue_bytes = max(1, int(out_queue_bytes))
+        self.overflow_policy = overflow_policy
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = max(0, int(spill_max_bytes))
+        self._flush = []  # 本輪有新封包待寫出的連線
+        self._backlog = False  # 上次快照後有連線的輸出佇列非空（佇列深度需要更新）
+        self.stats = {
+            'total_connections': 0,
+            'active_connections': 0,
+            'total_messages': 0,
+            'total_subscriptions': 0,
+            'dropped_messages': 0,
+            'overflow_disconnects': 0,
+            'uptime_start': None
+        }
+        self._snapshot = BrokerSnapshot((), ())
+        self._dirty = False
+        self._last_tick = 0.0
+        self._last_messages = 0
+
+    # 生命週期
+    def start(self):
+        """綁定並開始接受連線（背景事件迴圈執行緒）；綁定失敗時拋出例外。"""
+        self._raise_fd_limit()
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(socket.SOMAXCONN)
+        self.server_socket.setblocking(False)
+        self.port = self.server_socket.getsockname()[1]  # port 0 時取得實際埠號
+
+        # stop() 由其他執行緒呼叫時，以 socketpair 喚醒 select
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self.server_socket, selectors.EVENT_READ, None)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, self._wake_r)
+
+        self.running = True
+        self.stats['uptime_start'] = time.time()
+        self._log("🚀 MQTT Broker 已啟動")
+        self._log(f"📍 監聽地址: {self.host}:{self.port}")
+
+        self._thread = threading.Thread(target=self._run_loop, name="broker-loop", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+        # 重置統計
+        self.stats['active_connections'] = 0
+        self.stats['uptime_start'] = None
+        self._snapshot = BrokerSnapshot((), ())
+        self._log("⏹️ MQTT Broker 已停止")
+        self._emit("client_update", self._snapshot)
+        self._emit("topic_update", self._snapshot)
+        self._emit("stats")
+
+    def snapshot(self) -> BrokerSnapshot:
+        """事件迴圈最近一次產生的唯讀狀態（最多落後 snapshot_interval 秒）。"""
+        return self._snapshot
+
+    def _raise_fd_limit(self):
+        """大量連線需要足夠的檔案描述符：把 soft limit 提高到 hard limit（僅 Unix）。"""
+        try:
+            import resource
+        except ImportError:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            target = 1 << 20 if hard == resource.RLIM_INFINITY else hard
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            except (ValueError, OSError):
+                pass
+
+    # 事件與日誌
+    def _emit(self, kind, data=None):
+        if self.on_event is not None:
+            self.on_event(kind, data)
+
+    def _log(self, message):
+        if self.on_event is not None:
+            self.on_event("log", message)
+        else:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
+
+    # 事件迴圈
+    def _run_loop(self):
+        """accept / 讀 / 寫 全部在此執行緒以非阻塞 socket 處理。"""
+        select = self._selector.select
+        try:
+            while self.running:
+                for key, mask in select(self.snapshot_interval):
+                    conn = key.data
+                    if conn is None:
+                        self._accept()
+                    elif conn is self._wake_r:
+                        try:
+                            self._wake_r.recv(64)
+                        except OSError:
+                            pass
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._on_readable(conn)
+                        if mask & selectors.EVENT_WRITE and not conn.closed:
+                            self._write(conn)
+                self._flush_pending()
+                self._tick()
+        except Exception as e:
+            self._log(f"❌ 事件迴圈錯誤: {e}")
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        for conn in list(self._selector.get_map().values()):
+            if isinstance(conn.data, _Conn):
+                try:
+                    conn.data.sock.close()
+                except OSError:
+                    pass
+        for sock in (self.server_socket, self._wake_r, self._wake_w):
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._selector.close()
+        self.clients.clear()
+        self.subscriptions.clear()
+        self._shared.clear()
+        self._trie = SubscriptionTrie()
+        self._routes.clear()
+
+    def _tick(self):
+        """定期把狀態變化整理成快照交給觀察者（大量連線時不逐一通知）。"""
+        now = time.monotonic()
+        if now - self._last_tick < self.snapshot_interval:
+            return
+        self._last_tick = now
+        if self._dirty or self._backlog:
+            self._dirty = False
+            self._backlog = False
+            self._snapshot = BrokerSnapshot(
+                tuple((cid, c.address, c.connect_time, len(c.topics), self._queued(c), c.dropped)
+                      for cid, c in self.clients.items()),
+                tuple((topic, tuple(sorted(subs))) for topic, subs in self.subscriptions.items()))
+            self._emit("client_update", self._snapshot)
+            self._emit("topic_update", self._snapshot)
+            self._emit("stats")
+        elif self.stats['total_messages'] != self._last_messages:
+            self._emit("stats")
+        self._last_messages = self.stats['total_messages']
+
+    def _accept(self):
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # 例如檔案描述符用盡：先處理既有連線，下次事件再試
+                self._log(f"❌ accept 失敗: {e}")
+                return
+            client_socket.setblocking(False)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Conn(client_socket, address)
+            self._selector.register(client_socket, selectors.EVENT_READ, conn)
+            if self.verbose:
+                self._log(f"📱 新客戶端連接: {address[0]}:{address[1]}")
+
+    def _on_readable(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._close(conn, f"錯誤: {e}")
+            return
+        if not data:
+            self._close(conn)
+            return
+        try:
+            for msg_type, flags, body in conn.framer.feed(data):
+                self._handle_packet(conn, msg_type, flags, body)
+                if conn.closed:
+                    return
+        except Exception as e:
+            self._close(conn, f"錯誤: {e}")
+
+    def _handle_packet(self, conn, msg_type, flags, body):
+        if msg_type == CONNECT:
+            self._handle_connect(conn, body)
+        elif msg_type == PUBLISH:
+            self._handle_publish(conn, flags, body)
+        elif msg_type == PUBREL:
+            self._send(conn, bytes([0x70, 0x02]) + body[:2])  # PUBCOMP
+        elif msg_type == SUBSCRIBE:
+            self._handle_subscribe(conn, body)
+        elif msg_type == UNSUBSCRIBE:
+            self._handle_unsubscribe(conn, body)
+        elif msg_type == PINGREQ:
+            self._send(conn, bytes([0xD0, 0x00]))
+        elif msg_type == DISCONNECT:
+            self._close(conn)
+
+    # 輸出佇列
+    def _send(self, conn, data, droppable=False):
+        """把封包排入連線的輸出佇列（本輪結束時批次寫出）；droppable 表示 drop_qos0 政策下可丟棄。"""
+        if conn.closed:
+            return
+        size = len(data)
+        if conn.spill is not None or conn.outbytes + size > self.out_queue_bytes:
+            if not self._overflow(conn, data, droppable):
+                return
+        else:
+            conn.outbuf.append(data)
+            conn.outbytes += size
+        if not conn.flushing and not conn.writing:
+            conn.flushing = True
+            self._flush.append(conn)
+
+    def _overflow(self, conn, data, droppable):
+        """輸出佇列已滿；回傳 True 表示 data 仍已保存（入列或寫入暫存檔）。"""
+        policy = self.overflow_policy
+        if policy == "spill":
+            # 上限針對暫存檔本身（已讀回的部分於 _unspill 壓縮掉），慢速訂閱者不會讓檔案無限成長
+            if conn.spill_size + len(data) <= self.spill_max_bytes:
+                try:
+                    if conn.spill is None:
+                        conn.spill = tempfile.TemporaryFile(prefix="mqtt-spill-", dir=self.spill_dir)
+                        conn.spill_pos = conn.spill_size = 0
+                        self._log(f"💾 {conn.client_id} 輸出佇列已滿，改寫入暫存檔")
+                    conn.spill.seek(conn.spill_size)
+                    conn.spill.write(data)
+                    conn.spill_size += len(data)
+                    return True
+                except OSError as e:
+                    reason = f"輸出暫存檔寫入失敗: {e}"
+            else:
+                reason = "輸出暫存檔已滿"
+        elif policy == "drop_qos0":
+            if droppable:
+                conn.dropped += 1
+                self.stats['dropped_messages'] += 1
+                self._backlog = True
+                return False
+            # 控制封包很小且只在客戶端送出請求時產生，照常入列
+            conn.outbuf.append(data)
+            conn.outbytes += len(data)
+            return True
+        else:
+            reason = "輸出佇列已滿"
+        self.stats['overflow_disconnects'] += 1
+        self._close(conn, f"{reason}，中斷連線")
+        return False
+
+    def _unspill(self, conn):
+        """從暫存檔讀回至多半個佇列的資料；全部讀回後關閉暫存檔，讀回超過一半時壓縮。"""
+        try:
+            conn.spill.seek(conn.spill_pos)
+            chunk = conn.spill.read(min(max(1, self.out_queue_bytes // 2), conn.spill_size - conn.spill_pos))
+            conn.spill_pos += len(chunk)
+            if conn.spill_pos < conn.spill_size and conn.spill_pos * 2 >= conn.spill_size:
+                self._compact_spill(conn)
+        except OSError as e:
+            self.stats['overflow_disconnects'] += 1
+            self._close(conn, f"輸出暫存檔讀取失敗: {e}，中斷連線")
+            return
+        conn.outbuf.append(chunk)
+        conn.outbytes += len(chunk)
+        if conn.spill_pos >= conn.spill_size:
+            conn.spill.close()
+            conn.spill = None
+
+    @staticmethod
+    def _compact_spill(conn):
+        """把暫存檔未讀回的部分搬到檔頭並截斷（搬移量不超過已讀回的量，攤提為 O(1)/位元組）。"""
+        f = conn.spill
+        src, dst = conn.spill_pos, 0
+        while src < conn.spill_size:
+            f.seek(src)
+            chunk = f.read(min(SPILL_COPY_BYTES, conn.spill_size - src))
+            f.seek(dst)
+            f.write(chunk)
+            src += len(chunk)
+            dst += len(chunk)
+        f.truncate(dst)
+        conn.spill_pos, conn.spill_size = 0, dst
+
+    def _flush_pending(self):
+        """事件迴圈每輪結束時寫出本輪累積的封包（每條連線一次 sendmsg 送出多個封包）。"""
+        if not self._flush:
+            return
+        pending, self._flush = self._flush, []
+        for conn in pending:
+            conn.flushing = False
+            if not conn.closed:
+                self._write(conn)
+
+    def _write(self, conn):
+        """以 sendmsg 寫出佇列；寫不下時註冊 EVENT_WRITE，可寫時再由事件迴圈呼叫。"""
+        outbuf = conn.outbuf
+        sock = conn.sock
+        limit = self.out_queue_bytes // 2
+        while True:
+            if conn.spill is not None and conn.outbytes < limit:
+                self._unspill(conn)
+                if conn.closed:
+                    return
+            if not outbuf:
+                break
+            batch = list(islice(outbuf, MAX_IOV))
+            try:
+                n = sock.sendmsg(batch) if HAS_SENDMSG else sock.send(b"".join(batch))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self._close(conn, f"錯誤: {e}")
+                return
+            conn.outbytes -= n
+            while n:
+                head = outbuf[0]
+                if n < len(head):
+                    outbuf[0] = memoryview(head)[n:]
+                    break
+                n -= len(head)
+                outbuf.popleft()
+            else:
+                continue
+            break  # 只寫出一部分：socket 緩衝區已滿
+        writing = bool(outbuf)
+        if writing or conn.writing:
+            self._backlog = True  # 佇列深度有變化，下次快照更新
+        if writing != conn.writing:
+            conn.writing = writing
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if writing else selectors.EVENT_READ
+            self._selector.modify(sock, events, conn)
+
+    @staticmethod
+    def _queued(conn):
+        return conn.outbytes + conn.spill_size - conn.spill_pos if conn.spill is not None else conn.outbytes
+
+    def _close(self, conn, reason=None):
+        if conn.closed:
+            return
+        conn.closed = True
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
+        conn.outbuf.clear()
+        conn.outbytes = 0
+        if conn.spill is not None:
+            conn.spill.close()
+            conn.spill = None
+        if reason:
+            self._log(f"❌ 客戶端 {conn.address[0]}:{conn.address[1]} {reason}")
+        client_id = conn.client_id
+        if client_id and self.clients.get(client_id) is conn:
+            del self.clients[client_id]
+            self.stats['active_connections'] = len(self.clients)
+            # 清除此連線的訂閱
+            for topic in conn.topics:
+                self._unsubscribe(client_id, topic)
+            self._dirty = True
+        if client_id or self.verbose:
+            self._log(f"🔌 客戶端 {conn.address[0]}:{conn.address[1]} 已斷開")
+
+    # 封包處理
+    def _handle_connect(self, conn, body):
+        """處理 CONNECT 訊息"""
+        try:
+            # 協定名稱（MQTT / MQIsdp）之後為 level(1) + flags(1) + keepalive(2)
+            name_len = struct.unpack(">H", body[0:2])[0]
+            offset = 2 + name_len + 4
+
+            client_id_len = struct.unpack(">H", body[offset:offset+2])[0]
+            offset += 2
+            client_id = str(body[offset:offset+client_id_len], 'utf-8')
+            address = conn.address
+            if not client_id:
+                # 3.1.1 允許空 client id，由 broker 指派
+                client_id = f"auto-{address[0]}:{address[1]}"
+
+            # 同一 client id 的舊連線依規範斷開
+            old = self.clients.get(client_id)
+            if old is not None and old is not conn:
+                self._close(old)
+
+            # 儲存客戶端
+            conn.client_id = client_id
+            self.clients[client_id] = conn
+            self.stats['total_connections'] += 1
+            self.stats['active_connections'] = len(self.clients)
+            self._dirty = True
+
+            # 發送 CONNACK
+            self._send(conn, bytes([0x20, 0x02, 0x00, 0x00]))
+            self._log(f"✅ {client_id} ({address[0]}:{address[1]}) 連接成功")
+        except Exception as e:
+            self._log(f"❌ CONNECT 處理錯誤: {e}")
+
+    def _handle_publish(self, conn, flags, body):
+        """處理 PUBLISH 訊息"""
+        try:
+            # 解析主題和訊息（body 為 memoryview；payload 保持位元組原樣，二進位特徵不可解碼成字串）
+            topic_len = struct.unpack(">H", body[0:2])[0]
+            topic = str(body[2:2+topic_len], 'utf-8')
+            offset = 2 + topic_len
+            topic_part = body[:offset]  # 已編碼的主題長度 + 主題，轉發時原樣沿用
+            qos = (flags >> 1) & 0x03
+            if qos:
+                packet_id = body[offset:offset+2]
+                offset += 2
+                # QoS 1 → PUBACK；QoS 2 → PUBREC（之後的 PUBREL 回 PUBCOMP）
+                self._send(conn, bytes([0x40 if qos == 1 else 0x50, 0x02]) + packet_id)
+            payload = body[offset:]
+
+            self.stats['total_messages'] += 1
+
+            if self.verbose:
+                self._log(f"📢 {conn.client_id} 發布到 {topic}: {bytes(payload[:64])!r}")
+                if self.on_event is not None:
+                    # 添加到訊息流（觀察者可能在其他執行緒保留，交出獨立的 bytes）
+                    timestamp = datetime.now().strftime("%H:%M:%S")
+                    self._emit("message", (timestamp, topic, bytes(payload), conn.client_id))
+
+            # 轉發訊息
+            self._forward_message(topic, payload, conn.client_id, topic_part)
+
+        except Exception as e:
+            self._log(f"❌ PUBLISH 處理錯誤: {e}")
+
+    def _handle_subscribe(self, conn, body):
+        """處理 SUBSCRIBE 訊息（一個封包可含多個主題）"""
+        try:
+            client_id = conn.client_id
+            packet_id = body[0:2]
+            offset = 2
+            topics = []
+            while offset < len(body):
+                topic_len = struct.unpack(">H", body[offset:offset+2])[0]
+                offset += 2
+                topics.append(str(body[offset:offset+topic_len], 'utf-8'))
+                offset += topic_len + 1  # 略過請求的 QoS
+
+            # 添加訂閱；格式錯誤的 $share 訂閱回覆失敗碼 0x80
+            codes = bytearray()
+            for topic in topics:
+                if topic.startswith('$share/') and topic.count('/') < 2:
+                    codes.append(0x80)
+                    continue
+                self._subscribe(client_id, topic)
+                conn.topics.add(topic)
+                self.stats['total_subscriptions'] += 1
+                codes.append(0x00)
+            self._dirty = True
+
+            # 發送 SUBACK（一律授予 QoS 0）
+            suback = bytes([0x90]) + encode_remaining_length(2 + len(codes)) + packet_id + bytes(codes)
+            self._send(conn, suback)
+
+            for topic, code in zip(topics, codes):
+                self._log(f"📬 {client_id} 訂閱主題: {topic}" if code == 0 else f"⚠️ {client_id} 無效的共享訂閱: {topic}")
+
+        except Exception as e:
+            self._log(f"❌ SUBSCRIBE 處理錯誤: {e}")
+
+    def _handle_unsubscribe(self, conn, body):
+        """處理 UNSUBSCRIBE 訊息"""
+        try:
+            packet_id = body[0:2]
+            offset = 2
+            while offset < len(body):
+                topic_len = struct.unpack(">H", body[offset:offset+2])[0]
+                offset += 2
+                topic = str(body[offset:offset+topic_len], 'utf-8')
+                offset += topic_len
+                if topic in conn.topics:
+                    conn.topics.discard(topic)
+                    self._unsubscribe(conn.client_id, topic)
+            self._dirty = True
+            self._send(conn, bytes([0xB0, 0x02]) + packet_id)
+        except Exception as e:
+            self._log(f"❌ UNSUBSCRIBE 處理錯誤: {e}")
+
+    def _subscribe(self, client_id, topic):
+        subscribers = self.subscriptions.setdefault(topic, set())
+        if client_id in subscribers:
+            return
+        subscribers.add(client_id)
+        shared = parse_shared(topic)
+        if shared is None:
+            self._trie.add(topic, client_id)
+        else:
+            self._trie.add(shared[1], client_id, share_key=topic)
+            self._shared.pop(topic, None)
+        self._routes.clear()
+
+    def _unsubscribe(self, client_id, topic):
+        subscribers = self.subscriptions.get(topic)
+        if subscribers is None or client_id not in subscribers:
+            return
+        subscribers.discard(client_id)
+        if not subscribers:
+            del self.subscriptions[topic]
+        shared = parse_shared(topic)
+        if shared is None:
+            self._trie.remove(topic, client_id)
+        else:
+            self._trie.remove(shared[1], client_id, share_key=topic)
+            self._shared.pop(topic, None)
+        self._routes.clear()
+
+    def _resolve(self, topic):
+        """主題 → 轉發對象（一般訂閱者 + 每個共享群組以一致性雜湊選出的一個成員）。"""
+        routes = self._routes
+        targets = routes.get(topic)
+        if targets is not None:
+            return targets
+        subscribers, shared = self._trie.match(topic)
+        if shared:
+            key = self._share_key(topic)
+            for share_topic, members in shared:
+                member = self._shared_ring(share_topic, members).get(key)
+                if member is not None:
+                    subscribers.add(member)
+        targets = tuple(subscribers)
+        if self.route_cache_size:
+            if len(routes) >= self.route_cache_size:
+                routes.popitem(last=False)
+            routes[topic] = targets
+        return targets
+
+    def _forward_message(self, topic, payload, sender_id, topic_part=None):
+        """轉發訊息給訂閱者；topic_part 為收到的已編碼主題區段（省去重新編碼主題）。"""
+        subscribers = self._resolve(topic)
+        if not subscribers:
+            return
+
+        # 構建 PUBLISH 封包（每則訊息只組一次，所有訂閱者共用同一份 bytes）
+        packet = None
+
+        # 轉發訊息（排入各訂閱者的輸出佇列；佇列滿時依 overflow_policy 處理；不回送給發送者）
+        forwarded_count = 0
+        clients = self.clients
+        for subscriber_id in subscribers:
+            if subscriber_id == sender_id:
+                continue
+            conn = clients.get(subscriber_id)
+            if conn is None:
+                continue
+            if packet is None:
+                if topic_part is None:
+                    packet = encode_publish(topic, payload)
+                else:
+                    packet = frame_publish(topic_part, payload)
+            self._send(conn, packet, droppable=True)
+            forwarded_count += 1
+
+        if forwarded_count > 0 and self.verbose:
+            self._log(f"📤 已轉發給 {forwarded_count} 個訂閱者")
+
+    def _shared_ring(self, share_topic, members):
+        ring = self._shared.get(share_topic)
+        if ring is None:
+            ring = self._shared[share_topic] = ConsistentHashRing(members)
+        return ring
+
+    def _share_key(self, topic):
+        """取主題的 share_levels 層組成雜湊 key（層數不足時只用現有的層）。"""
+        levels = topic.split('/')
+        return '/'.join(levels[i] for i in self.share_levels if i < len(levels))
+
+
+def start_metrics(broker, port, host="127.0.0.1"):
+    """以 Prometheus text format 提供 broker 統計與各連線的輸出佇列深度（讀取快照，不碰事件迴圈的狀態）。"""
+    from metrics import MetricsRegistry, start_http_server
+
+    registry = MetricsRegistry()
+    registry.gauge('mqtt_broker_connections', '目前連線數', lambda: broker.stats['active_connections'])
+    registry.gauge('mqtt_broker_messages', '累計收到的 PUBLISH 數', lambda: broker.stats['total_messages'])
+    registry.gauge('mqtt_broker_dropped_messages', '輸出佇列滿而丟棄的 PUBLISH 數（drop_qos0）',
+                   lambda: broker.stats['dropped_messages'])
+    registry.gauge('mqtt_broker_overflow_disconnects', '輸出佇列或暫存檔溢位而中斷的連線數',
+                   lambda: broker.stats['overflow_disconnects'])
+    registry.gauge('mqtt_broker_client_queue_bytes', '各連線輸出佇列的位元組數（含暫存檔）',
+                   lambda: [(c[0], c[4]) for c in broker.snapshot().clients], label='client')
+    registry.gauge('mqtt_broker_client_dropped', '各連線因輸出佇列滿而丟棄的 PUBLISH 數',
+                   lambda: [(c[0], c[5]) for c in broker.snapshot().clients], label='client')
+    return start_http_server(registry, port, host)
+
+
+def main(argv=None):
+    """無介面模式"""
+    parser = argparse.ArgumentParser(description="MQTT Broker（無介面模式）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--verbose", action="store_true", help="逐則記錄 PUBLISH 與轉發")
+    parser.add_argument("--share-levels", default="2,3",
+                        help="共享訂閱一致性雜湊使用的主題層級（0 起算；串流模式以裝置分派可設為 2）")
+    parser.add_argument("--out-queue-kb", type=int, default=1024, help="每條連線的輸出佇列上限（KB）")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default="drop_qos0", help="輸出佇列滿時的處理方式")
+    parser.add_argument("--spill-dir", default=None, help="overflow=spill 的暫存檔目錄（預設為系統暫存目錄）")
+    parser.add_argument("--spill-max-mb", type=int, default=64, help="每條連線暫存檔的上限（MB）")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Prometheus 指標埠（0 = 停用）")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    share_levels = [int(x) for x in args.share_levels.split(',') if x.strip()]
+    broker = MQTTBrokerCore(args.host, args.port, verbose=args.verbose, share_levels=share_levels,
+                            out_queue_bytes=args.out_queue_kb * 1024, overflow_policy=args.overflow,
+                            spill_dir=args.spill_dir, spill_max_bytes=args.spill_max_mb << 20).start()
+    print(f"🌐 本機IP: {get_local_ip()}:{broker.port}")
+    if args.metrics_port:
+        start_metrics(broker, args.metrics_port, args.metrics_host)
+        print(f"📈 指標: http://{args.metrics_host}:{args.metrics_port}/metrics")
+    try:
+        while True:
+            time.sleep(10)
+            s = broker.stats
+            print(f"📊 連接 {s['active_connections']}（累計 {s['total_connections']}），訊息 {s['total_messages']}，"
+                  f"佇列滿丟棄 {s['dropped_messages']}，溢位斷線 {s['overflow_disconnects']}")
+            backlog = sorted(broker.snapshot().clients, key=lambda c: c[4], reverse=True)[:3]
+            if backlog and backlog[0][4]:
+                print("   輸出佇列最長: " + "，".join(f"{c[0]} {c[4] / 1024:.1f} KB" for c in backlog if c[4]))
+    except KeyboardInterrupt:
+        print("\n🛑 使用者中斷，正在停止...")
+    finally:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
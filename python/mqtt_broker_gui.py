@@ -3,17 +3,22 @@
 """
 帶GUI的MQTT Broker服務
 提供圖形化界面來監控和管理MQTT連接
+連線與封包處理位於 mqtt_broker_core.py；加上 --headless 可不開視窗直接執行
 """
 
+import argparse
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
-import socket
-import threading
 import time
-import struct
 import queue
+import threading
 from datetime import datetime
 from config import MQTTConfig
+from mqtt_broker_core import MQTTBrokerCore, get_local_ip
+
+# UI 執行緒每 100ms 最多處理 500 則，約 4 秒的積壓量
+MESSAGE_QUEUE_SIZE = 20000
+
 
 class MQTTBrokerGUI:
     """帶GUI的MQTT Broker"""
@@ -34,19 +39,16 @@ class MQTTBrokerGUI:
         self.host = '0.0.0.0'
         self.port = 1883
         self.running = False
-        self.server_socket = None
-        
-        # 數據結構
-        self.clients = {}  # client_id -> (socket, address, connect_time)
-        self.subscriptions = {}  # topic -> set of client_ids
-        self.message_queue = queue.Queue()
-        self.stats = {
-            'total_connections': 0,
-            'active_connections': 0,
-            'total_messages': 0,
-            'total_subscriptions': 0,
-            'uptime_start': None
-        }
+        
+        # Broker 核心（單一事件迴圈執行緒擁有所有狀態）；日誌與訊息流經有上限的 message_queue 交給 UI 執行緒，
+        # 佇列滿時直接丟棄並計數，不讓 UI 跟不上時無限堆積；列表/統計更新只記旗標合併，
+        # 客戶端與主題列表只讀取核心的唯讀快照
+        self.broker = MQTTBrokerCore(self.host, self.port, on_event=self._on_broker_event)
+        self.message_queue = queue.Queue(maxsize=MESSAGE_QUEUE_SIZE)
+        self._refresh = set()
+        self._refresh_lock = threading.Lock()
+        self._dropped_events = 0
+        self.stats = self.broker.stats
         
         # 建立UI
         self._setup_ui()
@@ -182,7 +184,7 @@ class MQTTBrokerGUI:
         notebook.add(clients_frame, text="👥 連接客戶端")
         
         # 客戶端樹狀圖
-        columns = ("ID", "地址", "連接時間", "訂閱數")
+        columns = ("ID", "地址", "連接時間", "訂閱數", "輸出佇列")
         self.clients_tree = ttk.Treeview(clients_frame, columns=columns, show="headings", height=10)
         
         for col in columns:
@@ -244,34 +246,39 @@ class MQTTBrokerGUI:
         self.port_entry.insert(0, port)
     
     def _start_message_processing(self):
-        """啟動訊息處理線程"""
-        def process_messages():
-            while True:
-                try:
-                    msg_type, data = self.message_queue.get(timeout=0.1)
-                    
-                    if msg_type == "log":
-                        self._update_log(data)
-                    elif msg_type == "client_update":
-                        self._update_clients_display()
-                    elif msg_type == "topic_update":
-                        self._update_topics_display()
-                    elif msg_type == "message":
-                        self._update_messages_display(data)
-                    elif msg_type == "stats":
-                        self._update_stats_display()
-                    
-                except queue.Empty:
-                    continue
-                except Exception as e:
-                    print(f"訊息處理錯誤: {e}")
-        
-        msg_thread = threading.Thread(target=process_messages, daemon=True)
-        msg_thread.start()
+        """於 Tk 主執行緒定期處理核心送來的事件（Tk 元件只能在主執行緒操作）"""
+        self._process_messages()
         
         # 定期更新運行時間
         self._update_uptime()
     
+    def _process_messages(self):
+        """每 100ms 取出一批事件；同一批中的列表/統計更新只重繪一次"""
+        with self._refresh_lock:
+            refresh, self._refresh = self._refresh, set()
+        try:
+            for _ in range(500):
+                msg_type, data = self.message_queue.get_nowait()
+                if msg_type == "log":
+                    self._update_log(data)
+                else:
+                    self._update_messages_display(data)
+        except queue.Empty:
+            pass
+        dropped, self._dropped_events = self._dropped_events, 0
+        if dropped:
+            self._update_log(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ 顯示跟不上，略過 {dropped} 則日誌/訊息")
+        try:
+            if "client_update" in refresh:
+                self._update_clients_display()
+            if "topic_update" in refresh:
+                self._update_topics_display()
+            if "stats" in refresh:
+                self._update_stats_display()
+        except Exception as e:
+            print(f"訊息處理錯誤: {e}")
+        self.root.after(100, self._process_messages)
+    
     def _update_uptime(self):
         """更新運行時間顯示"""
         if self.running and self.stats['uptime_start']:
@@ -291,7 +298,24 @@ class MQTTBrokerGUI:
         """添加日誌訊息到隊列"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         log_message = f"[{timestamp}] {message}"
-        self.message_queue.put(("log", log_message))
+        self._enqueue("log", log_message)
+    
+    def _enqueue(self, kind, data):
+        """放入日誌/訊息流；佇列滿時丟棄（計數後由 UI 執行緒提示），絕不阻塞事件迴圈"""
+        try:
+            self.message_queue.put_nowait((kind, data))
+        except queue.Full:
+            self._dropped_events += 1
+    
+    def _on_broker_event(self, kind, data):
+        """Broker 核心的狀態通知（於事件迴圈執行緒呼叫，只入列或記旗標）"""
+        if kind == "log":
+            self._log(data)
+        elif kind == "message":
+            self._enqueue(kind, data)
+        else:
+            with self._refresh_lock:
+                self._refresh.add(kind)
     
     def _update_log(self, message):
         """更新日誌顯示"""
@@ -311,20 +335,19 @@ class MQTTBrokerGUI:
         for item in self.clients_tree.get_children():
             self.clients_tree.delete(item)
         
-        # 添加客戶端資訊
-        for client_id, (socket, address, connect_time) in self.clients.items():
-            # 計算訂閱數
-            subscription_count = sum(1 for topic_subscribers in self.subscriptions.values() 
-                                   if client_id in topic_subscribers)
-            
+        # 添加客戶端資訊（核心的快照，不直接讀取核心的字典）
+        for client_id, address, connect_time, subscription_count, queued, dropped in self.broker.snapshot().clients:
             # 格式化連接時間
             connect_time_str = connect_time.strftime("%H:%M:%S")
+            # 輸出佇列深度（慢速訂閱者）與佇列滿而丟棄的訊息數
+            queue_str = f"{queued / 1024:.1f} KB" + (f"（丟棄 {dropped}）" if dropped else "")
             
             self.clients_tree.insert("", tk.END, values=(
                 client_id, 
                 f"{address[0]}:{address[1]}", 
                 connect_time_str,
-                subscription_count
+                subscription_count,
+                queue_str
             ))
     
     def _update_topics_display(self):
@@ -334,8 +357,8 @@ class MQTTBrokerGUI:
             self.topics_tree.delete(item)
         
         # 添加主題資訊
-        for topic, subscribers in self.subscriptions.items():
-            subscriber_list = ", ".join(sorted(subscribers))
+        for topic, subscribers in self.broker.snapshot().topics:
+            subscriber_list = ", ".join(subscribers)
             self.topics_tree.insert("", tk.END, values=(
                 topic,
                 len(subscribers),
@@ -344,7 +367,8 @@ class MQTTBrokerGUI:
     
     def _update_messages_display(self, message_data):
         """更新訊息流顯示"""
-        timestamp, topic, message, client_id = message_data
+        timestamp, topic, payload, client_id = message_data
+        message = payload.decode('utf-8', errors='replace')
         display_message = f"[{timestamp}] 📢 {client_id} → {topic}: {message}\n"
         self.messages_text.insert(tk.END, display_message)
         self.messages_text.see(tk.END)
@@ -369,14 +393,11 @@ class MQTTBrokerGUI:
             self.host = self.host_entry.get().strip()
             self.port = int(self.port_entry.get().strip())
             
-            # 啟動服務器
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            
+            # 啟動服務器（核心於背景事件迴圈執行緒處理所有連線）
+            self.broker.host = self.host
+            self.broker.port = self.port
+            self.broker.start()
             self.running = True
-            self.stats['uptime_start'] = time.time()
             
             # 更新UI狀態
             self.status_label.config(text="狀態: 運行中", foreground="green")
@@ -384,16 +405,9 @@ class MQTTBrokerGUI:
             self.stop_btn.config(state=tk.NORMAL)
             
             # 獲取本機IP
-            local_ip = self._get_local_ip()
-            
-            self._log("🚀 MQTT Broker 已啟動")
-            self._log(f"📍 監聽地址: {self.host}:{self.port}")
+            local_ip = get_local_ip()
             self._log(f"🌐 本機IP: {local_ip}:{self.port}")
             
-            # 啟動服務器線程
-            server_thread = threading.Thread(target=self._run_server, daemon=True)
-            server_thread.start()
-            
         except Exception as e:
             messagebox.showerror("啟動錯誤", f"Broker 啟動失敗: {e}")
             self._log(f"❌ 啟動失敗: {e}")
@@ -401,35 +415,12 @@ class MQTTBrokerGUI:
     def _stop_broker(self):
         """停止 Broker"""
         self.running = False
-        
-        if self.server_socket:
-            self.server_socket.close()
-        
-        # 關閉所有客戶端連接
-        for client_id, (client_socket, _, _) in self.clients.items():
-            try:
-                client_socket.close()
-            except:
-                pass
-        
-        self.clients.clear()
-        self.subscriptions.clear()
-        
-        # 重置統計
-        self.stats['active_connections'] = 0
-        self.stats['uptime_start'] = None
+        self.broker.stop()
         
         # 更新UI狀態
         self.status_label.config(text="狀態: 停止", foreground="red")
         self.start_btn.config(state=tk.NORMAL)
         self.stop_btn.config(state=tk.DISABLED)
-        
-        self._log("⏹️ MQTT Broker 已停止")
-        
-        # 更新顯示
-        self.message_queue.put(("client_update", None))
-        self.message_queue.put(("topic_update", None))
-        self.message_queue.put(("stats", None))
     
     def _restart_broker(self):
         """重新啟動 Broker"""
@@ -444,234 +435,6 @@ class MQTTBrokerGUI:
         self.messages_text.delete("1.0", tk.END)
         self._log("🧹 日誌已清除")
     
-    def _get_local_ip(self):
-        """獲取本機IP地址"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.connect(("8.8.8.8", 80))
-                return s.getsockname()[0]
-        except:
-            return "127.0.0.1"
-    
-    def _run_server(self):
-        """運行服務器主循環"""
-        while self.running:
-            try:
-                client_socket, address = self.server_socket.accept()
-                self._log(f"📱 新客戶端連接: {address[0]}:{address[1]}")
-                
-                # 為每個客戶端創建處理線程
-                client_thread = threading.Thread(
-                    target=self._handle_client,
-                    args=(client_socket, address),
-                    daemon=True
-                )
-                client_thread.start()
-                
-            except socket.error:
-                if self.running:
-                    self._log("❌ Socket 錯誤")
-                break
-    
-    def _handle_client(self, client_socket, address):
-        """處理客戶端連接"""
-        client_id = None
-        
-        try:
-            while self.running:
-                # 讀取MQTT封包
-                data = client_socket.recv(2)
-                if not data:
-                    break
-                
-                if len(data) >= 2:
-                    msg_type = (data[0] >> 4) & 0x0F
-                    remaining_length = data[1]
-                    
-                    if remaining_length > 0:
-                        payload = client_socket.recv(remaining_length)
-                        
-                        if msg_type == 1:  # CONNECT
-                            client_id = self._handle_connect(client_socket, payload, address)
-                        elif msg_type == 3:  # PUBLISH
-                            self._handle_publish(client_socket, payload, client_id)
-                        elif msg_type == 8:  # SUBSCRIBE
-                            self._handle_subscribe(client_socket, payload, client_id)
-                        elif msg_type == 12:  # PINGREQ
-                            self._handle_ping(client_socket, address)
-                
-        except Exception as e:
-            self._log(f"❌ 客戶端 {address[0]}:{address[1]} 錯誤: {e}")
-        finally:
-            if client_id and client_id in self.clients:
-                del self.clients[client_id]
-                self.stats['active_connections'] = len(self.clients)
-                
-                # 清除訂閱
-                for topic in list(self.subscriptions.keys()):
-                    if client_id in self.subscriptions[topic]:
-                        self.subscriptions[topic].remove(client_id)
-                        if not self.subscriptions[topic]:
-                            del self.subscriptions[topic]
-                
-                self.message_queue.put(("client_update", None))
-                self.message_queue.put(("topic_update", None))
-                self.message_queue.put(("stats", None))
-            
-            try:
-                client_socket.close()
-            except:
-                pass
-            self._log(f"🔌 客戶端 {address[0]}:{address[1]} 已斷開")
-    
-    def _handle_connect(self, client_socket, payload, address):
-        """處理 CONNECT 訊息"""
-        try:
-            # 簡化的 CONNECT 解析
-            offset = 10
-            
-            if len(payload) > offset + 1:
-                client_id_len = struct.unpack(">H", payload[offset:offset+2])[0]
-                offset += 2
-                
-                if len(payload) >= offset + client_id_len:
-                    client_id = payload[offset:offset+client_id_len].decode('utf-8')
-                    
-                    # 儲存客戶端
-                    self.clients[client_id] = (client_socket, address, datetime.now())
-                    self.stats['total_connections'] += 1
-                    self.stats['active_connections'] = len(self.clients)
-                    
-                    # 發送 CONNACK
-                    connack = bytes([0x20, 0x02, 0x00, 0x00])
-                    client_socket.send(connack)
-                    
-                    self._log(f"✅ {client_id} ({address[0]}:{address[1]}) 連接成功")
-                    
-                    self.message_queue.put(("client_update", None))
-                    self.message_queue.put(("stats", None))
-                    
-                    return client_id
-        except Exception as e:
-            self._log(f"❌ CONNECT 處理錯誤: {e}")
-        
-        return None
-    
-    def _handle_publish(self, client_socket, payload, client_id):
-        """處理 PUBLISH 訊息"""
-        try:
-            # 解析主題和訊息
-            topic_len = struct.unpack(">H", payload[0:2])[0]
-            topic = payload[2:2+topic_len].decode('utf-8')
-            message = payload[2+topic_len:].decode('utf-8')
-            
-            self.stats['total_messages'] += 1
-            
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            self._log(f"📢 {client_id} 發布到 {topic}: {message}")
-            
-            # 添加到訊息流
-            self.message_queue.put(("message", (timestamp, topic, message, client_id)))
-            self.message_queue.put(("stats", None))
-            
-            # 轉發訊息
-            self._forward_message(topic, message, client_id)
-            
-        except Exception as e:
-            self._log(f"❌ PUBLISH 處理錯誤: {e}")
-    
-    def _handle_subscribe(self, client_socket, payload, client_id):
-        """處理 SUBSCRIBE 訊息"""
-        try:
-            # 解析主題
-            offset = 2
-            topic_len = struct.unpack(">H", payload[offset:offset+2])[0]
-            offset += 2
-            topic = payload[offset:offset+topic_len].decode('utf-8')
-            
-            # 添加訂閱
-            if topic not in self.subscriptions:
-                self.subscriptions[topic] = set()
-            self.subscriptions[topic].add(client_id)
-            
-            # 發送 SUBACK
-            suback = bytes([0x90, 0x03, payload[0], payload[1], 0x00])
-            client_socket.send(suback)
-            
-            self._log(f"📬 {client_id} 訂閱主題: {topic}")
-            
-            self.message_queue.put(("client_update", None))
-            self.message_queue.put(("topic_update", None))
-            
-        except Exception as e:
-            self._log(f"❌ SUBSCRIBE 處理錯誤: {e}")
-    
-    def _handle_ping(self, client_socket, address):
-        """處理 PING 訊息"""
-        try:
-            pingresp = bytes([0xD0, 0x00])
-            client_socket.send(pingresp)
-        except Exception as e:
-            self._log(f"❌ PING 處理錯誤: {e}")
-    
-    def _forward_message(self, topic, message, sender_id):
-        """轉發訊息給訂閱者"""
-        subscribers = set()
-        
-        # 查找匹配的訂閱
-        for sub_topic in self.subscriptions:
-            if self._topic_matches(topic, sub_topic):
-                subscribers.update(self.subscriptions[sub_topic])
-        
-        # 移除發送者
-        if sender_id in subscribers:
-            subscribers.remove(sender_id)
-        
-        # 轉發訊息
-        forwarded_count = 0
-        for subscriber_id in subscribers:
-            if subscriber_id in self.clients:
-                try:
-                    client_socket, _, _ = self.clients[subscriber_id]
-                    
-                    # 構建 PUBLISH 封包
-                    topic_bytes = topic.encode('utf-8')
-                    message_bytes = message.encode('utf-8')
-                    payload = struct.pack(">H", len(topic_bytes)) + topic_bytes + message_bytes
-                    header = bytes([0x30, len(payload)]) + payload
-                    
-                    client_socket.send(header)
-                    forwarded_count += 1
-                    
-                except Exception as e:
-                    self._log(f"❌ 轉發錯誤 {subscriber_id}: {e}")
-        
-        if forwarded_count > 0:
-            self._log(f"📤 已轉發給 {forwarded_count} 個訂閱者")
-    
-    def _topic_matches(self, published_topic, subscribed_topic):
-        """檢查主題是否匹配"""
-        if subscribed_topic == published_topic:
-            return True
-        
-        # 支援 + 萬用字元
-        if '+' in subscribed_topic:
-            sub_parts = subscribed_topic.split('/')
-            pub_parts = published_topic.split('/')
-            
-            if len(sub_parts) == len(pub_parts):
-                for sub_part, pub_part in zip(sub_parts, pub_parts):
-                    if sub_part != '+' and sub_part != pub_part:
-                        return False
-                return True
-        
-        # 支援 # 萬用字元
-        if subscribed_topic.endswith('#'):
-            prefix = subscribed_topic[:-1]
-            return published_topic.startswith(prefix)
-        
-        return False
-    
     def _on_closing(self):
         """視窗關閉處理"""
         if self.running:
@@ -688,6 +451,13 @@ class MQTTBrokerGUI:
 
 def main():
     """主程式"""
+    parser = argparse.ArgumentParser(description="MQTT Broker GUI")
+    parser.add_argument("--headless", action="store_true", help="不開視窗，直接以核心執行（測試/壓測用）")
+    args, rest = parser.parse_known_args()
+    if args.headless:
+        from mqtt_broker_core import main as headless_main
+        headless_main(rest)
+        return
     print("🏭 啟動 MQTT Broker GUI")
     app = MQTTBrokerGUI()
     app.run()
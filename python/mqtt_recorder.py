@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MQTT 流量錄製與重播（離線重現實機負載，用於 feature_server.py / audio_data_receiver.py 壓測）
+
+錄製：訂閱 esp32/#，把 (接收時間, topic, payload) 寫入精簡的二進位記錄檔
+    python mqtt_recorder.py record capture.mqlog [--topic esp32/#] [--duration 600]
+
+重播：依原始時間間隔重新發佈；--speed 1 為原速、N 為 N 倍速、0 為盡量快
+    python mqtt_recorder.py replay capture.mqlog --speed 4 --clones 10 --connections 8
+
+檢視：
+    python mqtt_recorder.py info capture.mqlog
+
+記錄檔格式（little-endian）：
+    標頭  <4sB>   magic b"EMQL", version 1
+    每筆  <QHI>   接收時間（µs since epoch）, len(topic), len(payload)，之後緊接 topic 與 payload
+
+重播細節：
+- 所有訊息（含複製）於開始前預先編碼為 PUBLISH 封包，計時迴圈只做寫入
+- --clones N 將每台裝置複製為 N 台：特徵主題 device → device~k、info JSON 的 device 一併改寫；
+  音訊主題的 timestamp（與完成通知）加 k 毫秒。其他主題只發佈一次
+- --session-tag 附加於 session 名稱（特徵主題與 info），重複重播同一記錄檔時各次互不干擾
+- 同一裝置固定走同一條連線，維持其訊息順序
+- Binary v1 特徵幀的 ts 於送出時改寫為當下時間（--keep-ts 保留原值；JSON 幀一律保留），
+  讓伺服器的端到端延遲指標有意義
+- 預設略過錄到的推論回覆（infer_prefix），並訂閱回覆以量測「裝置最後一幀 → 回覆」延遲
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from config import MQTTConfig
+from feature_codec import is_binary_frame
+from mqtt_broker_core import encode_publish
+from topic_router import TopicRouter
+
+LOG_MAGIC = b"EMQL"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct('<4sB')
+LOG_RECORD = struct.Struct('<QHI')
+# Binary v1 標頭內 ts 欄位（u64）的位移：magic 2 + version/quant/feat/flags 各 1
+FRAME_TS = struct.Struct('<Q')
+FRAME_TS_OFFSET = 6
+
+
+class LogWriter:
+    """依序附加記錄；由單一執行緒（paho 網路執行緒）呼叫。"""
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        self.count = 0
+        self.bytes = 0
+
+    def write(self, ts_us, topic, payload):
+        t = topic.encode('utf-8')
+        self.f.write(LOG_RECORD.pack(ts_us, len(t), len(payload)))
+        self.f.write(t)
+        self.f.write(payload)
+        self.count += 1
+        self.bytes += len(payload)
+
+    def close(self):
+        self.f.close()
+
+
+def read_log(path):
+    """依序產生 (ts_us, topic, payload)；尾端不完整的記錄（錄製中斷）直接略過。"""
+    with open(path, 'rb') as f:
+        blob = f.read()
+    if len(blob) < LOG_HEADER.size:
+        raise ValueError(f"{path} 不是記錄檔")
+    magic, version = LOG_HEADER.unpack_from(blob)
+    if magic != LOG_MAGIC or version != LOG_VERSION:
+        raise ValueError(f"{path} 格式不符（magic={magic!r}, version={version}）")
+    view = memoryview(blob)
+    off = LOG_HEADER.size
+    while off + LOG_RECORD.size <= len(blob):
+        ts_us, tlen, plen = LOG_RECORD.unpack_from(blob, off)
+        off += LOG_RECORD.size
+        if off + tlen + plen > len(blob):
+            break
+        topic = bytes(view[off:off + tlen]).decode('utf-8')
+        off += tlen
+        yield ts_us, topic, bytes(view[off:off + plen])
+        off += plen
+
+
+# 錄製
+def record(args, cfg):
+    import paho.mqtt.client as mqtt
+
+    host, port = args.host or cfg.get_broker_info()[0], args.port or cfg.get_broker_info()[1]
+    writer = LogWriter(args.output)
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            client.subscribe(args.topic)
+            print(f"🎙️ 錄製中: {args.topic} → {args.output}（Ctrl+C 結束）")
+        else:
+            print(f"❌ 連接失敗: {reason_code}")
+
+    def on_message(client, userdata, msg):
+        writer.write(time.time_ns() // 1000, msg.topic, msg.payload)
+
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    print(f"🌐 連接 MQTT: {host}:{port}")
+    client.connect(host, port, keepalive=60)
+    client.loop_start()
+    t0 = time.time()
+    try:
+        while not args.duration or time.time() - t0 < args.duration:
+            time.sleep(1.0)
+            if args.max_messages and writer.count >= args.max_messages:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        writer.close()
+    print(f"💾 共 {writer.count} 則、{writer.bytes} 位元組 payload，{time.time() - t0:.1f}s")
+
+
+# 重播
+class CloneMapper:
+    """把一筆記錄展開為 clones 份 (topic, payload, device)；device 為 None 表示不屬於任何裝置。"""
+
+    def __init__(self, topics, clones, session_tag=""):
+        self.clones = max(1, clones)
+        self.session_tag = session_tag
+        self.feat_prefix = topics.get('feature_prefix', 'esp32/feat')
+        self.audio_prefix = topics.get('audio_prefix', 'esp32/audio')
+        self.router = TopicRouter()
+        self.router.add(f"{self.feat_prefix}/info", self._feat_info)
+        self.router.add(f"{self.feat_prefix}/{{device}}/{{session}}/{{idx}}", self._feat_frame)
+        self.router.add(f"{self.audio_prefix}/info", self._audio_info)
+        self.router.add(f"{self.audio_prefix}/{{timestamp:int}}/{{chunk}}", self._audio_chunk)
+
+    def expand(self, topic, payload):
+        route = self.router.match(topic)
+        if route is None:
+            return [(topic, payload, None)]
+        handler, fields = route
+        return handler(payload, *fields)
+
+    @staticmethod
+    def _device(device, k):
+        return device if k == 0 else f"{device}~{k}"
+
+    def _feat_frame(self, payload, device, session, idx):
+        session += self.session_tag
+        return [(f"{self.feat_prefix}/{self._device(device, k)}/{session}/{idx}", payload, self._device(device, k))
+                for k in range(self.clones)]
+
+    def _feat_info(self, payload):
+        try:
+            info = json.loads(payload)
+            device = str(info['device'])
+            if self.session_tag and 'session' in info:
+                info['session'] = f"{info['session']}{self.session_tag}"
+        except (ValueError, KeyError, TypeError):
+            return [(f"{self.feat_prefix}/info", payload, None)]
+        out = []
+        for k in range(self.clones):
+            info['device'] = self._device(device, k)
+            out.append((f"{self.feat_prefix}/info", json.dumps(info).encode('utf-8'), info['device']))
+        return out
+
+    def _audio_chunk(self, payload, timestamp, chunk):
+        return [(f"{self.audio_prefix}/{timestamp + k}/{chunk}", payload, f"audio:{timestamp + k}")
+                for k in range(self.clones)]
+
+    def _audio_info(self, payload):
+        # 完成通知格式：timestamp:size:success_count:total_chunks
+        head, sep, rest = payload.partition(b":")
+        try:
+            timestamp = int(head)
+        except ValueError:
+            return [(f"{self.audio_prefix}/info", payload, None)]
+        return [(f"{self.audio_prefix}/info", str(timestamp + k).encode('ascii') + sep + rest, f"audio:{timestamp + k}")
+                for k in range(self.clones)]
+
+
+def prepare(path, topics, args):
+    """讀取記錄檔並展開為 [(相對秒數, 連線編號, 封包, ts 位移或 -1, device)]。"""
+    mapper = CloneMapper(topics, args.clones, args.session_tag)
+    skip = f"{topics.get('infer_prefix', 'esp32/infer')}/"
+    feat = f"{mapper.feat_prefix}/"
+    out = []
+    base = None
+    for ts_us, topic, payload in read_log(path):
+        if not args.include_replies and topic.startswith(skip):
+            continue
+        if base is None:
+            base = ts_us
+        rel = (ts_us - base) / 1e6
+        for t, p, device in mapper.expand(topic, payload):
+            packet = encode_publish(t, p)
+            ts_off = -1
+            if not args.keep_ts and t.startswith(feat) and is_binary_frame(p):
+                ts_off = len(packet) - len(p) + FRAME_TS_OFFSET
+                packet = bytearray(packet)
+            conn = zlib.crc32(device.encode('utf-8')) % args.connections if device else 0
+            out.append((rel, conn, packet, ts_off, device))
+    return out
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def replay(messages, host, port, topics, args):
+    from feature_server_async import AsyncMQTTClient
+
+    infer_prefix = f"{topics.get('infer_prefix', 'esp32/infer')}/"
+    last_sent = {}
+    latencies = []
+    replies = [0]
+    sub = None
+    collector = None
+    if not args.no_replies:
+        sub = AsyncMQTTClient(f"replay_sub_{os.getpid()}", keepalive=60)
+        await sub.connect(host, port)
+        sub.subscribe([f"{infer_prefix}#"])
+        await sub.drain()
+
+        async def collect():
+            n = len(infer_prefix)
+            async for topic, _ in sub.messages():
+                replies[0] += 1
+                t = last_sent.pop(topic[n:], None)
+                if t is not None:
+                    latencies.append(time.perf_counter() - t)
+
+        collector = asyncio.create_task(collect())
+
+    pubs = []
+    for i in range(args.connections):
+        c = AsyncMQTTClient(f"replay_pub_{os.getpid()}_{i}", keepalive=60)
+        await c.connect(host, port)
+        pubs.append(c)
+
+    async def drain_all():
+        await asyncio.gather(*(c.drain() for c in pubs))
+
+    speed = args.speed
+    max_lag = 0.0
+    total_bytes = 0
+    print(f"▶️ 重播 {len(messages)} 則（速度 {'最快' if not speed else f'{speed:g}×'}，{len(pubs)} 條連線）")
+    t0 = time.perf_counter()
+    for i, (rel, conn, packet, ts_off, device) in enumerate(messages):
+        if speed:
+            delay = t0 + rel / speed - time.perf_counter()
+            if delay > 0.001:
+                await drain_all()
+                await asyncio.sleep(delay)
+            elif delay < 0:
+                max_lag = max(max_lag, -delay)
+        if ts_off >= 0:
+            FRAME_TS.pack_into(packet, ts_off, time.time_ns() // 1_000_000)
+        pubs[conn].publish_packet(packet)
+        total_bytes += len(packet)
+        if device is not None and not device.startswith("audio:"):
+            last_sent[device] = time.perf_counter()
+        if i % 256 == 255:
+            await drain_all()
+    await drain_all()
+    t_sent = time.perf_counter() - t0
+
+    if collector is not None:
+        # 等到第一則回覆後，再等回覆趨於停止（連續 wait_idle 秒沒有新回覆）
+        seen = 0
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and (replies[0] == 0 or replies[0] != seen):
+            seen = replies[0]
+            await asyncio.sleep(args.wait_idle)
+        collector.cancel()
+    for c in pubs + ([sub] if sub is not None else []):
+        await c.close()
+
+    span = messages[-1][0] if messages else 0.0
+    print(f"📤 送出 {len(messages)} 則、{total_bytes / 1e6:.1f} MB，耗時 {t_sent:.2f}s"
+          f"（{len(messages) / max(t_sent, 1e-9):.0f} msg/s；錄製時長 {span:.2f}s）")
+    if speed:
+        print(f"⏱️ 最大落後排程 {max_lag * 1000:.1f} ms")
+    if collector is not None:
+        print(f"📥 回覆 {replies[0]} 則（有對應裝置 {len(latencies)}）")
+        print(f"⏱️ 最後一幀 → 回覆 P50={percentile(latencies, 0.5) * 1000:.1f} ms  "
+              f"P99={percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+def info(args):
+    count = 0
+    nbytes = 0
+    first = last = None
+    per_prefix = {}
+    for ts_us, topic, payload in read_log(args.input):
+        count += 1
+        nbytes += len(payload)
+        first = ts_us if first is None else first
+        last = ts_us
+        prefix = "/".join(topic.split("/")[:2])
+        per_prefix[prefix] = per_prefix.get(prefix, 0) + 1
+    span = (last - first) / 1e6 if count else 0.0
+    print(f"📼 {args.input}: {count} 則、{nbytes} 位元組 payload，時長 {span:.2f}s"
+          f"（{count / span if span else 0:.0f} msg/s）")
+    for prefix, n in sorted(per_prefix.items(), key=lambda kv: -kv[1]):
+        print(f"  {prefix:<24} {n}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MQTT 流量錄製與重播")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("record", help="訂閱並錄製流量")
+    p.add_argument("output")
+    p.add_argument("--topic", default="esp32/#")
+    p.add_argument("--duration", type=float, default=0, help="錄製秒數（0 = 直到 Ctrl+C）")
+    p.add_argument("--max-messages", type=int, default=0)
+    p.add_argument("--host")
+    p.add_argument("--port", type=int)
+
+    p = sub.add_parser("replay", help="重播記錄檔")
+    p.add_argument("input")
+    p.add_argument("--speed", type=float, default=1.0, help="1 = 原速、N = N 倍速、0 = 盡量快")
+    p.add_argument("--clones", type=int, default=1, help="每台裝置複製為 N 台")
+    p.add_argument("--connections", type=int, default=4, help="發送端連線數")
+    p.add_argument("--keep-ts", action="store_true", help="保留特徵幀原始 ts")
+    p.add_argument("--session-tag", default="", help="附加在 session 名稱後（重複重播時避免與前次 session 相同）")
+    p.add_argument("--include-replies", action="store_true", help="一併重播錄到的推論回覆")
+    p.add_argument("--no-replies", action="store_true", help="不訂閱回覆（例如測 audio_data_receiver.py）")
+    p.add_argument("--wait-idle", type=float, default=1.0, help="送完後回覆停止多久（秒）視為結束")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--host")
+    p.add_argument("--port", type=int)
+
+    p = sub.add_parser("info", help="顯示記錄檔摘要")
+    p.add_argument("input")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "info":
+        info(args)
+        return
+    cfg = MQTTConfig()
+    if args.cmd == "record":
+        record(args, cfg)
+        return
+
+    topics = cfg.get_topics()
+    host, port = cfg.get_broker_info()
+    host, port = args.host or host, args.port or port
+    args.connections = max(1, args.connections)
+    t = time.perf_counter()
+    messages = prepare(args.input, topics, args)
+    print(f"📦 預先編碼 {len(messages)} 則（×{max(1, args.clones)}），{time.perf_counter() - t:.2f}s")
+    if not messages:
+        sys.exit("⚠️ 記錄檔沒有可重播的訊息")
+    asyncio.run(replay(messages, host, port, topics, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+執行期剖析控制（不需重啟伺服器）
+- 訂閱控制主題 esp32/control/server（[topics] control + "/server"），指令為 JSON（或只有指令名稱的純文字）：
+    {"cmd": "profile", "mode": "sample"|"cprofile", "seconds": 10, "interval_ms": 10}
+    {"cmd": "profile_stop"}                          提前結束進行中的剖析
+    {"cmd": "tracemalloc_start", "frames": 10}
+    {"cmd": "tracemalloc_snapshot"}                  存一份快照並設為比較基準
+    {"cmd": "tracemalloc_diff", "top": 20}           與基準比較（之後以新快照為基準）
+    {"cmd": "tracemalloc_stop"}
+    {"cmd": "stacks"}                                傾印所有執行緒的堆疊
+  可加 "target": "<名稱或 pid>" 只讓指定的行程執行（同一 broker 上有多個伺服器時）
+- 結果寫入 [server] profile_dir（檔名 <名稱>-<pid>-<時間>-<種類>），摘要以 JSON 發佈到 <控制主題>/result
+- 取樣剖析：背景執行緒每 interval_ms 讀取 sys._current_frames()，統計各函式的 self/累計樣本，
+  另輸出 flamegraph 使用的 folded stacks（.folded）；不掛 trace hook，對被剖析的執行緒幾乎無影響
+- cProfile：Python 3.12 起以 sys.monitoring 涵蓋所有執行緒；較舊版本只能剖析啟用它的執行緒，改用取樣剖析
+- 指令於單一背景執行緒依序執行（第一次收到指令時才建立），堆疊傾印、tracemalloc 快照與結果寫檔
+  不佔用 MQTT 網路執行緒
+- 未剖析時沒有 trace hook 或 tracemalloc，熱路徑不受影響
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# cProfile 於 3.12 起改用 sys.monitoring，可涵蓋所有執行緒
+CPROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+MAX_SECONDS = 600.0
+
+
+class _Sampler:
+    """以 sys._current_frames() 定期取樣所有執行緒堆疊的剖析器。"""
+
+    def __init__(self, interval_s):
+        self.interval = max(0.001, float(interval_s))
+        self.samples = 0         # 取樣次數
+        self.thread_samples = 0  # 取樣到的執行緒堆疊數（百分比的分母）
+        self.self_counts = Counter()   # 葉節點函式
+        self.total_counts = Counter()  # 出現在堆疊中的函式（每個樣本同一函式只計一次）
+        self.stacks = Counter()        # (執行緒名稱, folded stack)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        labels = {}  # code 物件 → 顯示名稱（避免每個樣本重新格式化）
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    stack.append(label)
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                self.thread_samples += 1
+                self.self_counts[stack[0]] += 1
+                for func in set(stack):
+                    self.total_counts[func] += 1
+                stack.reverse()
+                self.stacks[(names.get(ident, str(ident)), ";".join(stack))] += 1
+            self.samples += 1
+            del frames
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for (thread, stack), n in self.stacks.most_common():
+                f.write(f"{thread};{stack} {n}\n")
+
+    def summary(self, top=10):
+        """依 self 樣本排序的前 top 個函式（佔所有執行緒樣本的比例；閒置等待亦會出現）。"""
+        n = max(1, self.thread_samples)
+        return [f"{c / n:6.1%} self {t / n:6.1%} total  {func}"
+                for func, c in self.self_counts.most_common(top)
+                for t in (self.total_counts[func],)]
+
+
+class ProfilerControl:
+    """處理控制主題指令並管理剖析狀態；publish(topic, body) 由宿主提供（MQTT client 或伺服器出口）。"""
+
+    def __init__(self, publish, name, control_topic="esp32/control/server", out_dir="profiles"):
+        self.publish = publish
+        self.name = name
+        self.topic = control_topic
+        self.result_topic = f"{control_topic}/result"
+        self.out_dir = out_dir
+        self._lock = threading.Lock()
+        self._session = None   # 進行中的剖析：dict(mode, profiler, timer, started)
+        self._baseline = None  # tracemalloc 比較基準
+        self._executor = None  # 執行指令的背景執行緒（依序處理）
+
+    def handle(self, payload: bytes):
+        """控制主題的訊息處理器（於 MQTT 網路執行緒呼叫，只解析指令並交給背景執行緒，不阻塞）。"""
+        try:
+            text = payload.decode('utf-8').strip()
+            cmd = json.loads(text) if text.startswith('{') else {"cmd": text}
+        except (UnicodeDecodeError, ValueError) as e:
+            print(f"⚠️ 控制指令解析失敗: {e}")
+            return
+        target = cmd.get("target")
+        if target and str(target) not in (self.name, str(os.getpid())):
+            return
+        name = cmd.get("cmd", "")
+        handler = {
+            "profile": self._start_profile,
+            "profile_stop": self._stop_profile,
+            "tracemalloc_start": self._tracemalloc_start,
+            "tracemalloc_snapshot": self._tracemalloc_snapshot,
+            "tracemalloc_diff": self._tracemalloc_diff,
+            "tracemalloc_stop": self._tracemalloc_stop,
+            "stacks": self._dump_stacks,
+        }.get(name)
+        if handler is None:
+            self._reply(name, ok=False, error="未知的指令")
+            return
+        print(f"🔬 控制指令: {name}")
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profiler-cmd")
+            executor = self._executor
+        executor.submit(self._run, name, handler, cmd)
+
+    def _run(self, name, handler, cmd):
+        try:
+            handler(cmd)
+        except Exception as e:
+            print(f"⚠️ 控制指令 {name} 執行錯誤: {e}")
+            self._reply(name, ok=False, error=str(e))
+
+    def shutdown(self):
+        """停止背景執行緒（等待進行中的指令完成）；進行中的剖析會先結束並寫出結果。"""
+        with self._lock:
+            session = self._session
+            executor, self._executor = self._executor, None
+        if session is not None:
+            session["timer"].cancel()
+            self._finish_profile()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    # 剖析
+    def _start_profile(self, cmd):
+        seconds = min(MAX_SECONDS, max(0.1, float(cmd.get("seconds", 10))))
+        mode = cmd.get("mode", "sample")
+        note = None
+        if mode == "cprofile" and not CPROFILE_ALL_THREADS:
+            mode, note = "sample", "Python < 3.12 的 cProfile 只涵蓋單一執行緒，改用取樣剖析"
+        with self._lock:
+            if self._session is not None:
+                self._reply("profile", ok=False, error=f"已有進行中的剖析（{self._session['mode']}）")
+                return
+            if mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                profiler = _Sampler(float(cmd.get("interval_ms", 10)) / 1000.0)
+                profiler.start()
+            timer = threading.Timer(seconds, self._finish_profile)
+            timer.daemon = True
+            self._session = {"mode": mode, "profiler": profiler, "timer": timer,
+                             "started": time.monotonic(), "note": note}
+            timer.start()
+        self._reply("profile", mode=mode, seconds=seconds, status="started", note=note)
+
+    def _stop_profile(self, cmd):
+        with self._lock:
+            session = self._session
+        if session is None:
+            self._reply("profile_stop", ok=False, error="沒有進行中的剖析")
+            return
+        session["timer"].cancel()
+        self._finish_profile()
+
+    def _finish_profile(self):
+        with self._lock:
+            session, self._session = self._session, None
+        if session is None:
+            return
+        profiler, mode = session["profiler"], session["mode"]
+        elapsed = round(time.monotonic() - session["started"], 3)
+        if mode == "cprofile":
+            profiler.disable()
+            path = self._path("cprofile", "prof")
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(10)
+            summary = [line for line in out.getvalue().splitlines() if line.strip()][-10:]
+        else:
+            profiler.stop()
+            path = self._path("sample", "folded")
+            profiler.write(path)
+            summary = profiler.summary()
+        print(f"🔬 剖析完成（{mode}，{elapsed}s）: {path}")
+        extra = {"samples": profiler.samples} if mode == "sample" else {}
+        self._reply("profile", mode=mode, seconds=elapsed, file=path, summary=summary,
+                    note=session["note"], **extra)
+
+    # tracemalloc
+    def _tracemalloc_start(self, cmd):
+        frames = max(1, int(cmd.get("frames", 10)))
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = tracemalloc.take_snapshot()
+        self._reply("tracemalloc_start", frames=tracemalloc.get_traceback_limit())
+
+    def _tracemalloc_snapshot(self, cmd):
+        snapshot = self._take_snapshot()
+        path = self._path("tracemalloc", "snap")
+        snapshot.dump(path)
+        self._baseline = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        top = snapshot.statistics("lineno")[:int(cmd.get("top", 10))]
+        self._reply("tracemalloc_snapshot", file=path, current_b=current, peak_b=peak,
+                    summary=[str(s) for s in top])
+
+    def _tracemalloc_diff(self, cmd):
+        if self._baseline is None:
+            raise RuntimeError("尚無比較基準，請先 tracemalloc_start 或 tracemalloc_snapshot")
+        snapshot = self._take_snapshot()
+        stats = snapshot.compare_to(self._baseline, "lineno")
+        path = self._path("tracemalloc-diff", "txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            for s in stats:
+                f.write(f"{s}\n")
+        self._baseline = snapshot
+        top = int(cmd.get("top", 10))
+        self._reply("tracemalloc_diff", file=path, summary=[str(s) for s in stats[:top]],
+                    size_diff_b=sum(s.size_diff for s in stats))
+
+    def _tracemalloc_stop(self, cmd):
+        tracemalloc.stop()
+        self._baseline = None
+        self._reply("tracemalloc_stop")
+
+    def _take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc 未啟動，請先送 tracemalloc_start")
+        # 排除 tracemalloc 自身的配置
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    # 堆疊
+    def _dump_stacks(self, cmd):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        path = self._path("stacks", "txt")
+        summary = []
+        with open(path, 'w', encoding='utf-8') as f:
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                stack = traceback.extract_stack(frame)
+                f.write(f"--- {name} ({ident})\n")
+                f.write("".join(traceback.format_list(stack)))
+                top = stack[-1] if stack else None
+                summary.append(f"{name}: {top.name} ({os.path.basename(top.filename)}:{top.lineno})" if top else name)
+        self._reply("stacks", file=path, threads=len(summary), summary=summary)
+
+    def _path(self, kind, ext):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return os.path.abspath(os.path.join(self.out_dir, f"{self.name}-{os.getpid()}-{stamp}-{kind}.{ext}"))
+
+    def _reply(self, cmd, ok=True, **fields):
+        body = {"server": self.name, "pid": os.getpid(), "cmd": cmd, "ok": ok,
+                **{k: v for k, v in fields.items() if v is not None}}
+        try:
+            self.publish(self.result_topic, json.dumps(body, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            print(f"⚠️ 控制結果發佈失敗: {e}")
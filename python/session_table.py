@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+有上限的 session 表
+- 每筆資料有自己的 TTL，以雜湊時間輪（hashed timer wheel）排程到期，插入/刪除/到期皆為 O(1)
+- 存取時只更新到期時間（lazy），輪到舊槽位時才搬到新槽位，不需重排
+- 超過 max_size 時以 LRU 淘汰最久未存取的項目
+- 淘汰時呼叫 on_evict(key, value, reason)，reason 為 "ttl" 或 "lru"（於鎖外呼叫）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ("value", "deadline", "slot")
+
+    def __init__(self, value, deadline, slot):
+        self.value = value
+        self.deadline = deadline
+        self.slot = slot
+
+
+class SessionTable:
+    """具 TTL 與 LRU 上限的執行緒安全字典。"""
+
+    def __init__(self, factory=dict, ttl_s=30.0, max_size=10000, on_evict=None,
+                 tick_s=1.0, slots=64, clock=time.monotonic):
+        self.factory = factory
+        self.ttl = float(ttl_s)
+        self.max_size = max(1, int(max_size))
+        self.on_evict = on_evict
+        self.tick = float(tick_s)
+        self.clock = clock
+        self._data = OrderedDict()  # key → _Entry；順序即 LRU 順序
+        self._wheel = [set() for _ in range(max(2, int(slots)))]
+        self._cursor = int(clock() // self.tick)  # 已處理到的 tick
+        self._lock = threading.Lock()
+        # 統計
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        """目前所有 key 的快照（LRU 順序，最久未存取者在前）。"""
+        with self._lock:
+            return list(self._data)
+
+    def get(self, key, default=None):
+        """讀取但不更新存取時間。"""
+        entry = self._data.get(key)
+        return entry.value if entry is not None else default
+
+    def get_or_create(self, key, ttl_s=None):
+        """取得（不存在則以 factory 建立）並更新存取時間與到期時間。"""
+        evicted = []
+        with self._lock:
+            now = self.clock()
+            deadline = now + (self.ttl if ttl_s is None else float(ttl_s))
+            entry = self._data.get(key)
+            if entry is None:
+                entry = _Entry(self.factory(), deadline, None)
+                self._data[key] = entry
+                self._schedule(key, entry)
+                if len(self._data) > self.max_size:
+                    evicted.append(self._evict_lru())
+            else:
+                entry.deadline = deadline
+                self._data.move_to_end(key)
+            value = entry.value
+        self._notify(evicted)
+        return value
+
+    def set(self, key, value, ttl_s=None):
+        evicted = []
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._wheel[old.slot].discard(key)
+            deadline = self.clock() + (self.ttl if ttl_s is None else float(ttl_s))
+            entry = _Entry(value, deadline, None)
+            self._data[key] = entry
+            self._schedule(key, entry)
+            if len(self._data) > self.max_size:
+                evicted.append(self._evict_lru())
+        self._notify(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._wheel[entry.slot].discard(key)
+            return entry.value
+
+    def expire(self, now=None):
+        """推進時間輪並淘汰到期項目；回傳淘汰筆數。"""
+        evicted = []
+        with self._lock:
+            now = self.clock() if now is None else now
+            target = int(now // self.tick)
+            n = len(self._wheel)
+            # 間隔超過一圈時每個槽位只需看一次
+            start = max(self._cursor + 1, target - n + 1)
+            for tick in range(start, target + 1):
+                slot = self._wheel[tick % n]
+                if not slot:
+                    continue
+                for key in list(slot):
+                    entry = self._data[key]
+                    if entry.deadline <= now:
+                        slot.discard(key)
+                        del self._data[key]
+                        self.evicted_ttl += 1
+                        evicted.append((key, entry.value, "ttl"))
+                    else:
+                        # 期間被存取過：搬到新的到期槽位
+                        slot.discard(key)
+                        self._schedule(key, entry, base_tick=tick)
+            self._cursor = max(self._cursor, target)
+        self._notify(evicted)
+        return len(evicted)
+
+    def _schedule(self, key, entry, base_tick=None):
+        """依 deadline 放入槽位；超出一圈者先放最遠槽位，輪到時再重新排程。"""
+        n = len(self._wheel)
+        base = self._cursor if base_tick is None else base_tick
+        tick = int(entry.deadline // self.tick)
+        tick = min(max(tick, base + 1), base + n - 1)
+        entry.slot = tick % n
+        self._wheel[entry.slot].add(key)
+
+    def _evict_lru(self):
+        key, entry = self._data.popitem(last=False)
+        self._wheel[entry.slot].discard(key)
+        self.evicted_lru += 1
+        return (key, entry.value, "lru")
+
+    def _notify(self, evicted):
+        if self.on_evict is None:
+            return
+        for key, value, reason in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                print(f"⚠️ session 淘汰回呼錯誤 {key}: {e}")
+
+
+class RecentKeys:
+    """近期見過的鍵（兩代輪替的雜湊集合），用於無 session 狀態時的重送去重。
+
+    - 只保存鍵的 hash，判斷與加入皆為 O(1)；碰撞機率約 n²/2⁶⁴，可忽略
+    - 目前這代滿 capacity 筆即整代輪替、丟棄最舊一代，因此至少記得最近 capacity 筆
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = max(1, int(capacity))
+        self._cur = set()
+        self._old = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cur) + len(self._old)
+
+    def seen(self, key) -> bool:
+        """已見過回傳 True；否則記錄並回傳 False。"""
+        h = hash(key)
+        with self._lock:
+            if h in self._cur or h in self._old:
+                return True
+            self._cur.add(h)
+            if len(self._cur) >= self.capacity:
+                self._old = self._cur
+                self._cur = set()
+        return False
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常駐關鍵詞偵測的串流模式
+- 所有裝置共用一個預配置的 [max_devices, W, F] 環狀緩衝，每裝置保留最後 W 幀
+- 每收到 H 幀對該裝置的視窗推論一次（視窗以兩段切片交給模型，不組新陣列）
+- 後驗機率以指數移動平均平滑（每次更新 O(1)），平滑分數越過門檻才發佈，命中後進入冷卻期
+- 無模型時以每幀能量（0..1）當作單一類別的分數，同樣做平滑與門檻判斷
+- 超過 max_devices 時回收最久未活動的裝置槽位
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class StreamBank:
+    """多裝置滑動視窗狀態（全部以預配置陣列保存）。"""
+
+    def __init__(self, bins, window=49, hop=10, max_devices=2048, labels=("yes",),
+                 alpha=0.5, threshold=0.8, refractory_ms=1000):
+        self.bins = int(bins)
+        self.window = int(window)
+        self.hop = max(1, int(hop))
+        self.max_devices = int(max_devices)
+        self.labels = tuple(labels)
+        self.alpha = float(alpha)
+        self.threshold = float(threshold)
+        self.refractory = float(refractory_ms) / 1000.0
+        # 以 "_" 開頭的類別（_silence_/_unknown_）不觸發
+        self.targets = np.array([i for i, name in enumerate(self.labels) if not name.startswith("_")], dtype=np.intp)
+
+        D, W, F, K = self.max_devices, self.window, self.bins, len(self.labels)
+        self.ring = np.zeros((D, W, F), dtype=np.float32)
+        self.pos = np.zeros(D, dtype=np.int32)
+        self.filled = np.zeros(D, dtype=np.int32)
+        self.since = np.zeros(D, dtype=np.int32)
+        self.ema = np.zeros((D, K), dtype=np.float32)
+        self.last_hit = np.full(D, -1e18)
+        self._slots = OrderedDict()  # device → slot（LRU 順序）
+        self._free = list(range(D - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def slot(self, device):
+        """取得裝置槽位；新裝置配置槽位並重置狀態，滿載時回收最久未活動者。"""
+        with self._lock:
+            s = self._slots.get(device)
+            if s is not None:
+                self._slots.move_to_end(device)
+                return s
+            if self._free:
+                s = self._free.pop()
+            else:
+                _, s = self._slots.popitem(last=False)
+            self._slots[device] = s
+        self.ring[s] = 0.0
+        self.pos[s] = 0
+        self.filled[s] = 0
+        self.since[s] = 0
+        self.ema[s] = 0.0
+        self.last_hit[s] = -1e18
+        return s
+
+    def push(self, s, rows) -> bool:
+        """寫入 [t, F] 幀；回傳是否已累積 H 幀且視窗已滿（該做推論）。"""
+        W = self.window
+        t = rows.shape[0]
+        if t > W:
+            rows, t = rows[-W:], W
+        p = int(self.pos[s])
+        first = min(t, W - p)
+        self.ring[s, p:p + first] = rows[:first]
+        if t > first:
+            self.ring[s, :t - first] = rows[first:t]
+        self.pos[s] = (p + t) % W
+        self.filled[s] = min(W, int(self.filled[s]) + t)
+        self.since[s] += t
+        if self.since[s] >= self.hop and self.filled[s] >= W:
+            self.since[s] = 0
+            return True
+        return False
+
+    def recent(self, s, t):
+        """回傳最近寫入的 t 幀（依時間順序，最多兩段可就地修改的切片）。"""
+        W = self.window
+        p = int(self.pos[s])
+        start = p - min(int(t), W)
+        if start >= 0:
+            return [self.ring[s, start:p]]
+        return [self.ring[s, W + start:], self.ring[s, :p]]
+
+    def window_blocks(self, s):
+        """依時間順序回傳視窗的兩段切片（最舊在前），供模型直接讀取。"""
+        p = int(self.pos[s])
+        return [self.ring[s, p:], self.ring[s, :p]]
+
+    def update(self, s, probs, now=None):
+        """以 EMA 平滑後驗；越過門檻且不在冷卻期時回傳 (label, score)，否則 None。"""
+        ema = self.ema[s]
+        ema *= (1.0 - self.alpha)
+        ema += self.alpha * np.asarray(probs, dtype=np.float32)
+        if not len(self.targets):
+            return None
+        k = int(self.targets[ema[self.targets].argmax()])
+        score = float(ema[k])
+        if score < self.threshold:
+            return None
+        now = time.monotonic() if now is None else now
+        if now - self.last_hit[s] < self.refractory:
+            return None
+        self.last_hit[s] = now
+        return self.labels[k], score
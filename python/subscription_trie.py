@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MQTT 訂閱樹（topic trie）
+- 每個主題層一個節點，'+' 與 '#' 為特殊子節點；比對一則 PUBLISH 只沿主題的各層往下走，
+  成本與主題層數及命中的萬用字元分支有關，與訂閱總數無關
+- 'a/#' 同時符合 'a' 本身（MQTT 3.1.1 §4.7.1.2）；'$' 開頭的主題不符合第一層的 '+' / '#'（§4.7.2）
+- 共享訂閱 $share/<group>/<filter> 以 filter 放入樹中，節點另記錄 {完整 $share 主題: 成員}，
+  由呼叫端（broker）依一致性雜湊挑選成員
+"""
+
+
+class _Node:
+    __slots__ = ("children", "clients", "shared")
+
+    def __init__(self):
+        self.children = {}  # 層名稱（含 '+'、'#'）→ _Node
+        self.clients = set()
+        self.shared = {}    # '$share/<group>/<filter>' → set of client_ids
+
+
+class SubscriptionTrie:
+    """以主題層為節點的訂閱索引；非執行緒安全（由 broker 事件迴圈獨佔）。"""
+
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, topic_filter, client_id, share_key=None):
+        """加入訂閱；share_key 為完整的 $share/... 主題（共享訂閱時）。"""
+        node = self.root
+        for level in topic_filter.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        if share_key is None:
+            node.clients.add(client_id)
+        else:
+            node.shared.setdefault(share_key, set()).add(client_id)
+
+    def remove(self, topic_filter, client_id, share_key=None):
+        """移除訂閱，並清掉不再有訂閱的節點。"""
+        path = [self.root]
+        levels = topic_filter.split('/')
+        for level in levels:
+            child = path[-1].children.get(level)
+            if child is None:
+                return
+            path.append(child)
+        node = path[-1]
+        if share_key is None:
+            node.clients.discard(client_id)
+        else:
+            members = node.shared.get(share_key)
+            if members is not None:
+                members.discard(client_id)
+                if not members:
+                    del node.shared[share_key]
+        for i in range(len(levels), 0, -1):
+            node = path[i]
+            if node.clients or node.shared or node.children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+
+    def match(self, topic):
+        """回傳 (一般訂閱者 set, [(share_key, 成員 set)])。"""
+        clients = set()
+        shared = []
+
+        def collect(node):
+            if node.clients:
+                clients.update(node.clients)
+            if node.shared:
+                shared.extend(node.shared.items())
+
+        levels = topic.split('/')
+        nodes = [self.root]
+        system = topic.startswith('$')
+        for depth, level in enumerate(levels):
+            following = []
+            for node in nodes:
+                children = node.children
+                if not children:
+                    continue
+                if not (system and depth == 0):
+                    wild = children.get('#')
+                    if wild is not None:
+                        collect(wild)
+                    plus = children.get('+')
+                    if plus is not None:
+                        following.append(plus)
+                child = children.get(level)
+                if child is not None:
+                    following.append(child)
+            nodes = following
+            if not nodes:
+                return clients, shared
+        for node in nodes:
+            collect(node)
+            # 'a/#' 也符合 'a'
+            wild = node.children.get('#')
+            if wild is not None:
+                collect(wild)
+        return clients, shared
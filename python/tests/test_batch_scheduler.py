@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MicroBatcher / ReplyCoalescer 單元測試（batch_scheduler.py）
+- 正常批次逐筆回呼；推論失敗時改以 fallback 回呼，每筆 session 都有結果
+- 合併回覆的 pending() 只計尚未送出的結果（湊滿先送的批次不再計入）
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from batch_scheduler import MicroBatcher, ReplyCoalescer  # noqa: E402
+
+
+class EchoModel:
+    def infer_batch(self, batch):
+        return [{"result": f"r{feats}"} for feats in batch]
+
+
+class FailingModel:
+    def infer_batch(self, batch):
+        raise RuntimeError("boom")
+
+
+class MicroBatcherTest(unittest.TestCase):
+    def run_batch(self, model, items):
+        results = {}
+        done = threading.Event()
+
+        def on_result(key, result):
+            results[key] = result
+            if len(results) == len(items):
+                done.set()
+
+        batcher = MicroBatcher(model, on_result, max_batch=4, max_delay_ms=1.0).start()
+        for key, feats, fallback in items:
+            batcher.submit(key, feats, fallback=fallback)
+        done.wait(2.0)
+        batcher.stop()
+        return batcher, results
+
+    def test_results(self):
+        _, results = self.run_batch(EchoModel(), [(i, i, None) for i in range(6)])
+        self.assertEqual(results, {i: {"result": f"r{i}"} for i in range(6)})
+
+    def test_failure_uses_fallback(self):
+        items = [(i, i, {"result": "energy", "i": i}) for i in range(6)]
+        batcher, results = self.run_batch(FailingModel(), items)
+        self.assertEqual(results, {i: {"result": "energy", "i": i} for i in range(6)})
+        self.assertGreaterEqual(batcher.errors, 2)
+        self.assertEqual(batcher.pending(), 0)
+
+
+class ReplyCoalescerTest(unittest.TestCase):
+    def test_pending_counts_live_results(self):
+        sent = []
+        replies = ReplyCoalescer(lambda device, batch: sent.append((device, list(batch))), window_ms=1000.0, max_items=3)
+        for i in range(3):
+            replies.submit("d1", i)  # 第 3 筆湊滿立即送出
+        self.assertEqual(sent, [("d1", [0, 1, 2])])
+        self.assertEqual(replies.pending(), 0)
+        replies.submit("d1", 3)
+        replies.submit("d2", 4)
+        self.assertEqual(replies.pending(), 2)
+        self.assertEqual(replies.flush_due(float("inf")), 2)
+        self.assertEqual(replies.pending(), 0)
+        self.assertEqual(sent[1:], [("d1", [3]), ("d2", [4])])
+
+
+if __name__ == "__main__":
+    unittest.main()
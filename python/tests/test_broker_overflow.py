@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+broker 輸出佇列溢位政策的單元測試（mqtt_broker_core.py）
+- 以 socketpair 模擬不讀取的慢速訂閱者，不啟動事件迴圈，直接呼叫 _send / _flush_pending / _write
+- drop_qos0：只丟棄轉發的 PUBLISH，控制封包照常送達，收到的訊息完整且依序
+- disconnect：佇列滿即中斷連線
+- spill：超出佇列的封包寫入暫存檔，全部依序、完整讀回；暫存超過上限即中斷；
+  消化速度跟得上卻一直沒讀完的訂閱者，暫存檔大小仍不超過上限
+- 單一封包就超過佇列上限時同樣依政策處理
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import selectors
+import socket
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mqtt_broker_core import PUBLISH, MQTTBrokerCore, MQTTFramer, _Conn, encode_publish  # noqa: E402
+
+QUEUE_BYTES = 64 * 1024
+PINGRESP = b"\xd0\x00"
+
+
+class OverflowTest(unittest.TestCase):
+    def make_core(self, policy, **kwargs):
+        core = MQTTBrokerCore(on_event=lambda kind, data: None, verbose=False, out_queue_bytes=QUEUE_BYTES,
+                              overflow_policy=policy, **kwargs)
+        core._selector = selectors.DefaultSelector()
+        self.addCleanup(core._selector.close)
+        server, client = socket.socketpair()
+        self.addCleanup(server.close)
+        self.addCleanup(client.close)
+        # 縮小 socket 緩衝區，讓輸出佇列很快就滿
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16 * 1024)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+        server.setblocking(False)
+        conn = _Conn(server, ("127.0.0.1", 0))
+        conn.client_id = "slow"
+        core._selector.register(server, selectors.EVENT_READ, conn)
+        self.client = client
+        return core, conn
+
+    @staticmethod
+    def payload(i):
+        return struct.pack(">I", i) + bytes([i % 251]) * 1020
+
+    def publish(self, core, conn, count):
+        for i in range(count):
+            core._send(conn, encode_publish("t/x", self.payload(i)), droppable=True)
+            if i % 16 == 15:
+                core._flush_pending()
+        core._flush_pending()
+
+    def read_some(self, core, conn, framer, nbytes):
+        """client 端讀取約 nbytes 位元組（慢速訂閱者），期間讓 broker 繼續寫。"""
+        received = []
+        got = 0
+        self.client.setblocking(False)
+        while got < nbytes:
+            if not conn.closed and conn.outbuf:
+                core._write(conn)
+            try:
+                data = self.client.recv(min(1 << 16, nbytes - got))
+            except BlockingIOError:
+                break
+            got += len(data)
+            received += [(t, bytes(body)) for t, _, body in framer.feed(data)]
+        return received
+
+    def drain(self, core, conn, framer=None):
+        """讀出 client 端收到的所有封包；每次讀完都讓 broker 繼續寫（相當於 EVENT_WRITE）。"""
+        framer = framer or MQTTFramer()
+        received = []
+        self.client.settimeout(0.2)
+        while True:
+            if not conn.closed and conn.outbuf:
+                core._write(conn)
+            try:
+                data = self.client.recv(1 << 16)
+            except socket.timeout:
+                break
+            if not data:
+                break
+            received += [(t, bytes(body)) for t, _, body in framer.feed(data)]
+        return received
+
+    def payloads(self, received):
+        out = []
+        for msg_type, body in received:
+            if msg_type == PUBLISH:
+                topic_len = struct.unpack(">H", body[:2])[0]
+                out.append(body[2 + topic_len:])
+        return out
+
+    def assert_intact_and_ordered(self, payloads):
+        indexes = [struct.unpack(">I", p[:4])[0] for p in payloads]
+        self.assertEqual(indexes, sorted(indexes))
+        for i, p in zip(indexes, payloads):
+            self.assertEqual(p, self.payload(i))
+        return indexes
+
+    def test_drop_qos0(self):
+        core, conn = self.make_core("drop_qos0")
+        self.publish(core, conn, 500)
+        self.assertLessEqual(conn.outbytes, QUEUE_BYTES + 2)
+        self.assertGreater(conn.dropped, 0)
+        core._send(conn, PINGRESP)  # 控制封包不丟棄
+        core._flush_pending()
+        received = self.drain(core, conn)
+        self.assertFalse(conn.closed)
+        indexes = self.assert_intact_and_ordered(self.payloads(received))
+        self.assertEqual(len(indexes) + conn.dropped, 500)
+        self.assertEqual(core.stats['dropped_messages'], conn.dropped)
+        self.assertEqual(received[-1][0], PINGRESP[0] >> 4)
+        self.assertEqual(conn.outbytes, 0)
+
+    def test_disconnect(self):
+        core, conn = self.make_core("disconnect")
+        self.publish(core, conn, 500)
+        self.assertTrue(conn.closed)
+        self.assertEqual(conn.outbytes, 0)
+        self.assertEqual(core.stats['overflow_disconnects'], 1)
+        self.assertEqual(core.stats['dropped_messages'], 0)
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            core, conn = self.make_core("spill", spill_dir=spill_dir)
+            self.publish(core, conn, 500)
+            self.assertIsNotNone(conn.spill)
+            self.assertLessEqual(conn.outbytes, QUEUE_BYTES)
+            self.assertGreater(core._queued(conn), conn.outbytes)
+            received = self.drain(core, conn)
+            self.assertFalse(conn.closed)
+            self.assertEqual(self.assert_intact_and_ordered(self.payloads(received)), list(range(500)))
+            self.assertIsNone(conn.spill)
+            self.assertEqual(core._queued(conn), 0)
+            self.assertEqual(core.stats['dropped_messages'], 0)
+
+    def test_spill_limit_disconnects(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            core, conn = self.make_core("spill", spill_dir=spill_dir, spill_max_bytes=QUEUE_BYTES)
+            self.publish(core, conn, 500)
+            self.assertTrue(conn.closed)
+            self.assertIsNone(conn.spill)
+            self.assertEqual(core.stats['overflow_disconnects'], 1)
+
+    def test_spill_file_bounded_for_slow_reader(self):
+        spill_max = 1 << 20
+        with tempfile.TemporaryDirectory() as spill_dir:
+            core, conn = self.make_core("spill", spill_dir=spill_dir, spill_max_bytes=spill_max)
+            framer = MQTTFramer()
+            self.publish(core, conn, 300)
+            received = []
+            total = 300
+            # 每輪寫入約 40 KB、讀出約 45 KB：佇列與暫存檔一直有資料，暫存檔從未讀完關閉
+            for _ in range(200):
+                for _ in range(40):
+                    core._send(conn, encode_publish("t/x", self.payload(total)), droppable=True)
+                    total += 1
+                core._flush_pending()
+                received += self.read_some(core, conn, framer, 45 * 1024)
+                self.assertFalse(conn.closed)
+                self.assertLessEqual(conn.spill_size, spill_max)
+                if conn.spill is not None:
+                    self.assertLessEqual(os.fstat(conn.spill.fileno()).st_size, spill_max)
+            received += self.drain(core, conn, framer)
+            self.assertEqual(self.assert_intact_and_ordered(self.payloads(received)), list(range(total)))
+            self.assertEqual(core.stats['overflow_disconnects'], 0)
+
+    def test_oversized_packet_follows_policy(self):
+        big = encode_publish("t/x", bytes(2 * QUEUE_BYTES))
+        core, conn = self.make_core("drop_qos0")
+        core._send(conn, big, droppable=True)
+        self.assertEqual((conn.dropped, conn.outbytes), (1, 0))
+        core._send(conn, PINGRESP)
+        self.assertEqual(conn.outbytes, len(PINGRESP))
+        core, conn = self.make_core("disconnect")
+        core._send(conn, big, droppable=True)
+        self.assertTrue(conn.closed)
+        self.assertEqual(core.stats['overflow_disconnects'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OnlineCMVN 單元測試（cmvn.py）
+- 統計等同對所有幀一次計算的均值/變異數（decay = 1）
+- 附列遮罩時只併入實際收到的列，補零的列正規化後仍為 0
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cmvn import OnlineCMVN  # noqa: E402
+from frame_buffer import FramePool, SessionFrames  # noqa: E402
+
+
+class OnlineCMVNTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.rows = (rng.standard_normal((12, 4)) * 2.0 + 5.0).astype(np.float32)
+
+    def test_stats_match_batch(self):
+        cmvn = OnlineCMVN(4, decay=1.0)
+        cmvn.apply("d", [self.rows[:5].copy()])
+        cmvn.apply("d", [self.rows[5:].copy()])
+        weight, mean, var = cmvn.stats("d")
+        self.assertEqual(weight, 12)
+        np.testing.assert_allclose(mean, self.rows.mean(axis=0, dtype=np.float64), rtol=1e-6)
+        np.testing.assert_allclose(var, self.rows.var(axis=0, dtype=np.float64), rtol=1e-5)
+
+    def test_masked_rows_skip_stats(self):
+        block = self.rows.copy()
+        mask = np.ones(12, dtype=bool)
+        mask[[3, 7, 8]] = False
+        block[~mask] = 0.0  # 缺幀補零
+        cmvn = OnlineCMVN(4, decay=1.0)
+        cmvn.apply("d", [block], [mask])
+        weight, mean, var = cmvn.stats("d")
+        received = self.rows[mask]
+        self.assertEqual(weight, 9)
+        np.testing.assert_allclose(mean, received.mean(axis=0, dtype=np.float64), rtol=1e-6)
+        np.testing.assert_allclose(var, received.var(axis=0, dtype=np.float64), rtol=1e-5)
+        self.assertFalse(block[~mask].any())
+        np.testing.assert_allclose(block[mask].mean(axis=0), 0.0, atol=1e-5)
+
+    def test_session_frames_mask(self):
+        frames = SessionFrames(FramePool(max_rows=16), 4, 2)
+        for idx in (0, 2, 3):
+            frames.put(idx, self.rows[idx * 2:idx * 2 + 2])
+        self.assertEqual(frames.present_rows(4).tolist(), [True, True, False, False, True, True, True, True])
+        frames.put(1, self.rows[2:4])
+        self.assertIsNone(frames.present_rows(4))
+        frames.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
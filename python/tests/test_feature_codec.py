@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+特徵幀與推論回覆編解碼的單元測試（feature_codec.py）
+- Binary v1 與 JSON 特徵幀解析出相同的 meta 與資料
+- 回覆 Binary v1 的往返與錯誤處理
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import base64
+import json
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from feature_codec import (FRAME_HEADER, decode_frame, decode_results, encode_binary_frame,  # noqa: E402
+                           encode_results, is_binary_frame)
+
+META = {"ts": 1700000000123, "sr": 16000, "feat": "mfcc", "shape": [2, 3], "win_ms": 25, "hop_ms": 10}
+
+
+class FrameCodecTest(unittest.TestCase):
+    def test_binary_round_trip(self):
+        raw = struct.pack('<6f', *range(6))
+        payload = encode_binary_frame(raw, (2, 3), META["ts"], sr=16000, feat="mfcc", quant="f32")
+        self.assertTrue(is_binary_frame(payload))
+        self.assertEqual(len(payload), FRAME_HEADER.size + len(raw))
+        meta, body = decode_frame(payload)
+        self.assertEqual(meta, dict(META, q="f32"))
+        self.assertIsInstance(body, memoryview)
+        self.assertEqual(bytes(body), raw)
+
+    def test_json_frame(self):
+        raw = bytes(range(6))
+        payload = json.dumps(dict(META, q="u8", data=base64.b64encode(raw).decode())).encode()
+        self.assertFalse(is_binary_frame(payload))
+        meta, body = decode_frame(payload)
+        self.assertEqual(meta, dict(META, q="u8"))
+        self.assertEqual(body, raw)
+
+    def test_invalid_frames(self):
+        with self.assertRaises(ValueError):
+            encode_binary_frame(b"", (0, 0), 0, quant="f16")
+        payload = bytearray(encode_binary_frame(b"\x00", (1, 1), 0))
+        payload[2] = 9  # 版本
+        with self.assertRaises(ValueError):
+            decode_frame(bytes(payload))
+        payload[2], payload[3] = 1, 7  # 量化代碼
+        with self.assertRaises(ValueError):
+            decode_frame(bytes(payload))
+
+
+class ResultCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        results = [
+            {"ts": 1, "session": "s1", "frames": 6, "missing": 0, "result": "yes", "conf": 0.75,
+             "latency_ms": 1.5, "mode": "session"},
+            {"ts": 2, "session": "會話", "frames": 49, "missing": 2, "result": "no", "conf": 0.5,
+             "latency_ms": 0.25, "mode": "stream"},
+        ]
+        self.assertEqual(decode_results(encode_results(results)), results)
+
+    def test_limits(self):
+        decoded = decode_results(encode_results([{"frames": 70000, "session": "x" * 300}]))[0]
+        self.assertEqual((decoded["frames"], len(decoded["session"])), (0xFFFF, 255))
+        with self.assertRaises(ValueError):
+            encode_results([{}] * 256)
+        with self.assertRaises(ValueError):
+            decode_results(b"EF\x01\x00")
+
+
+if __name__ == "__main__":
+    unittest.main()
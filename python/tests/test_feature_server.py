@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FeatureServer 決策流程的單元測試（feature_server.py）
+- 注入假的 MQTT client 並改寫 [server] 設定，不連線 broker
+- 過載丟棄部分幀的 session 仍會決策，回覆的 missing 反映被丟棄的幀
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import feature_server  # noqa: E402
+from feature_simulator import encode_binary_payload  # noqa: E402
+
+FRAME = encode_binary_payload(bytes([200] * 40), (1, 40))
+
+
+class FakeClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload))
+
+
+class Msg:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def make_server(workers=0, **overrides):
+    """以預設設定加上 overrides 建立 FeatureServer（config.ini 建立於暫存目錄）。"""
+    get_server_config = feature_server.MQTTConfig.get_server_config
+
+    def server_config(self):
+        cfg = get_server_config(self)
+        cfg.update(model='energy', log_messages=False, reply_mode='single', reply_format='json', **overrides)
+        return cfg
+
+    with mock.patch.object(feature_server.MQTTConfig, 'get_server_config', server_config):
+        return feature_server.FeatureServer(client=FakeClient(), workers=workers)
+
+
+class FeatureServerTest(unittest.TestCase):
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        os.chdir(tmp.name)
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, cwd)
+
+    def replies(self, server):
+        return [json.loads(payload) for _, payload in server.client.published]
+
+    def test_session_reply(self):
+        server = make_server()
+        for i in range(6):
+            server.on_message(None, None, Msg(f"esp32/feat/d/s/{i}", FRAME))
+        self.assertEqual([(r["session"], r["frames"], r["missing"]) for r in self.replies(server)], [("s", 6, 0)])
+
+    def test_shed_frames_reported_as_missing(self):
+        server = make_server(workers=1, ingress_queue=2, shed_policy='drop_oldest', shed_budget_ms=60000.0)
+        gate = threading.Event()
+        handler = server.pool.handler
+
+        def gated(*item):
+            gate.wait()
+            handler(*item)
+
+        server.pool.handler = gated
+        server.pool.start()
+        self.addCleanup(server.pool.stop)
+        self.addCleanup(gate.set)
+        # worker 卡在第一則訊息：A 的 #0、#1 入列，#2～#4 因佇列滿被丟棄，#5 為收尾幀
+        server.on_message(None, None, Msg("esp32/feat/warm/w/0", FRAME))
+        deadline = time.monotonic() + 2.0
+        while server._pool_depth() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for i in range(6):
+            server.on_message(None, None, Msg(f"esp32/feat/d/A/{i}", FRAME))
+        self.assertEqual(server.m_shed.labels("full").value, 3)
+        gate.set()
+        deadline = time.monotonic() + 2.0
+        while not server.client.published and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([(r["session"], r["frames"], r["missing"]) for r in self.replies(server)], [("A", 3, 3)])
+        self.assertNotIn(("d", "A"), server.session_acc)
+
+    def test_shed_session_flushed_on_expiry(self):
+        server = make_server(session_flush_on_expire=False)
+        for i in range(2):
+            server.on_message(None, None, Msg(f"esp32/feat/d/s/{i}", FRAME))
+        server._handle_shed(b"1", "d", "s")  # 未湊滿：2 幀收到、1 幀丟棄
+        self.assertEqual(self.replies(server), [])
+        acc = server.session_acc.pop(("d", "s"))
+        server._on_session_evicted(("d", "s"), acc, "ttl")
+        self.assertEqual([(r["frames"], r["missing"]) for r in self.replies(server)], [(2, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
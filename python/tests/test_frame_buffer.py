@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FramePool / SessionFrames 單元測試（frame_buffer.py）
+- 亂序到達依 idx 還原順序，缺幀補零並計數，重複與超出容量的幀略過
+- bins 在 session 中途改變時拋出 ValueError，且該幀不算已收到
+- 釋放的緩衝區由 pool 依 bins 回收重用
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from frame_buffer import FramePool, SessionFrames  # noqa: E402
+
+
+def rows(idx, n=2, bins=3):
+    return np.full((n, bins), idx + 1, dtype=np.float32)
+
+
+class SessionFramesTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = FramePool(max_rows=8)
+
+    def test_out_of_order_and_gaps(self):
+        frames = SessionFrames(self.pool, 3, 2)
+        self.assertEqual(frames.max_msgs, 4)
+        for idx in (2, 0):
+            self.assertTrue(frames.put(idx, rows(idx)))
+        self.assertEqual((frames.received, frames.high, frames.missing()), (2, 3, 1))
+        self.assertEqual(frames.missing(expect=4), 2)
+        frames.buf[2:4] = 99.0  # 前一個 session 殘留的資料
+        tensor = frames.tensor()
+        self.assertEqual(tensor[:, 0].tolist(), [1, 1, 0, 0, 3, 3])
+
+    def test_duplicate_and_overflow(self):
+        frames = SessionFrames(self.pool, 3, 2)
+        self.assertTrue(frames.put(1, rows(1)))
+        self.assertTrue(frames.seen(1))
+        self.assertFalse(frames.put(1, rows(1)))
+        self.assertFalse(frames.put(4, rows(4)))
+        self.assertFalse(frames.put(-1, rows(0)))
+        self.assertEqual((frames.received, frames.duplicates, frames.overflow), (1, 1, 2))
+
+    def test_short_frame_zero_padded(self):
+        frames = SessionFrames(self.pool, 3, 2)
+        frames.buf[:] = 99.0
+        frames.put(0, rows(0, n=1))
+        self.assertEqual(frames.tensor()[:, 0].tolist(), [1, 0])
+
+    def test_bins_change_rejected_before_marking(self):
+        frames = SessionFrames(self.pool, 3, 2)
+        frames.put(0, rows(0))
+        with self.assertRaises(ValueError):
+            frames.put(1, rows(1, bins=4))
+        self.assertFalse(frames.seen(1))
+        self.assertEqual((frames.received, frames.high), (1, 1))
+        self.assertTrue(frames.put(1, rows(1)))  # 之後同一 idx 的正確幀仍可寫入
+
+    def test_bitmap_only(self):
+        frames = SessionFrames(self.pool, 0, 1)
+        self.assertIsNone(frames.buf)
+        self.assertTrue(frames.put(3))
+        self.assertEqual((frames.received, frames.missing()), (1, 3))
+        self.assertIsNone(frames.tensor())
+
+    def test_pool_reuses_buffers(self):
+        frames = SessionFrames(self.pool, 3, 2)
+        buf = frames.buf
+        frames.release()
+        self.assertIsNone(frames.buf)
+        self.assertIs(SessionFrames(self.pool, 3, 2).buf, buf)
+        self.assertIsNot(SessionFrames(self.pool, 3, 2).buf, buf)
+        self.assertEqual(SessionFrames(self.pool, 5, 2).buf.shape, (8, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IngressQueue / LoadShedder 單元測試（ingress_queue.py）
+- 收尾幀提前時，同 session 已入列的幀一併提前且順序不變，之後不會被 drop_oldest 擠出
+- 被丟棄的幀仍計入 session 的幀數（收尾幀照常判斷），丟棄數取出一次後歸零
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ingress_queue import IngressQueue, LoadShedder  # noqa: E402
+
+
+def drain(q):
+    out = []
+    while q.qsize():
+        out.append(q.get())
+    return out
+
+
+class IngressQueueTest(unittest.TestCase):
+    def test_urgent_first(self):
+        q = IngressQueue(4)
+        q.offer("n1")
+        q.offer("u1", urgent=True)
+        q.offer("n2")
+        self.assertEqual(drain(q), ["u1", "n1", "n2"])
+
+    def test_capacity_and_eviction(self):
+        q = IngressQueue(2)
+        self.assertEqual(q.offer("a"), (True, None))
+        self.assertEqual(q.offer("b"), (True, None))
+        self.assertEqual(q.offer("c"), (False, None))
+        self.assertEqual(q.offer("c", evict_after=0.0), (True, "a"))
+        self.assertEqual(q.offer("u", urgent=True), (True, None))  # 優先項目不受上限限制
+        self.assertEqual(drain(q), ["u", "b", "c"])
+
+    def test_final_frame_promotes_its_session(self):
+        q = IngressQueue(4)
+        for i in range(3):
+            q.offer(("A", i), group="A")
+        q.offer(("B", 0), group="B")
+        q.offer(("A", 3), urgent=True, group="A")
+        self.assertEqual(q.qsize(), 5)
+        # 一般佇列只剩 B 的 1 幀：B 的後續幀可入列，且擠出時只會擠出 B 的幀
+        for i in range(1, 5):
+            accepted, evicted = q.offer(("B", i), evict_after=0.0, group="B")
+            self.assertTrue(accepted)
+            self.assertTrue(evicted is None or evicted[0] == "B", evicted)
+        self.assertEqual(drain(q)[:4], [("A", 0), ("A", 1), ("A", 2), ("A", 3)])
+
+    def test_promoted_slots_are_skipped(self):
+        q = IngressQueue(3)
+        q.offer(("A", 0), group="A")
+        q.offer(("B", 0), group="B")
+        q.offer(("A", 1), group="A")
+        q.offer(("A", 2), urgent=True, group="A")
+        self.assertEqual(q.offer(("C", 0), group="C"), (True, None))
+        self.assertEqual(q.offer(("C", 1), group="C"), (True, None))
+        self.assertEqual(q.offer(("C", 2), evict_after=0.0, group="C"), (True, ("B", 0)))
+        self.assertEqual(drain(q), [("A", 0), ("A", 1), ("A", 2), ("C", 0), ("C", 1), ("C", 2)])
+        self.assertEqual(q._groups, {})
+
+    def test_stalled_worker_session_still_completes(self):
+        # worker 停住：A 的 4 幀湊滿 session，之後 B 的幀以 drop_oldest 持續擠壓佇列
+        shedder = LoadShedder(4, policy="drop_oldest", budget_ms=0, frames_to_decide=4)
+        q = IngressQueue(4)
+        for key, n in (("A", 4), ("B", 6)):
+            for i in range(n):
+                urgent, reason = shedder.classify(key, q.qsize())
+                self.assertIsNone(reason)
+                accepted, evicted = q.offer((key, i), urgent, shedder.evict_after, group=key)
+                self.assertTrue(accepted)
+                if evicted is not None:
+                    self.assertEqual(evicted[0], "B")
+                    shedder.shed(evicted[0])
+        items = drain(q)
+        self.assertEqual([i for k, i in items if k == "A"], [0, 1, 2, 3])
+        self.assertEqual(items[:4], [("A", 0), ("A", 1), ("A", 2), ("A", 3)])
+
+
+class LoadShedderTest(unittest.TestCase):
+    def test_shed_frames_count_toward_closing_frame(self):
+        shedder = LoadShedder(4, frames_to_decide=4)
+        key = ("d", "s")
+        for _ in range(2):
+            self.assertEqual(shedder.classify(key, 0), (False, None))
+        shedder.shed(key)  # 第 2 幀入列失敗
+        self.assertEqual(shedder.take_shed(key), 1)
+        self.assertEqual(shedder.take_shed(key), 0)
+        self.assertEqual(shedder.classify(key, 0), (False, None))
+        shedder.shed(key)
+        self.assertEqual(shedder.classify(key, 0), (True, None))  # 第 4 幀仍為收尾幀
+        self.assertEqual(shedder.take_shed(key), 1)
+
+    def test_shed_closing_frame_is_reported_later(self):
+        shedder = LoadShedder(4, frames_to_decide=2)
+        key = ("d", "s")
+        shedder.classify(key, 0)
+        self.assertEqual(shedder.classify(key, 0), (True, None))
+        shedder.shed(key)  # 收尾幀入列失敗（process 模式）：留待重送
+        self.assertEqual(shedder.unreported_keys(), [key])
+        self.assertEqual(shedder.take_shed(key), 1)
+        self.assertEqual(shedder.unreported_keys(), [])
+
+    def test_new_session_rejected_until_below_watermark(self):
+        shedder = LoadShedder(4, policy="drop_new_sessions", watermark=0.5, frames_to_decide=4)
+        key = ("d", "s")
+        self.assertEqual(shedder.classify(key, 2), (False, "new_session"))
+        self.assertEqual(shedder.classify(key, 2), (False, "new_session"))
+        self.assertEqual(shedder.classify(("d", "old"), 0), (False, None))
+        self.assertEqual(shedder.classify(("d", "old"), 2), (False, None))  # 進行中的 session 照常
+        self.assertEqual(shedder.classify(key, 0), (False, None))
+        self.assertEqual(shedder.take_shed(key), 2)
+        self.assertEqual(shedder.classify(key, 2), (True, None))
+
+    def test_fully_rejected_session_is_not_reported(self):
+        shedder = LoadShedder(4, policy="drop_new_sessions", watermark=0.5, frames_to_decide=2)
+        key = ("d", "s")
+        for _ in range(2):
+            self.assertEqual(shedder.classify(key, 2), (False, "new_session"))
+        self.assertEqual(shedder.unreported_keys(), [])
+        self.assertEqual(shedder.take_shed(key), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
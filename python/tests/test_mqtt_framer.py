@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MQTTFramer 單元測試（mqtt_broker_core.py）
+- 任意切分的 recv 資料都要切出相同的封包
+- 跨 recv 的大封包之後緊接短封包的尾端，不可因沿用舊的所需長度而卡住
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mqtt_broker_core import MAX_PACKET, MQTTFramer, encode_publish  # noqa: E402
+
+PINGREQ = b"\xc0\x00"
+
+
+def packets(results):
+    return [(t, f, bytes(body)) for t, f, body in results]
+
+
+class MQTTFramerTest(unittest.TestCase):
+    def setUp(self):
+        # 1 位元組、2 位元組剩餘長度的 PUBLISH，加上控制封包
+        self.stream = b"".join((encode_publish("a/b", b"x" * 10), PINGREQ,
+                                encode_publish("esp32/feat/d/s/0", bytes(range(256)) * 2), PINGREQ))
+        self.expected = packets(MQTTFramer().feed(self.stream))
+
+    def test_whole_stream(self):
+        self.assertEqual([t for t, _, _ in self.expected], [3, 12, 3, 12])
+        self.assertEqual(self.expected[2][2][:2], b"\x00\x10")
+
+    def test_every_split_point(self):
+        for cut in range(1, len(self.stream)):
+            f = MQTTFramer()
+            got = packets(f.feed(self.stream[:cut])) + packets(f.feed(self.stream[cut:]))
+            self.assertEqual(got, self.expected, cut)
+            self.assertEqual(f.pending(), 0)
+
+    def test_byte_by_byte(self):
+        f = MQTTFramer()
+        got = []
+        for i in range(len(self.stream)):
+            got += packets(f.feed(self.stream[i:i + 1]))
+        self.assertEqual(got, self.expected)
+
+    def test_short_tail_after_split_packet(self):
+        # 308 位元組的 PUBLISH 分兩次到達，第二次尾端多 1 位元組的 PINGREQ 開頭
+        publish = encode_publish("t/x", bytes(300))
+        f = MQTTFramer()
+        self.assertEqual(f.feed(publish[:100]), [])
+        self.assertEqual(len(f.feed(publish[100:] + PINGREQ[:1])), 1)
+        self.assertEqual(packets(f.feed(PINGREQ[1:])), [(12, 0, b"")])
+        self.assertEqual(packets(f.feed(PINGREQ)), [(12, 0, b"")])
+        self.assertEqual(f.pending(), 0)
+
+    def test_incomplete_length_after_split_packet(self):
+        big = encode_publish("t/x", bytes(1000))
+        small = encode_publish("t/y", bytes(200))  # 剩餘長度 2 位元組
+        f = MQTTFramer()
+        f.feed(big[:10])
+        self.assertEqual(len(f.feed(big[10:] + small[:2])), 1)
+        self.assertEqual(len(f.feed(small[2:])), 1)
+
+    def test_oversized_packet(self):
+        f = MQTTFramer(max_packet=100)
+        with self.assertRaises(ValueError):
+            f.feed(encode_publish("t", bytes(200)))
+        with self.assertRaises(ValueError):
+            MQTTFramer().feed(b"\x30\xff\xff\xff\xff\x01")
+        self.assertEqual(MQTTFramer().max_packet, MAX_PACKET)
+
+
+if __name__ == "__main__":
+    unittest.main()
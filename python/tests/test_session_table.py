@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SessionTable / RecentKeys 單元測試（session_table.py）
+- 以假時鐘驗證 TTL 到期、存取延長期限、LRU 上限與淘汰回呼
+- RecentKeys 至少記得最近 capacity 個鍵
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from session_table import RecentKeys, SessionTable  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionTableTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.evicted = []
+        self.table = SessionTable(factory=list, ttl_s=5.0, max_size=3, clock=self.clock, slots=8,
+                                  on_evict=lambda key, value, reason: self.evicted.append((key, reason)))
+
+    def test_ttl_expiry(self):
+        self.table.get_or_create("a").append(1)
+        self.clock.now += 4.0
+        self.assertEqual(self.table.expire(), 0)
+        self.clock.now += 2.0
+        self.assertEqual(self.table.expire(), 1)
+        self.assertEqual(self.evicted, [("a", "ttl")])
+        self.assertNotIn("a", self.table)
+
+    def test_access_extends_deadline(self):
+        self.table.get_or_create("a")
+        self.clock.now += 4.0
+        self.table.get_or_create("a")
+        self.clock.now += 4.0
+        self.assertEqual(self.table.expire(), 0)
+        self.clock.now += 2.0
+        self.assertEqual(self.table.expire(), 1)
+
+    def test_ttl_longer_than_wheel(self):
+        self.table.set("a", 1, ttl_s=20.0)  # 超過一圈（8 個槽位）
+        for _ in range(19):
+            self.clock.now += 1.0
+            self.table.expire()
+        self.assertIn("a", self.table)
+        self.clock.now += 1.5
+        self.table.expire()
+        self.assertNotIn("a", self.table)
+
+    def test_lru_limit(self):
+        for key in "abc":
+            self.table.get_or_create(key)
+        self.table.get_or_create("a")  # a 變成最近存取
+        self.table.get_or_create("d")
+        self.assertEqual(self.evicted, [("b", "lru")])
+        self.assertEqual(self.table.keys(), ["c", "a", "d"])
+        self.assertEqual((self.table.evicted_lru, self.table.evicted_ttl), (1, 0))
+
+    def test_pop_and_get(self):
+        self.table.set("a", 1)
+        self.assertEqual(self.table.get("a"), 1)
+        self.assertEqual(self.table.pop("a"), 1)
+        self.assertIsNone(self.table.pop("a"))
+        self.clock.now += 10.0
+        self.assertEqual(self.table.expire(), 0)
+        self.assertEqual(self.evicted, [])
+
+
+class RecentKeysTest(unittest.TestCase):
+    def test_remembers_recent_keys(self):
+        recent = RecentKeys(capacity=4)
+        self.assertFalse(recent.seen(("d", "s", 0)))
+        self.assertTrue(recent.seen(("d", "s", 0)))
+        for i in range(1, 8):
+            recent.seen(i)
+        for i in range(4, 8):
+            self.assertTrue(recent.seen(i))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SubscriptionTrie 與 broker 轉發對象解析的單元測試（subscription_trie.py、mqtt_broker_core.py）
+- '+' / '#' / '$' 開頭主題 / $share 共享訂閱的比對
+- 訂閱變動時路由快取失效、快取大小上限
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mqtt_broker_core import MQTTBrokerCore  # noqa: E402
+from subscription_trie import SubscriptionTrie  # noqa: E402
+
+
+class SubscriptionTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = SubscriptionTrie()
+        for topic_filter, client in (("a/b/c", "exact"), ("a/+/c", "plus"), ("a/#", "hash"),
+                                     ("+/+/+", "three"), ("#", "all"), ("a/+", "a_plus")):
+            self.trie.add(topic_filter, client)
+
+    def clients(self, topic):
+        return self.trie.match(topic)[0]
+
+    def test_wildcards(self):
+        self.assertEqual(self.clients("a/b/c"), {"exact", "plus", "hash", "three", "all"})
+        self.assertEqual(self.clients("a/x/c"), {"plus", "hash", "three", "all"})
+        self.assertEqual(self.clients("a/b"), {"hash", "all", "a_plus"})
+        self.assertEqual(self.clients("a/b/c/d"), {"hash", "all"})
+        self.assertEqual(self.clients("b/c"), {"all"})
+
+    def test_hash_matches_parent_level(self):
+        self.assertEqual(self.clients("a"), {"hash", "all"})
+
+    def test_empty_levels(self):
+        self.trie.add("a//c", "empty")
+        self.assertIn("empty", self.clients("a//c"))
+        self.assertIn("plus", self.clients("a//c"))
+
+    def test_system_topics_skip_leading_wildcards(self):
+        self.assertEqual(self.clients("$SYS/x/y"), set())
+        self.trie.add("$SYS/#", "sys")
+        self.assertEqual(self.clients("$SYS/x/y"), {"sys"})
+
+    def test_remove_prunes_nodes(self):
+        self.trie.remove("a/b/c", "exact")
+        self.assertNotIn("exact", self.clients("a/b/c"))
+        self.assertNotIn("b", self.trie.root.children["a"].children)  # 空的 a/b、a/b/c 節點一併移除
+        self.trie.remove("a/b/c", "missing")  # 不存在的訂閱不報錯
+        self.trie.remove("x/y", "missing")
+
+    def test_shared(self):
+        trie = SubscriptionTrie()
+        trie.add("esp32/feat/+/+/+", "w1", share_key="$share/g/esp32/feat/+/+/+")
+        trie.add("esp32/feat/+/+/+", "w2", share_key="$share/g/esp32/feat/+/+/+")
+        trie.add("esp32/feat/#", "m")
+        clients, shared = trie.match("esp32/feat/d/s/0")
+        self.assertEqual(clients, {"m"})
+        self.assertEqual(shared, [("$share/g/esp32/feat/+/+/+", {"w1", "w2"})])
+        trie.remove("esp32/feat/+/+/+", "w1", share_key="$share/g/esp32/feat/+/+/+")
+        trie.remove("esp32/feat/+/+/+", "w2", share_key="$share/g/esp32/feat/+/+/+")
+        self.assertEqual(trie.match("esp32/feat/d/s/0"), ({"m"}, []))
+
+
+class ResolveTest(unittest.TestCase):
+    def setUp(self):
+        self.core = MQTTBrokerCore(verbose=False, route_cache_size=4)
+
+    def test_shared_group_picks_one_member(self):
+        for member in ("w1", "w2", "w3"):
+            self.core._subscribe(member, "$share/g/esp32/feat/+/+/+")
+        self.core._subscribe("m", "esp32/feat/#")
+        for s in range(20):
+            targets = set(self.core._resolve(f"esp32/feat/d/s{s}/0"))
+            self.assertIn("m", targets)
+            self.assertEqual(len(targets - {"m"}), 1)
+            # 同一 session 的各幀固定送給同一成員
+            self.assertEqual(targets, set(self.core._resolve(f"esp32/feat/d/s{s}/5")))
+
+    def test_cache_invalidated_on_subscription_change(self):
+        self.assertEqual(self.core._resolve("a/b"), ())
+        self.core._subscribe("c1", "a/+")
+        self.assertEqual(self.core._resolve("a/b"), ("c1",))
+        self.core._unsubscribe("c1", "a/+")
+        self.assertEqual(self.core._resolve("a/b"), ())
+
+    def test_cache_bounded(self):
+        self.core._subscribe("c1", "#")
+        for i in range(10):
+            self.core._resolve(f"t/{i}")
+        self.assertEqual(list(self.core._routes), [f"t/{i}" for i in range(6, 10)])
+
+
+if __name__ == "__main__":
+    unittest.main()
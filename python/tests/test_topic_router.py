@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TopicRouter 單元測試（topic_router.py）
+- 完全比對優先於欄位樣式；欄位依樣式順序以位置參數交給處理器
+- {name:int} 轉換失敗或層數不符時不符合，改試下一個樣式
+
+用法：
+    python -m unittest discover -s tests      （於 python/ 目錄）
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from topic_router import TopicRouter  # noqa: E402
+
+
+def info(payload):
+    return ("info", payload)
+
+
+def feature(payload, device, session, idx):
+    return ("feature", device, session, idx)
+
+
+def shed(payload, device, session):
+    return ("shed", device, session)
+
+
+def audio(payload, device, kind):
+    return ("audio", device, kind)
+
+
+class TopicRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = (TopicRouter()
+                       .add("esp32/feat/info", info)
+                       .add("esp32/feat/{device}/{session}/{idx:int}", feature)
+                       .add("esp32/feat/{device}/{session}/shed", shed)
+                       .add("esp32/{device}/audio/{kind}", audio))
+
+    def test_exact_before_patterns(self):
+        self.assertEqual(self.router.match("esp32/feat/info"), (info, ()))
+
+    def test_fields_and_int_conversion(self):
+        handler, fields = self.router.match("esp32/feat/d1/s1/12")
+        self.assertIs(handler, feature)
+        self.assertEqual(tuple(fields), ("d1", "s1", 12))
+
+    def test_int_failure_falls_through(self):
+        handler, fields = self.router.match("esp32/feat/d1/s1/shed")
+        self.assertIs(handler, shed)
+        self.assertEqual(tuple(fields), ("d1", "s1"))
+
+    def test_literal_between_fields(self):
+        handler, fields = self.router.match("esp32/d7/audio/pcm")
+        self.assertIs(handler, audio)
+        self.assertEqual(tuple(fields), ("d7", "pcm"))
+        self.assertIsNone(self.router.match("esp32/d7/video/pcm"))
+
+    def test_no_match(self):
+        for topic in ("esp32/feat/d1/s1", "esp32/feat/d1/s1/2/3", "other/feat/d1/s1/2", "esp32/feat/d1/s1/x"):
+            self.assertIsNone(self.router.match(topic), topic)
+
+    def test_dispatch(self):
+        calls = []
+        router = TopicRouter().add("t/{a}/{b:int}", lambda payload, a, b: calls.append((payload, a, b)))
+        self.assertTrue(router.dispatch("t/x/3", b"p"))
+        self.assertFalse(router.dispatch("t/x/y", b"p"))
+        self.assertEqual(calls, [(b"p", "x", 3)])
+
+    def test_invalid_patterns(self):
+        for pattern in ("a/{x:float}", "a/{x}/+", "a/{x}/b{y}"):
+            with self.assertRaises(ValueError):
+                TopicRouter().add(pattern, info)
+
+
+if __name__ == "__main__":
+    unittest.main()
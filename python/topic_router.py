@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+預先編譯的 MQTT 主題路由
+- 啟動時把設定中的主題樣式編譯一次，例如：
+    "esp32/feat/info"                           → 完全比對（dict 查表）
+    "esp32/feat/{device}/{session}/{idx:int}"   → 固定前綴 + 固定層數的欄位
+- 每則訊息只做一次 dict 查詢或 startswith + split，欄位依樣式順序以位置參數交給處理器：
+    handler(payload, *fields)
+- 支援的欄位轉換：{name}（字串）、{name:int}
+"""
+
+from operator import itemgetter
+
+_CONVERTERS = {"str": None, "int": int}
+
+
+class _Pattern:
+    __slots__ = ("pattern", "prefix", "plen", "levels", "literals", "ints", "pick", "handler", "names")
+
+    def __init__(self, pattern, handler):
+        parts = pattern.split('/')
+        first = next(i for i, p in enumerate(parts) if p.startswith('{'))
+        self.pattern = pattern
+        self.prefix = '/'.join(parts[:first]) + '/' if first else ''
+        self.plen = len(self.prefix)
+        rest = parts[first:]
+        self.levels = len(rest)
+        self.literals = []  # [(level, text)] 欄位之間的固定層
+        self.ints = []      # 需轉成 int 的層
+        self.names = []
+        fields = []
+        for level, part in enumerate(rest):
+            if part.startswith('{') and part.endswith('}'):
+                name, _, kind = part[1:-1].partition(':')
+                if kind and kind not in _CONVERTERS:
+                    raise ValueError(f"不支援的欄位型別: {part}")
+                self.names.append(name)
+                fields.append(level)
+                if _CONVERTERS.get(kind or "str") is int:
+                    self.ints.append(level)
+            elif part in ('+', '#') or '{' in part:
+                raise ValueError(f"無效的樣式層級: {part}")
+            else:
+                self.literals.append((level, part))
+        # 沒有夾在中間的固定層時，split 的結果本身就是欄位序列
+        if self.literals:
+            getter = itemgetter(*fields)
+            self.pick = (lambda rest: (getter(rest),)) if len(fields) == 1 else getter
+        else:
+            self.pick = tuple
+        self.handler = handler
+
+    def match(self, topic):
+        if not topic.startswith(self.prefix):
+            return None
+        rest = topic[self.plen:].split('/')
+        if len(rest) != self.levels:
+            return None
+        if self.literals:
+            for level, text in self.literals:
+                if rest[level] != text:
+                    return None
+        if self.ints:
+            try:
+                for level in self.ints:
+                    rest[level] = int(rest[level])
+            except ValueError:
+                return None
+        return self.pick(rest)
+
+
+class TopicRouter:
+    """依註冊順序比對主題；完全比對的主題優先於含欄位的樣式。"""
+
+    def __init__(self):
+        self._exact = {}
+        self._patterns = []
+
+    def add(self, pattern, handler):
+        if '{' in pattern:
+            self._patterns.append(_Pattern(pattern, handler))
+        else:
+            self._exact[pattern] = handler
+        return self
+
+    def match(self, topic):
+        """回傳 (handler, fields) 或 None。"""
+        handler = self._exact.get(topic)
+        if handler is not None:
+            return handler, ()
+        for p in self._patterns:
+            fields = p.match(topic)
+            if fields is not None:
+                return p.handler, fields
+        return None
+
+    def dispatch(self, topic, payload) -> bool:
+        """找到處理器則呼叫 handler(payload, *fields) 並回傳 True。"""
+        route = self.match(topic)
+        if route is None:
+            return False
+        handler, fields = route
+        handler(payload, *fields)
+        return True